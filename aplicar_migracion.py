@@ -176,8 +176,12 @@ def aplicar_migracion():
             except sqlite3.OperationalError as e:
                 print(f"  ⚠️  {e}")
         
-        # 4. Poblar modificadores de ejemplo
+        # 4. Poblar modificadores de ejemplo (precios en pesos)
         print("📋 Creando modificadores de ejemplo...")
+        # Desde la versión 1 del esquema (user_version) los importes se guardan en
+        # centavos; en una base anterior van en pesos y el servidor los convierte
+        # al arrancar (migrar_a_centavos en app.py)
+        en_centavos = cur.execute("PRAGMA user_version").fetchone()[0] >= 1
         modificadores = [
             ('Sin azúcar', 0),
             ('Extra shot café', 500),
@@ -191,7 +195,8 @@ def aplicar_migracion():
         
         for nombre, precio in modificadores:
             try:
-                cur.execute("INSERT INTO modifiers (nombre, precio_extra) VALUES (?, ?)", (nombre, precio))
+                cur.execute("INSERT INTO modifiers (nombre, precio_extra) VALUES (?, ?)",
+                            (nombre, precio * 100 if en_centavos else precio))
             except sqlite3.IntegrityError:
                 pass
         
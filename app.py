@@ -2,16 +2,82 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Body, Request, Header
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, Response
 from pydantic import BaseModel, Field, validator
-from typing import List, Optional, Dict
-from datetime import datetime, timedelta
-import sqlite3, json, os, io, csv, shutil, socket
+from typing import List, Optional, Dict, Callable, TypeVar
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal, ROUND_HALF_UP
+from contextlib import contextmanager, ExitStack, closing
+from concurrent.futures import Future
+import sqlite3, json, os, io, csv, shutil, socket, threading, time, asyncio, struct, uuid, queue, hashlib, bisect, heapq, re, unicodedata, zlib
 from pathlib import Path
+from email.utils import formatdate, parsedate_to_datetime
 
-DB = "mozo.db"
+DB = os.environ.get("MOZO_DB", "mozo.db")
 BACKUP_DIR = "backups"
+BACKUP_RETENCION_DIAS = 7
+BACKUP_REVISION_HORAS = float(os.environ.get("MOZO_BACKUP_HORAS", "1"))  # cada cuánto ver si falta el del día
+BACKUP_PAGINAS = 256         # páginas copiadas por paso de la API de backup
+BACKUP_PAUSA = 0.05          # segundos entre pasos para no frenar a las escrituras
+# "completo": una copia por día. "incremental": snapshot cada WAL_SNAPSHOT_DIAS + segmentos del WAL
+BACKUP_MODO = os.environ.get("MOZO_BACKUP_MODO", "completo")
+WAL_DIR = os.path.join(BACKUP_DIR, "wal")
+WAL_INTERVALO = float(os.environ.get("MOZO_WAL_SEGUNDOS", "60"))      # cada cuánto archivar el WAL
+WAL_SNAPSHOT_DIAS = int(os.environ.get("MOZO_WAL_SNAPSHOT_DIAS", "7"))  # días entre snapshots completos
 ADMIN_PIN = "1234"  # Cambia esto por tu PIN deseado
+CAMBIOS_RETENCION_DIAS = 2   # historial de cambios disponible para /orders/changes
+CAMBIOS_PURGA_SEGUNDOS = 3600  # cada cuánto se borra el historial vencido
+APAGADO_ESPERA = 10.0        # segundos que el apagado espera a cada hilo de fondo
+CAMBIOS_MAX_ORDENES = 500    # más órdenes cambiadas que esto => el cliente recarga todo
+ORDENES_LIMITE = 200         # órdenes por página en GET /orders
+ORDENES_LIMITE_MAX = 1000
+WS_COLA_MAX = 64             # mensajes pendientes por cliente antes de descartar
+WS_TIMEOUT_ENVIO = 5.0       # segundos para un send antes de dar al cliente por muerto
+TOPICOS_FIJOS = ("kitchen", "bar", "cashier", "admin")
+# Categorías que se preparan en la barra (topic "bar")
+CATEGORIAS_BAR = set(os.environ.get("MOZO_CATEGORIAS_BAR", "Bebidas Calientes,Bebidas Frías").split(","))
+
+# Pool de conexiones SQLite
+DB_POOL_SIZE = int(os.environ.get("MOZO_DB_POOL_SIZE", "8"))
+DB_BUSY_TIMEOUT = 5.0        # segundos esperando un lock de escritura
+DB_STATEMENT_CACHE = 256     # sentencias preparadas cacheadas por conexión
+# Escritor único: las mutaciones de los endpoints async se confirman en grupo
+ESCRITOR_VENTANA = float(os.environ.get("MOZO_ESCRITOR_VENTANA_MS", "0")) / 1000  # espera extra para juntar un lote
+ESCRITOR_LOTE_MAX = int(os.environ.get("MOZO_ESCRITOR_LOTE", "64"))               # comandos por commit
+
+# Perfiles de almacenamiento: PRAGMAs que se aplican a cada conexión
+PERFILES_DB = {
+    # WAL + NORMAL: los commits no hacen fsync (sólo los checkpoints) y lectores y
+    # escritor no se bloquean. Los checkpoints van en segundo plano, fuera de los requests
+    "equilibrado": {"journal_mode": "WAL", "synchronous": "NORMAL", "mmap_size": 256 * 2**20,
+                    "cache_size": -32000, "temp_store": "MEMORY", "wal_autocheckpoint": 0},
+    # Igual pero con fsync en cada commit: no se pierde la última transacción si se corta la luz
+    "seguro": {"journal_mode": "WAL", "synchronous": "FULL", "mmap_size": 256 * 2**20,
+               "cache_size": -32000, "temp_store": "MEMORY", "wal_autocheckpoint": 0},
+    # Para equipos con poca RAM: sin mmap, caché chica, checkpoints automáticos de SQLite
+    "liviano": {"journal_mode": "WAL", "synchronous": "NORMAL", "mmap_size": 0,
+                "cache_size": -2000, "temp_store": "DEFAULT", "wal_autocheckpoint": 1000},
+    # Valores por defecto de SQLite (journal de rollback); sólo para comparar en benchmark.py
+    "clasico": {"journal_mode": "DELETE", "synchronous": "FULL", "mmap_size": 0,
+                "cache_size": -2000, "temp_store": "DEFAULT", "wal_autocheckpoint": 1000},
+}
+PERFIL_DB = os.environ.get("MOZO_PERFIL", "equilibrado")
+CHECKPOINT_SEGUNDOS = float(os.environ.get("MOZO_CHECKPOINT_SEGUNDOS", "30"))
+CHECKPOINT_TRUNCAR_MB = 64   # WAL más grande que esto => checkpoint TRUNCATE
+
+EXPORT_LOTE = 1000           # filas por fetchmany al exportar
+PARQUET_DIR = os.environ.get("MOZO_PARQUET_DIR", "analytics")  # export columnar por día
+
+# Archivo histórico: las órdenes cerradas más viejas pasan a una base por mes
+ARCHIVO_DIR = os.environ.get("MOZO_ARCHIVO_DIR", "archivo")
+ARCHIVO_DIAS = int(os.environ.get("MOZO_ARCHIVO_DIAS", "0"))  # antigüedad para archivar (0 = no archivar)
+ARCHIVO_HORA = int(os.environ.get("MOZO_ARCHIVO_HORA", "6"))   # hora UTC de la corrida nocturna
+ARCHIVO_LOTE = 500           # órdenes movidas por transacción
+
+# Auditoría en segundo plano
+AUDIT_FLUSH_SEGUNDOS = float(os.environ.get("MOZO_AUDIT_FLUSH", "1.0"))  # espera máxima antes de escribir
+AUDIT_LOTE_MAX = int(os.environ.get("MOZO_AUDIT_LOTE", "200"))          # registros por transacción
+AUDIT_COLA_MAX = int(os.environ.get("MOZO_AUDIT_COLA", "5000"))         # pendientes antes de escribir en línea
 
 app = FastAPI(title="El Café de los Pinos")
 
@@ -53,172 +119,658 @@ def verify_admin_pin(payload: dict = Body(...)):
     raise HTTPException(401, "PIN incorrecto")
 
 
+# --- Pool de conexiones ---
+def aplicar_perfil(con: sqlite3.Connection, perfil: str = PERFIL_DB):
+    """Aplica los PRAGMAs del perfil de almacenamiento a una conexión"""
+    for pragma, valor in PERFILES_DB[perfil].items():
+        if pragma == "wal_autocheckpoint" and BACKUP_MODO == "incremental":
+            # Los checkpoints los hace el archivador del WAL, después de copiar los frames
+            valor = 0
+        con.execute(f"PRAGMA {pragma} = {valor}")
+
+class ConnectionPool:
+    """Pool fijo de conexiones SQLite de larga vida, con afinidad por hilo.
+
+    Cada conexión se abre y configura una sola vez (WAL, pragmas, caché de
+    sentencias). Un hilo que vuelve a pedir conexión recibe la misma que usó
+    la última vez si está libre, y las llamadas anidadas dentro del mismo
+    hilo reutilizan la conexión (y la transacción) del llamador.
+    """
+
+    def __init__(self, path: str, size: int, perfil: str = PERFIL_DB):
+        if perfil not in PERFILES_DB:
+            raise ValueError(f"Perfil de base desconocido: {perfil} (opciones: {', '.join(PERFILES_DB)})")
+        if BACKUP_MODO == "incremental" and PERFILES_DB[perfil]["journal_mode"] != "WAL":
+            raise ValueError(f"El backup incremental necesita un perfil con WAL (no {perfil})")
+        self.path = path
+        self.size = size
+        self.perfil = perfil
+        self._libres: List[sqlite3.Connection] = []
+        self._todas: List[sqlite3.Connection] = []
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        # Métricas
+        self.checkouts = 0
+        self.esperas = 0
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+
+    def _abrir(self) -> sqlite3.Connection:
+        con = sqlite3.connect(self.path, timeout=DB_BUSY_TIMEOUT, check_same_thread=False,
+                              cached_statements=DB_STATEMENT_CACHE)
+        con.row_factory = sqlite3.Row
+        con.execute("PRAGMA foreign_keys = ON")
+        aplicar_perfil(con, self.perfil)
+        return con
+
+    def acquire(self) -> sqlite3.Connection:
+        """Tomar una conexión del pool (bloquea si están todas en uso)"""
+        inicio = time.perf_counter()
+        preferida = getattr(self._local, "ultima", None)
+        nueva = False
+        with self._cond:
+            while True:
+                if preferida is not None and preferida in self._libres:
+                    self._libres.remove(preferida)
+                    con = preferida
+                    break
+                if self._libres:
+                    con = self._libres.pop()
+                    break
+                if len(self._todas) < self.size:
+                    con = self._abrir()
+                    self._todas.append(con)
+                    nueva = True
+                    break
+                self._cond.wait()
+            espera = time.perf_counter() - inicio
+            self.checkouts += 1
+            if espera > 0.001 and not nueva:
+                self.esperas += 1
+            self.espera_total += espera
+            self.espera_max = max(self.espera_max, espera)
+        self._local.ultima = con
+        return con
+
+    def release(self, con: sqlite3.Connection):
+        """Devolver una conexión al pool, descartando transacciones abiertas"""
+        if con.in_transaction:
+            con.rollback()
+        with self._cond:
+            self._libres.append(con)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Conexión del pool con commit al salir y rollback si hay excepción"""
+        actual = getattr(self._local, "actual", None)
+        if actual is not None:
+            # Llamada anidada: la transacción la cierra el llamador externo
+            yield actual
+            return
+        con = self.acquire()
+        self._local.actual = con
+        try:
+            yield con
+            con.commit()
+        finally:
+            self._local.actual = None
+            self.release(con)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "perfil": self.perfil,
+                "size": self.size,
+                "abiertas": len(self._todas),
+                "en_uso": len(self._todas) - len(self._libres),
+                "checkouts": self.checkouts,
+                "esperas": self.esperas,
+                "espera_promedio_ms": round(self.espera_total / self.checkouts * 1000, 3) if self.checkouts else 0,
+                "espera_max_ms": round(self.espera_max * 1000, 3),
+            }
+
+    def close(self):
+        with self._cond:
+            for con in self._todas:
+                con.close()
+            self._todas.clear()
+            self._libres.clear()
+
+pool = ConnectionPool(DB, DB_POOL_SIZE)
+
+# --- Checkpoints del WAL en segundo plano ---
+estado_checkpoint = {"corridas": 0, "truncados": 0, "ultimo": None, "ms": None, "error": None}
+_detener_checkpoints = threading.Event()
+
+def checkpoint_wal(modo: str = "PASSIVE") -> dict:
+    """Pasa el WAL a la base. PASSIVE no espera a nadie; TRUNCATE espera a los lectores y achica el archivo"""
+    inicio = time.perf_counter()
+    with db() as con:
+        ocupado, paginas_wal, copiadas = con.execute(f"PRAGMA wal_checkpoint({modo})").fetchone()
+    estado_checkpoint.update(ultimo={"modo": modo, "ocupado": ocupado, "paginas_wal": paginas_wal,
+                                     "copiadas": copiadas},
+                             ms=round((time.perf_counter() - inicio) * 1000, 2), error=None)
+    estado_checkpoint["corridas"] += 1
+    if modo == "TRUNCATE":
+        estado_checkpoint["truncados"] += 1
+    return estado_checkpoint["ultimo"]
+
+def programar_checkpoints():
+    """Hilo de fondo: checkpoint cada CHECKPOINT_SEGUNDOS, así ningún commit de un request lo paga"""
+    while not _detener_checkpoints.wait(CHECKPOINT_SEGUNDOS):
+        try:
+            wal = DB + "-wal"
+            grande = os.path.exists(wal) and os.path.getsize(wal) > CHECKPOINT_TRUNCAR_MB * 2**20
+            checkpoint_wal("TRUNCATE" if grande else "PASSIVE")
+        except Exception as e:
+            estado_checkpoint["error"] = str(e)
+            print(f"❌ Error en checkpoint: {e}")
+
+
 # --- DB helpers ---
 def db():
-    con = sqlite3.connect(DB)
-    con.row_factory = sqlite3.Row
-    con.execute("PRAGMA foreign_keys = ON")
-    return con
+    """Conexión del pool: usar siempre como `with db() as con:`"""
+    return pool.connection()
+
+T = TypeVar("T")
+
+class Escritor:
+    """Hilo único por el que pasan las mutaciones, con commit en grupo.
+
+    Cada comando es una función fn(con). El hilo toma todos los que se juntaron
+    en la cola mientras confirmaba el lote anterior (más los que lleguen dentro
+    de ESCRITOR_VENTANA, hasta ESCRITOR_LOTE_MAX), los corre uno detrás del otro en
+    una sola transacción IMMEDIATE, cada uno en su SAVEPOINT para que el error
+    de uno no deshaga a los demás, y confirma todo el lote con un solo commit.
+    Como nadie más compite por el lock de escritura desde los endpoints, no
+    aparecen los "database is locked" de varias conexiones peleando.
+    """
+
+    def __init__(self, ventana: float, lote_max: int):
+        self.ventana = ventana
+        self.lote_max = lote_max
+        self.cola: queue.Queue = queue.Queue()
+        self._hilo = None
+        self.metricas = {"comandos": 0, "lotes": 0, "lote_max": 0, "errores": 0, "commits_fallidos": 0,
+                         "espera_total": 0.0, "espera_max": 0.0}
+
+    def enviar(self, fn: Callable[[sqlite3.Connection], T]) -> Future:
+        """Encola fn(con); el Future se resuelve después del commit"""
+        futuro = Future()
+        if self._hilo is None:
+            # Sin hilo (scripts, antes del arranque): se ejecuta en el momento
+            self._confirmar([(fn, futuro, time.perf_counter())])
+        else:
+            self.cola.put((fn, futuro, time.perf_counter()))
+        return futuro
+
+    def _loop(self):
+        while True:
+            primero = self.cola.get()
+            if primero is None:
+                return
+            lote, limite = [primero], time.perf_counter() + self.ventana
+            while len(lote) < self.lote_max:
+                try:
+                    comando = self.cola.get(timeout=max(limite - time.perf_counter(), 0))
+                except queue.Empty:
+                    break
+                if comando is None:
+                    self._confirmar(lote)
+                    return
+                lote.append(comando)
+            self._confirmar(lote)
+
+    def _confirmar(self, lote: list):
+        resultados = []
+        try:
+            with db() as con:
+                con.execute("BEGIN IMMEDIATE")
+                for fn, futuro, encolado in lote:
+                    espera = time.perf_counter() - encolado
+                    self.metricas["espera_total"] += espera
+                    self.metricas["espera_max"] = max(self.metricas["espera_max"], espera)
+                    con.execute("SAVEPOINT comando")
+                    try:
+                        resultados.append((futuro, fn(con), None))
+                        con.execute("RELEASE comando")
+                    except Exception as e:
+                        con.execute("ROLLBACK TO comando")
+                        con.execute("RELEASE comando")
+                        resultados.append((futuro, None, e))
+                        self.metricas["errores"] += 1
+        except Exception as e:
+            # Falló el commit (o la transacción): ningún comando del lote quedó escrito
+            self.metricas["commits_fallidos"] += 1
+            for _, futuro, _ in lote:
+                futuro.set_exception(e)
+            return
+        self.metricas["comandos"] += len(lote)
+        self.metricas["lotes"] += 1
+        self.metricas["lote_max"] = max(self.metricas["lote_max"], len(lote))
+        for futuro, resultado, error in resultados:
+            if error is None:
+                futuro.set_result(resultado)
+            else:
+                futuro.set_exception(error)
+
+    def iniciar(self):
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._loop, name="escritor", daemon=True)
+            self._hilo.start()
+
+    def detener(self):
+        if self._hilo is not None:
+            self.cola.put(None)
+            self._hilo.join()
+            self._hilo = None
+            # Lo que llegó mientras se apagaba se escribe en línea
+            while not self.cola.empty():
+                comando = self.cola.get_nowait()
+                if comando is not None:
+                    self._confirmar([comando])
+
+    def stats(self) -> dict:
+        m = self.metricas
+        return {
+            "comandos": m["comandos"], "lotes": m["lotes"], "lote_max": m["lote_max"],
+            "lote_promedio": round(m["comandos"] / m["lotes"], 2) if m["lotes"] else 0,
+            "errores": m["errores"], "commits_fallidos": m["commits_fallidos"], "pendientes": self.cola.qsize(),
+            "espera_promedio_ms": round(m["espera_total"] / m["comandos"] * 1000, 3) if m["comandos"] else 0,
+            "espera_max_ms": round(m["espera_max"] * 1000, 3),
+        }
+
+escritor = Escritor(ESCRITOR_VENTANA, ESCRITOR_LOTE_MAX)
+
+async def en_db(fn: Callable[[sqlite3.Connection], T]) -> T:
+    """Manda fn(con) al escritor y espera el resultado sin frenar el event loop"""
+    return await asyncio.wrap_future(escritor.enviar(fn))
+
+SQL_AUDIT = """INSERT INTO audit_log(user_id, user_nombre, action, entity, entity_id, data_json, ip, created_at)
+               VALUES(?,?,?,?,?,?,?,?)"""
+
+class AuditWriter:
+    """Escribe audit_log por lotes desde un hilo propio.
+
+    Los endpoints encolan el registro (con su hora, para que created_at no
+    dependa de cuándo se escribe) recién cuando su cambio quedó confirmado,
+    así no queda auditada una operación que se revirtió. El hilo junta hasta
+    AUDIT_LOTE_MAX registros o espera AUDIT_FLUSH_SEGUNDOS y los inserta con
+    executemany en una sola transacción. Si la cola está llena el registro se
+    escribe en línea en el momento: se pierde velocidad, no datos.
+    """
+
+    def __init__(self, intervalo: float, lote_max: int, cola_max: int):
+        self.intervalo = intervalo
+        self.lote_max = lote_max
+        self.cola = queue.Queue(maxsize=cola_max)
+        self._escritura = threading.Lock()   # ordena lotes del hilo y flush() externos
+        self._hilo = None
+        self._detener = threading.Event()
+        self._despertar = threading.Event()
+        self.metricas = {"encolados": 0, "escritos": 0, "lotes": 0, "en_linea": 0, "errores": 0}
+
+    def registrar(self, fila: tuple):
+        try:
+            self.cola.put_nowait(fila)
+            self.metricas["encolados"] += 1
+            if self.cola.qsize() >= self.lote_max:
+                self._despertar.set()
+        except queue.Full:
+            self.metricas["en_linea"] += 1
+            with db() as con:
+                con.execute(SQL_AUDIT, fila)
+
+    def _tomar(self) -> list:
+        lote = []
+        while len(lote) < self.lote_max:
+            try:
+                lote.append(self.cola.get_nowait())
+            except queue.Empty:
+                break
+        return lote
+
+    def _escribir(self, lote: list):
+        if not lote:
+            return
+        try:
+            # Por el escritor, así el lote no compite por el lock con las comandas
+            escritor.enviar(lambda con: con.executemany(SQL_AUDIT, lote)).result()
+            self.metricas["escritos"] += len(lote)
+            self.metricas["lotes"] += 1
+        except Exception as e:
+            self.metricas["errores"] += 1
+            print(f"Error logging audit: {e}")
+
+    def _loop(self):
+        while not self._detener.is_set():
+            # Se despierta cada `intervalo` o antes si ya hay un lote completo
+            self._despertar.wait(self.intervalo)
+            self._despertar.clear()
+            self.flush()
+
+    def flush(self):
+        """Escribe ya todo lo pendiente (antes de leer audit_log o al apagar)"""
+        with self._escritura:
+            while not self.cola.empty():
+                self._escribir(self._tomar())
+
+    def iniciar(self):
+        if self._hilo is None:
+            self._detener.clear()
+            self._hilo = threading.Thread(target=self._loop, name="audit-writer", daemon=True)
+            self._hilo.start()
+
+    def detener(self):
+        if self._hilo is not None:
+            self._detener.set()
+            self._despertar.set()
+            self._hilo.join()
+            self._hilo = None
+        self.flush()
+
+    def stats(self) -> dict:
+        return {**self.metricas, "pendientes": self.cola.qsize(),
+                "flush_segundos": self.intervalo, "lote_max": self.lote_max}
+
+auditoria = AuditWriter(AUDIT_FLUSH_SEGUNDOS, AUDIT_LOTE_MAX, AUDIT_COLA_MAX)
 
 def log_audit(user_id=None, user_nombre=None, action=None, entity=None, entity_id=None, data=None, ip=None):
-    """Registrar acción en audit_log"""
+    """Registrar acción en audit_log (se escribe en segundo plano)"""
     try:
-        con = db()
-        cur = con.cursor()
-        cur.execute("""INSERT INTO audit_log(user_id, user_nombre, action, entity, entity_id, data_json, ip)
-                       VALUES(?,?,?,?,?,?,?)""",
-                    (user_id, user_nombre, action, entity, entity_id, json.dumps(data) if data else None, ip))
-        con.commit()
-        con.close()
+        auditoria.registrar((user_id, user_nombre, action, entity, entity_id,
+                             json.dumps(data) if data else None, ip,
+                             time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())))
     except Exception as e:
         print(f"Error logging audit: {e}")
 
-def init_db():
-    con = db(); cur = con.cursor()
-    
-    # Crear tablas base
-    cur.executescript("""
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        nombre TEXT NOT NULL,
-        rol TEXT NOT NULL,
-        pin TEXT,
-        activo INTEGER DEFAULT 1,
-        created_at TEXT DEFAULT (datetime('now')),
-        updated_at TEXT DEFAULT (datetime('now'))
-    );
-    
-    CREATE TABLE IF NOT EXISTS tables (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        nombre TEXT NOT NULL,
-        activo INTEGER DEFAULT 1,
-        created_at TEXT DEFAULT (datetime('now')),
-        updated_at TEXT DEFAULT (datetime('now'))
-    );
-    
-    CREATE TABLE IF NOT EXISTS categories (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        nombre TEXT NOT NULL UNIQUE,
-        orden INTEGER DEFAULT 0,
-        created_at TEXT DEFAULT (datetime('now')),
-        updated_at TEXT DEFAULT (datetime('now'))
-    );
-    
-    CREATE TABLE IF NOT EXISTS products (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        nombre TEXT NOT NULL,
-        precio REAL NOT NULL CHECK(precio >= 0),
-        category_id INTEGER,
-        activo INTEGER DEFAULT 1,
-        created_at TEXT DEFAULT (datetime('now')),
-        updated_at TEXT DEFAULT (datetime('now')),
-        FOREIGN KEY (category_id) REFERENCES categories(id) ON DELETE SET NULL
-    );
-    
-    CREATE TABLE IF NOT EXISTS orders (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        table_id INTEGER,
-        user_id INTEGER,
-        mozo_nombre TEXT,
-        subtotal REAL DEFAULT 0,
-        descuento_total REAL DEFAULT 0,
-        total REAL DEFAULT 0,
-        estado TEXT DEFAULT 'pendiente' CHECK(estado IN ('pendiente', 'listo', 'cobrado')),
-        anulada INTEGER DEFAULT 0,
-        pagado INTEGER DEFAULT 0,
-        ts TEXT DEFAULT (datetime('now')),
-        updated_at TEXT DEFAULT (datetime('now')),
-        FOREIGN KEY (table_id) REFERENCES tables(id),
-        FOREIGN KEY (user_id) REFERENCES users(id)
-    );
-    
-    CREATE TABLE IF NOT EXISTS order_items (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        order_id INTEGER NOT NULL,
-        product_id INTEGER,
-        product_nombre TEXT NOT NULL,
-        product_precio REAL DEFAULT 0,
-        cantidad INTEGER NOT NULL CHECK(cantidad > 0),
-        notas TEXT,
-        created_at TEXT DEFAULT (datetime('now')),
-        updated_at TEXT DEFAULT (datetime('now')),
-        FOREIGN KEY (order_id) REFERENCES orders(id) ON DELETE CASCADE,
-        FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE SET NULL
-    );
-    
-    CREATE TABLE IF NOT EXISTS modifiers (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        nombre TEXT NOT NULL,
-        precio_extra REAL DEFAULT 0,
-        activo INTEGER DEFAULT 1,
-        created_at TEXT DEFAULT (datetime('now')),
-        updated_at TEXT DEFAULT (datetime('now'))
-    );
-    
-    CREATE TABLE IF NOT EXISTS order_item_modifiers (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        order_item_id INTEGER NOT NULL,
-        modifier_id INTEGER,
-        modifier_nombre TEXT NOT NULL,
-        precio_extra REAL DEFAULT 0,
-        created_at TEXT DEFAULT (datetime('now')),
-        FOREIGN KEY (order_item_id) REFERENCES order_items(id) ON DELETE CASCADE,
-        FOREIGN KEY (modifier_id) REFERENCES modifiers(id) ON DELETE SET NULL
-    );
-    
-    CREATE TABLE IF NOT EXISTS discounts (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        order_id INTEGER NOT NULL,
-        tipo TEXT NOT NULL CHECK(tipo IN ('porcentaje', 'monto')),
-        valor REAL NOT NULL CHECK(valor >= 0),
-        motivo TEXT NOT NULL,
-        aplicado_por TEXT,
-        created_at TEXT DEFAULT (datetime('now')),
-        FOREIGN KEY (order_id) REFERENCES orders(id) ON DELETE CASCADE
-    );
-    
-    CREATE TABLE IF NOT EXISTS payments (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        order_id INTEGER NOT NULL,
-        metodo TEXT NOT NULL CHECK(metodo IN ('efectivo', 'debito', 'credito', 'qr', 'transferencia')),
-        monto REAL NOT NULL CHECK(monto >= 0),
-        created_at TEXT DEFAULT (datetime('now')),
-        FOREIGN KEY (order_id) REFERENCES orders(id) ON DELETE CASCADE
-    );
-    
-    CREATE TABLE IF NOT EXISTS audit_log (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER,
-        user_nombre TEXT,
-        action TEXT NOT NULL,
-        entity TEXT NOT NULL,
-        entity_id INTEGER,
-        data_json TEXT,
-        ip TEXT,
-        created_at TEXT DEFAULT (datetime('now'))
-    );
-    
-    CREATE TABLE IF NOT EXISTS notas_generales (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        contenido TEXT NOT NULL,
-        activo INTEGER DEFAULT 1,
-        ts TEXT DEFAULT (datetime('now')),
-        updated_at TEXT DEFAULT (datetime('now'))
-    );
-    """)
-    
-    # Crear índices
-    cur.executescript("""
-    CREATE INDEX IF NOT EXISTS idx_products_category ON products(category_id);
-    CREATE INDEX IF NOT EXISTS idx_products_nombre ON products(nombre);
-    CREATE INDEX IF NOT EXISTS idx_products_activo ON products(activo);
-    CREATE INDEX IF NOT EXISTS idx_orders_estado ON orders(estado);
-    CREATE INDEX IF NOT EXISTS idx_orders_date ON orders(DATE(ts));
-    CREATE INDEX IF NOT EXISTS idx_audit_entity ON audit_log(entity, entity_id);
-    """)
-    
+# Columnas con importes (centavos) o porcentajes (centésimos de punto) por tabla
+COLUMNAS_DINERO = {
+    "products": ["precio"],
+    "modifiers": ["precio_extra"],
+    "orders": ["subtotal", "descuento_pct", "descuento_fijo", "descuento_total", "total"],
+    "order_items": ["product_precio"],
+    "order_item_modifiers": ["precio_extra"],
+    "discounts": ["valor"],
+    "payments": ["monto"],
+    "daily_sales": ["total", "cobrado"],
+    "daily_table_sales": ["total"],
+    "daily_waiter_sales": ["total"],
+    "daily_product_sales": ["ingresos"],
+}
+
+def migrar_a_centavos(con):
+    """Pasa las columnas de dinero de REAL en pesos a INTEGER en centavos.
+
+    SQLite no cambia el tipo de una columna: cada tabla que todavía tiene
+    alguna en REAL se reconstruye (crear la nueva, copiar multiplicando por
+    100 y redondeando, borrar la vieja, renombrar), con las foreign keys
+    apagadas y todo en una transacción. Los índices los vuelve a crear init_db.
+    Sólo se revisan las foreign keys de las tablas reconstruidas, comparando
+    contra las violaciones que ya tenían antes: esas se informan, no frenan.
+    """
     con.commit()
-    con.close()
+    con.execute("PRAGMA foreign_keys = OFF")
+    try:
+        con.execute("BEGIN IMMEDIATE")
+        reconstruidas: Dict[str, int] = {}
+        for tabla, columnas in COLUMNAS_DINERO.items():
+            info = con.execute(f"PRAGMA table_info({tabla})").fetchall()
+            if not any(c["name"] in columnas and c["type"].upper() == "REAL" for c in info):
+                continue
+            sql = con.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (tabla,)).fetchone()[0]
+            for columna in columnas:
+                sql = re.sub(rf"\b{columna}\s+REAL\b", f"{columna} INTEGER", sql)
+            sql = re.sub(rf"^CREATE TABLE\s+\"?{tabla}\"?", f"CREATE TABLE _centavos_{tabla}", sql)
+            nombres = [c["name"] for c in info]
+            valores = [f"CAST(ROUND({n} * 100) AS INTEGER)" if n in columnas else n for n in nombres]
+            secuencia = con.execute("SELECT seq FROM sqlite_sequence WHERE name=?", (tabla,)).fetchone()
+            reconstruidas[tabla] = len(con.execute(f"PRAGMA foreign_key_check({tabla})").fetchall())
+            if reconstruidas[tabla]:
+                print(f"⚠️  {tabla}: {reconstruidas[tabla]} filas con foreign keys rotas desde antes de migrar")
+
+            con.execute(sql)
+            con.execute(f"INSERT INTO _centavos_{tabla}({', '.join(nombres)}) SELECT {', '.join(valores)} FROM {tabla}")
+            con.execute(f"DROP TABLE {tabla}")
+            con.execute(f"ALTER TABLE _centavos_{tabla} RENAME TO {tabla}")
+            if secuencia:
+                con.execute("UPDATE sqlite_sequence SET seq=? WHERE name=?", (secuencia[0], tabla))
+            print(f"💰 {tabla}: importes pasados a centavos")
+        for tabla, antes in reconstruidas.items():
+            if len(con.execute(f"PRAGMA foreign_key_check({tabla})").fetchall()) > antes:
+                raise RuntimeError(f"La migración a centavos dejó foreign keys rotas en {tabla}")
+        con.commit()
+        if reconstruidas:
+            print("   Totales redondeados por separado: revisar con python verificar_totales.py --reparar")
+    except Exception:
+        con.rollback()
+        raise
+    finally:
+        con.execute("PRAGMA foreign_keys = ON")
+
+def init_db():
+    with db() as con:
+        cur = con.cursor()
+
+        # Crear tablas base
+        cur.executescript("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nombre TEXT NOT NULL,
+            rol TEXT NOT NULL,
+            pin TEXT,
+            activo INTEGER DEFAULT 1,
+            created_at TEXT DEFAULT (datetime('now')),
+            updated_at TEXT DEFAULT (datetime('now'))
+        );
+
+        CREATE TABLE IF NOT EXISTS tables (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nombre TEXT NOT NULL,
+            activo INTEGER DEFAULT 1,
+            created_at TEXT DEFAULT (datetime('now')),
+            updated_at TEXT DEFAULT (datetime('now'))
+        );
+
+        CREATE TABLE IF NOT EXISTS categories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nombre TEXT NOT NULL UNIQUE,
+            orden INTEGER DEFAULT 0,
+            created_at TEXT DEFAULT (datetime('now')),
+            updated_at TEXT DEFAULT (datetime('now'))
+        );
+
+        CREATE TABLE IF NOT EXISTS products (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nombre TEXT NOT NULL,
+            precio INTEGER NOT NULL CHECK(precio >= 0),
+            category_id INTEGER,
+            activo INTEGER DEFAULT 1,
+            created_at TEXT DEFAULT (datetime('now')),
+            updated_at TEXT DEFAULT (datetime('now')),
+            FOREIGN KEY (category_id) REFERENCES categories(id) ON DELETE SET NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_id INTEGER,
+            user_id INTEGER,
+            mozo_nombre TEXT,
+            subtotal INTEGER DEFAULT 0,
+            descuento_pct INTEGER DEFAULT 0,
+            descuento_fijo INTEGER DEFAULT 0,
+            descuento_total INTEGER DEFAULT 0,
+            total INTEGER DEFAULT 0,
+            estado TEXT DEFAULT 'pendiente' CHECK(estado IN ('pendiente', 'listo', 'cobrado')),
+            anulada INTEGER DEFAULT 0,
+            pagado INTEGER DEFAULT 0,
+            ts TEXT DEFAULT (datetime('now')),
+            updated_at TEXT DEFAULT (datetime('now')),
+            FOREIGN KEY (table_id) REFERENCES tables(id),
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        );
+
+        CREATE TABLE IF NOT EXISTS order_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER NOT NULL,
+            product_id INTEGER,
+            product_nombre TEXT NOT NULL,
+            product_precio INTEGER DEFAULT 0,
+            cantidad INTEGER NOT NULL CHECK(cantidad > 0),
+            notas TEXT,
+            created_at TEXT DEFAULT (datetime('now')),
+            updated_at TEXT DEFAULT (datetime('now')),
+            FOREIGN KEY (order_id) REFERENCES orders(id) ON DELETE CASCADE,
+            FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE SET NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS modifiers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nombre TEXT NOT NULL,
+            precio_extra INTEGER DEFAULT 0,
+            activo INTEGER DEFAULT 1,
+            created_at TEXT DEFAULT (datetime('now')),
+            updated_at TEXT DEFAULT (datetime('now'))
+        );
+
+        CREATE TABLE IF NOT EXISTS order_item_modifiers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_item_id INTEGER NOT NULL,
+            modifier_id INTEGER,
+            modifier_nombre TEXT NOT NULL,
+            precio_extra INTEGER DEFAULT 0,
+            created_at TEXT DEFAULT (datetime('now')),
+            FOREIGN KEY (order_item_id) REFERENCES order_items(id) ON DELETE CASCADE,
+            FOREIGN KEY (modifier_id) REFERENCES modifiers(id) ON DELETE SET NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS discounts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER NOT NULL,
+            tipo TEXT NOT NULL CHECK(tipo IN ('porcentaje', 'monto')),
+            valor INTEGER NOT NULL CHECK(valor >= 0),
+            motivo TEXT NOT NULL,
+            aplicado_por TEXT,
+            created_at TEXT DEFAULT (datetime('now')),
+            FOREIGN KEY (order_id) REFERENCES orders(id) ON DELETE CASCADE
+        );
+
+        CREATE TABLE IF NOT EXISTS payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER NOT NULL,
+            metodo TEXT NOT NULL CHECK(metodo IN ('efectivo', 'debito', 'credito', 'qr', 'transferencia')),
+            monto INTEGER NOT NULL CHECK(monto >= 0),
+            created_at TEXT DEFAULT (datetime('now')),
+            FOREIGN KEY (order_id) REFERENCES orders(id) ON DELETE CASCADE
+        );
+
+        CREATE TABLE IF NOT EXISTS audit_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            user_nombre TEXT,
+            action TEXT NOT NULL,
+            entity TEXT NOT NULL,
+            entity_id INTEGER,
+            data_json TEXT,
+            ip TEXT,
+            created_at TEXT DEFAULT (datetime('now'))
+        );
+
+        CREATE TABLE IF NOT EXISTS order_changes (
+            version INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER NOT NULL,
+            tipo TEXT NOT NULL,
+            ts TEXT DEFAULT (datetime('now'))
+        );
+
+        -- Resúmenes materializados por día (ver actualizar_resumenes)
+        CREATE TABLE IF NOT EXISTS daily_sales (
+            fecha TEXT PRIMARY KEY,
+            total INTEGER DEFAULT 0,
+            comandas INTEGER DEFAULT 0,
+            cobrado INTEGER DEFAULT 0
+        );
+
+        CREATE TABLE IF NOT EXISTS daily_table_sales (
+            fecha TEXT NOT NULL,
+            table_id INTEGER NOT NULL,
+            total INTEGER DEFAULT 0,
+            comandas INTEGER DEFAULT 0,
+            PRIMARY KEY (fecha, table_id)
+        );
+
+        CREATE TABLE IF NOT EXISTS daily_waiter_sales (
+            fecha TEXT NOT NULL,
+            mozo TEXT NOT NULL,
+            total INTEGER DEFAULT 0,
+            comandas INTEGER DEFAULT 0,
+            PRIMARY KEY (fecha, mozo)
+        );
+
+        CREATE TABLE IF NOT EXISTS daily_product_sales (
+            fecha TEXT NOT NULL,
+            product_nombre TEXT NOT NULL,
+            vendidos INTEGER DEFAULT 0,
+            ingresos INTEGER DEFAULT 0,
+            PRIMARY KEY (fecha, product_nombre)
+        );
+
+        CREATE TABLE IF NOT EXISTS notas_generales (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            contenido TEXT NOT NULL,
+            activo INTEGER DEFAULT 1,
+            ts TEXT DEFAULT (datetime('now')),
+            updated_at TEXT DEFAULT (datetime('now'))
+        );
+
+        -- Meses movidos al archivo histórico (ver archivar_ordenes)
+        CREATE TABLE IF NOT EXISTS archivo_meses (
+            mes TEXT PRIMARY KEY,
+            ordenes INTEGER DEFAULT 0,
+            auditoria INTEGER DEFAULT 0,
+            corte TEXT NOT NULL,
+            actualizado TEXT DEFAULT (datetime('now'))
+        );
+        """)
+
+        # Componentes del descuento guardados en la orden (ver aplicar_delta_totales):
+        # en bases anteriores se agregan y se llenan una vez desde discounts
+        try:
+            cur.execute("ALTER TABLE orders ADD COLUMN descuento_pct INTEGER DEFAULT 0")
+            cur.execute("ALTER TABLE orders ADD COLUMN descuento_fijo INTEGER DEFAULT 0")
+            cur.execute("""
+                UPDATE orders SET
+                    descuento_pct = (SELECT COALESCE(SUM(valor), 0) FROM discounts
+                                     WHERE order_id = orders.id AND tipo = 'porcentaje'),
+                    descuento_fijo = (SELECT COALESCE(SUM(valor), 0) FROM discounts
+                                      WHERE order_id = orders.id AND tipo = 'monto')
+                WHERE id IN (SELECT order_id FROM discounts)
+            """)
+        except sqlite3.OperationalError:
+            pass
+
+        # Importes en centavos (versión 1 del esquema): bases anteriores guardaban REAL en pesos
+        if con.execute("PRAGMA user_version").fetchone()[0] < 1:
+            migrar_a_centavos(con)
+            con.execute("PRAGMA user_version = 1")
+
+        # Crear índices
+        cur.executescript("""
+        CREATE INDEX IF NOT EXISTS idx_products_category ON products(category_id);
+        CREATE INDEX IF NOT EXISTS idx_products_nombre ON products(nombre);
+        CREATE INDEX IF NOT EXISTS idx_products_activo ON products(activo);
+        CREATE INDEX IF NOT EXISTS idx_orders_estado ON orders(estado);
+        CREATE INDEX IF NOT EXISTS idx_orders_ts_anulada ON orders(ts, anulada);
+        CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items(order_id);
+        CREATE INDEX IF NOT EXISTS idx_order_item_modifiers_item ON order_item_modifiers(order_item_id);
+        CREATE INDEX IF NOT EXISTS idx_payments_order ON payments(order_id);
+        CREATE INDEX IF NOT EXISTS idx_discounts_order ON discounts(order_id);
+        DROP INDEX IF EXISTS idx_orders_date;
+        CREATE INDEX IF NOT EXISTS idx_audit_entity ON audit_log(entity, entity_id);
+        CREATE INDEX IF NOT EXISTS idx_audit_created ON audit_log(created_at);
+        CREATE INDEX IF NOT EXISTS idx_order_changes_ts ON order_changes(ts);
+        """)
 
 init_db()
 
@@ -244,7 +796,7 @@ class ProductIn(BaseModel):
     nombre: str
     precio: float = Field(ge=0)
     category_id: Optional[int] = None
-    
+
     @validator('nombre')
     def nombre_no_vacio(cls, v):
         if not v or not v.strip():
@@ -254,7 +806,7 @@ class ProductIn(BaseModel):
 class CategoryIn(BaseModel):
     nombre: str
     orden: int = 0
-    
+
     @validator('nombre')
     def nombre_no_vacio(cls, v):
         if not v or not v.strip():
@@ -278,669 +830,831 @@ class PaymentIn(BaseModel):
     monto: float = Field(ge=0)
 
 # --- WebSocket Hub ---
+def topicos_evento(message: dict) -> List[str]:
+    """Topics que deben recibir un evento.
+
+    Los eventos de órdenes van a cocina, caja, admin, a la mesa y al mozo de
+    la orden, y a la barra si la orden tiene algo de CATEGORIAS_BAR. El resto
+    (notas generales) va a cocina y admin.
+    """
+    order = message.get("order")
+    if not order:
+        return ["kitchen", "admin"]
+    topicos = ["kitchen", "cashier", "admin", f"mesa:{order['table_id']}"]
+    if order.get("mozo"):
+        topicos.append(f"mozo:{order['mozo']}")
+    if any(it.get("categoria") in CATEGORIAS_BAR for it in order["items"]):
+        topicos.append("bar")
+    return topicos
+
+def topico_valido(topico: str) -> bool:
+    return topico in TOPICOS_FIJOS or topico.startswith(("mesa:", "mozo:"))
+
+class ClienteWS:
+    """Socket conectado con su cola de salida acotada y sus filtros"""
+    def __init__(self, ws: WebSocket, room: str, filtros: Optional[Dict[str, set]] = None):
+        self.ws = ws
+        self.room = room
+        self.filtros: Dict[str, set] = filtros or {}
+        self.cola: asyncio.Queue = asyncio.Queue(maxsize=WS_COLA_MAX)
+        self.tarea: Optional[asyncio.Task] = None
+
+    def acepta(self, message: dict) -> bool:
+        """Filtro del lado del servidor por estado y/o categoría de la orden"""
+        order = message.get("order")
+        if not order or not self.filtros:
+            return True
+        estados = self.filtros.get("estado")
+        if estados and order["estado"] not in estados:
+            return False
+        categorias = self.filtros.get("categoria")
+        if categorias and not any(it.get("categoria") in categorias for it in order["items"]):
+            return False
+        return True
+
 class Hub:
+    """Pub/sub por WebSocket: cada cliente se suscribe a un topic con filtros.
+
+    Topics: kitchen, bar, cashier, admin, mesa:<id> y mozo:<nombre>. Un evento
+    se serializa una sola vez y se encola sólo en los clientes de los topics
+    que le corresponden y cuyos filtros acepta; cada cliente tiene su propia
+    tarea de envío, así un tablet lento sólo atrasa su propia cola. Si la
+    cola se llena se descarta el mensaje más viejo (el cliente detecta el
+    salto de versión y se pone al día con /orders/changes), y si un envío no
+    termina en WS_TIMEOUT_ENVIO segundos el cliente se desconecta.
+    """
     def __init__(self):
-        self.rooms: Dict[str, List[WebSocket]] = {"kitchen": []}
-    async def connect(self, ws: WebSocket, room: str):
+        self.rooms: Dict[str, List[ClienteWS]] = {}
+        self.metricas: Dict[str, dict] = {}
+
+    @staticmethod
+    def _metricas_vacias():
+        return {"enviados": 0, "filtrados": 0, "descartados": 0, "desconectados": 0,
+                "latencia_total": 0.0, "latencia_max": 0.0}
+
+    async def connect(self, ws: WebSocket, room: str, filtros: Optional[Dict[str, set]] = None):
         await ws.accept()
-        self.rooms[room].append(ws)
+        cliente = ClienteWS(ws, room, filtros)
+        cliente.tarea = asyncio.create_task(self._enviar(cliente))
+        self.rooms.setdefault(room, []).append(cliente)
+        self.metricas.setdefault(room, self._metricas_vacias())
+        return cliente
+
     def remove(self, ws: WebSocket, room: str):
-        if ws in self.rooms[room]:
-            self.rooms[room].remove(ws)
+        clientes = self.rooms.get(room, [])
+        for cliente in list(clientes):
+            if cliente.ws is ws:
+                clientes.remove(cliente)
+                if cliente.tarea and cliente.tarea is not asyncio.current_task():
+                    cliente.tarea.cancel()
+        # Los topics por mesa/mozo se crean a demanda: no dejar salas vacías colgadas
+        if not clientes and room not in TOPICOS_FIJOS:
+            self.rooms.pop(room, None)
+            self.metricas.pop(room, None)
+
+    async def publish(self, message: dict):
+        """Enviar un evento a todos los topics y clientes que correspondan"""
+        texto = None
+        for room in topicos_evento(message):
+            for cliente in list(self.rooms.get(room, [])):
+                if not cliente.acepta(message):
+                    self.metricas[room]["filtrados"] += 1
+                    continue
+                if texto is None:
+                    texto = json.dumps(message)
+                self._encolar(cliente, texto)
+
     async def broadcast(self, room: str, message: dict):
-        dead = []
-        for ws in list(self.rooms[room]):
+        """Enviar un mensaje a todos los clientes de un topic, sin filtrar"""
+        texto = json.dumps(message)
+        for cliente in list(self.rooms.get(room, [])):
+            self._encolar(cliente, texto)
+
+    def _encolar(self, cliente: ClienteWS, texto: str):
+        try:
+            cliente.cola.put_nowait(texto)
+        except asyncio.QueueFull:
+            cliente.cola.get_nowait()
+            cliente.cola.put_nowait(texto)
+            self.metricas[cliente.room]["descartados"] += 1
+
+    async def _enviar(self, cliente: ClienteWS):
+        m = self.metricas[cliente.room]
+        while True:
+            texto = await cliente.cola.get()
+            inicio = time.perf_counter()
             try:
-                await ws.send_text(json.dumps(message))
-            except:
-                dead.append(ws)
-        for d in dead:
-            self.remove(d, room)
+                await asyncio.wait_for(cliente.ws.send_text(texto), WS_TIMEOUT_ENVIO)
+            except Exception:
+                m["desconectados"] += 1
+                self.remove(cliente.ws, cliente.room)
+                try:
+                    await cliente.ws.close()
+                except Exception:
+                    pass
+                return
+            latencia = time.perf_counter() - inicio
+            m["enviados"] += 1
+            m["latencia_total"] += latencia
+            m["latencia_max"] = max(m["latencia_max"], latencia)
+
+    def stats(self) -> dict:
+        data = {}
+        for room, clientes in self.rooms.items():
+            m = self.metricas[room]
+            colas = [c.cola.qsize() for c in clientes]
+            data[room] = {
+                "clientes": len(clientes),
+                "cola_total": sum(colas),
+                "cola_max": max(colas, default=0),
+                "enviados": m["enviados"],
+                "filtrados": m["filtrados"],
+                "descartados": m["descartados"],
+                "desconectados": m["desconectados"],
+                "latencia_promedio_ms": round(m["latencia_total"] / m["enviados"] * 1000, 3) if m["enviados"] else 0,
+                "latencia_max_ms": round(m["latencia_max"] * 1000, 3),
+            }
+        return data
 
 hub = Hub()
 
-# --- Helper: Calcular totales ---
-def calcular_totales_order(order_id: int, con=None):
-    """Recalcula subtotal, descuentos y total de una orden"""
-    close_con = False
-    if not con:
-        con = db()
-        close_con = True
-    
-    cur = con.cursor()
-    
-    # Calcular subtotal (items + modificadores)
-    items = cur.execute("""
-        SELECT oi.product_precio * oi.cantidad as item_total,
-               (SELECT COALESCE(SUM(oim.precio_extra), 0) 
-                FROM order_item_modifiers oim 
-                WHERE oim.order_item_id = oi.id) * oi.cantidad as mods_total
+# --- Dinero ---
+# Los importes se guardan y se suman como enteros en centavos, y los porcentajes
+# de descuento en centésimos de punto (12,5% = 1250): toda la aritmética es
+# exacta. La API sigue hablando en pesos; se convierte sólo al entrar y al salir.
+def a_centavos(pesos) -> int:
+    """Pesos de la API a centavos, redondeando al centavo (mitad hacia arriba)"""
+    return int((Decimal(str(pesos)) * 100).quantize(Decimal(1), ROUND_HALF_UP))
+
+def a_pesos(centavos: Optional[int]) -> Optional[float]:
+    """Centavos a pesos para la API (el float resultante es exacto a dos decimales)"""
+    return None if centavos is None else centavos / 100
+
+# --- Totales de las órdenes ---
+# La orden guarda el subtotal y los dos componentes del descuento (suma de
+# porcentajes y suma de montos fijos); descuento_total y total se derivan de
+# ellos. Agregar items o descuentos sólo suma un delta: no se releen los items.
+# Todo es INTEGER: `/` es división entera y `+ 5000` redondea mitad hacia arriba.
+SQL_TOTALES_DELTA = """
+    UPDATE orders SET
+        subtotal = subtotal + :subtotal,
+        descuento_pct = descuento_pct + :pct,
+        descuento_fijo = descuento_fijo + :fijo,
+        descuento_total = ((subtotal + :subtotal) * (descuento_pct + :pct) + 5000) / 10000 + descuento_fijo + :fijo,
+        total = MAX((subtotal + :subtotal)
+                    - (((subtotal + :subtotal) * (descuento_pct + :pct) + 5000) / 10000 + descuento_fijo + :fijo), 0),
+        updated_at = datetime('now')
+    WHERE id = :id
+"""
+
+# Totales recalculados desde cero para las órdenes que cumplen {filtro}
+SQL_TOTALES_ESPERADOS = """
+    WITH objetivo AS (SELECT id FROM orders o WHERE {filtro}),
+    lineas AS (
+        SELECT oi.order_id, oi.cantidad * (oi.product_precio + COALESCE(SUM(m.precio_extra), 0)) AS importe
         FROM order_items oi
-        WHERE oi.order_id = ?
-    """, (order_id,)).fetchall()
-    
-    subtotal = sum(row['item_total'] + row['mods_total'] for row in items)
-    
-    # Calcular descuentos
-    descuentos = cur.execute("""
-        SELECT tipo, valor FROM discounts WHERE order_id = ?
-    """, (order_id,)).fetchall()
-    
-    descuento_total = 0
-    for desc in descuentos:
-        if desc['tipo'] == 'porcentaje':
-            descuento_total += subtotal * (desc['valor'] / 100)
-        else:
-            descuento_total += desc['valor']
-    
-    total = subtotal - descuento_total
-    if total < 0:
-        total = 0
-    
-    cur.execute("""
-        UPDATE orders 
-        SET subtotal = ?, descuento_total = ?, total = ?, updated_at = datetime('now')
-        WHERE id = ?
-    """, (subtotal, descuento_total, total, order_id))
-    
-    if close_con:
-        con.commit()
-        con.close()
-    
-    return {"subtotal": subtotal, "descuento_total": descuento_total, "total": total}
-
-# --- API ENDPOINTS ---
-
-# PRODUCTOS
-@app.get("/products")
-def products(category_id: Optional[int] = None, search: Optional[str] = None):
-    con = db()
-    cur = con.cursor()
-    
-    query = """SELECT p.id, p.nombre, p.precio, p.category_id, c.nombre as categoria
-               FROM products p 
-               LEFT JOIN categories c ON c.id = p.category_id
-               WHERE p.activo=1"""
-    params = []
-    
-    if category_id:
-        query += " AND p.category_id = ?"
-        params.append(category_id)
-    
-    if search:
-        query += " AND p.nombre LIKE ?"
-        params.append(f"%{search}%")
-    
-    query += " ORDER BY c.orden, c.nombre, p.nombre"
-    
-    rows = cur.execute(query, params).fetchall()
-    con.close()
-    return [dict(r) for r in rows]
-
-@app.on_event("startup")
-def on_startup():
-    print("🚀 Iniciando El Café de los Pinos...")
-    local_ip = get_local_ip()
-    print(f"📡 IP Local: {local_ip}")
-    print(f"🌐 Acceso local: http://localhost:8000")
-    print(f"📱 Acceso LAN: http://{local_ip}:8000")
-    backup_database()
-    print("✅ Sistema listo")
-
-@app.post("/orders")
-async def create_order(payload: OrderIn, request: Request):
-    if not payload.items:
-        raise HTTPException(400, "Pedido sin items")
-    
-    con = db()
-    cur = con.cursor()
-    
-    # Crear orden
-    cur.execute("""INSERT INTO orders(table_id, user_id, mozo_nombre, estado)
-                   VALUES(?,?,?,'pendiente')""",
-                (payload.table_id, payload.user_id, payload.user_name))
-    order_id = cur.lastrowid
-    
-    # Agregar items
-    for it in payload.items:
-        if it.product_id:
-            prod = cur.execute("SELECT nombre, precio FROM products WHERE id=?", (it.product_id,)).fetchone()
-            if prod:
-                nombre = prod["nombre"]
-                precio = prod["precio"]
-            else:
-                nombre = "Producto desconocido"
-                precio = 0
+        LEFT JOIN order_item_modifiers m ON m.order_item_id = oi.id
+        WHERE oi.order_id IN objetivo
+        GROUP BY oi.id
+    ),
+    items AS (SELECT order_id, SUM(importe) AS subtotal FROM lineas GROUP BY order_id),
+    descuentos AS (
+        SELECT order_id,
+               SUM(CASE WHEN tipo = 'porcentaje' THEN valor ELSE 0 END) AS pct,
+               SUM(CASE WHEN tipo = 'monto' THEN valor ELSE 0 END) AS fijo
+        FROM discounts WHERE order_id IN objetivo GROUP BY order_id
+    ),
+    esperados AS (
+        SELECT o.id, COALESCE(i.subtotal, 0) AS subtotal, COALESCE(d.pct, 0) AS pct, COALESCE(d.fijo, 0) AS fijo
+        FROM objetivo o LEFT JOIN items i ON i.order_id = o.id LEFT JOIN descuentos d ON d.order_id = o.id
+    )
+    SELECT e.id, e.subtotal, e.pct, e.fijo,
+           (e.subtotal * e.pct + 5000) / 10000 + e.fijo AS descuento_total,
+           MAX(e.subtotal - ((e.subtotal * e.pct + 5000) / 10000 + e.fijo), 0) AS total,
+           o.subtotal AS subtotal_guardado, o.descuento_pct AS pct_guardado, o.descuento_fijo AS fijo_guardado,
+           o.descuento_total AS descuento_guardado, o.total AS total_guardado, substr(o.ts, 1, 10) AS fecha
+    FROM esperados e JOIN orders o ON o.id = e.id
+"""
+TOTALES_LOTE = 2000  # órdenes por transacción al verificar/reparar en masa
+# En centavos la comparación es exacta: cualquier diferencia es un error
+SQL_TOTALES_DIFERENCIAS = f"""
+    SELECT * FROM ({SQL_TOTALES_ESPERADOS})
+    WHERE subtotal <> subtotal_guardado OR pct <> pct_guardado OR fijo <> fijo_guardado
+       OR descuento_total <> descuento_guardado OR total <> total_guardado
+"""
+
+def aplicar_delta_totales(con, order_id: int, subtotal: int = 0, pct: int = 0, fijo: int = 0):
+    """Suma un delta (centavos / centésimos de punto) al subtotal y/o a los componentes del descuento"""
+    con.execute(SQL_TOTALES_DELTA, {"id": order_id, "subtotal": subtotal, "pct": pct, "fijo": fijo})
+
+def delta_descuento(tipo: str, valor: int) -> dict:
+    """Componente del descuento que mueve un descuento de este tipo"""
+    return {"pct": valor} if tipo == "porcentaje" else {"fijo": valor}
+
+def verificar_totales(desde: Optional[str] = None, hasta: Optional[str] = None, reparar: bool = False,
+                      lote: int = TOTALES_LOTE, ejemplos: int = 50, eventos: Optional[list] = None) -> dict:
+    """Compara los totales guardados con los recalculados, y opcionalmente los repara.
+
+    Recorre las órdenes de `desde` a `hasta` (YYYY-MM-DD, inclusive; sin ellos
+    todo el historial) en lotes de `lote` ids. Cada lote es una consulta que
+    trae las diferencias y, con `reparar`, un UPDATE ... FROM que las reescribe,
+    en su propia transacción por el escritor: el lock se suelta entre lotes y
+    las comandas no esperan a que termine todo. Si se reparó algo se regeneran
+    los resúmenes de los días corregidos, de a uno. Cada orden reparada queda
+    en order_changes en el mismo comando que la corrige (cambia la versión y
+    con ella el ETag de /orders y las stats); si se pasa `eventos`, ahí se
+    juntan los mensajes para publicar por WebSocket. No llamar dentro de una
+    transacción abierta.
+    """
+    inicio = time.perf_counter()
+    filtro, params = "1=1", []
+    if desde:
+        filtro += " AND o.ts >= ?"
+        params.append(rango_dia(desde)[0])
+    if hasta:
+        filtro += " AND o.ts < ?"
+        params.append(rango_dia(hasta)[1])
+
+    with db() as con:
+        primero, ultimo = con.execute(f"SELECT MIN(id), MAX(id) FROM orders o WHERE {filtro}", params).fetchone()
+
+    resultado = {"revisadas": 0, "con_diferencias": 0, "reparadas": 0, "lotes": 0, "ejemplos": []}
+    dias = set()
+
+    def revisar(con, filtro_lote, params_lote):
+        revisadas = con.execute(f"SELECT COUNT(*) FROM orders o WHERE {filtro_lote}", params_lote).fetchone()[0]
+        diferencias = [dict(r) for r in con.execute(SQL_TOTALES_DIFERENCIAS.format(filtro=filtro_lote), params_lote)]
+        if reparar and diferencias:
+            con.execute(f"""
+                UPDATE orders
+                SET subtotal = d.subtotal, descuento_pct = d.pct, descuento_fijo = d.fijo,
+                    descuento_total = d.descuento_total, total = d.total, updated_at = datetime('now')
+                FROM ({SQL_TOTALES_DIFERENCIAS.format(filtro=filtro_lote)}) AS d
+                WHERE orders.id = d.id
+            """, params_lote)
+            return revisadas, diferencias, [evento_orden(con, d["id"], "order_updated") for d in diferencias]
+        return revisadas, diferencias, []
+
+    for desde_id in range(primero or 1, (ultimo or 0) + 1, lote):
+        filtro_lote = f"{filtro} AND o.id BETWEEN ? AND ?"
+        params_lote = [*params, desde_id, desde_id + lote - 1]
+        if reparar:
+            revisadas, diferencias, eventos_lote = escritor.enviar(
+                lambda con: revisar(con, filtro_lote, params_lote)).result()
+            if eventos is not None:
+                eventos.extend(eventos_lote)
         else:
-            nombre = "Pedido libre"
-            precio = 0
-        
-        cur.execute("""INSERT INTO order_items(order_id, product_id, product_nombre, product_precio, cantidad, notas)
-                       VALUES(?,?,?,?,?,?)""",
-                    (order_id, it.product_id, nombre, precio, it.cantidad, it.notas))
-        item_id = cur.lastrowid
-        
-        # Agregar modificadores
-        for mod in it.modifiers:
-            if mod.modifier_id:
-                mod_data = cur.execute("SELECT nombre, precio_extra FROM modifiers WHERE id=?", (mod.modifier_id,)).fetchone()
-                if mod_data:
-                    cur.execute("""INSERT INTO order_item_modifiers(order_item_id, modifier_id, modifier_nombre, precio_extra)
-                                   VALUES(?,?,?,?)""",
-                                (item_id, mod.modifier_id, mod_data["nombre"], mod_data["precio_extra"]))
-            elif mod.nombre:
-                cur.execute("""INSERT INTO order_item_modifiers(order_item_id, modifier_nombre, precio_extra)
-                               VALUES(?,?,?)""",
-                            (item_id, mod.nombre, 0))
-    
-    # Calcular totales
-    calcular_totales_order(order_id, con)
-    
-    log_audit(user_nombre=payload.user_name, action="CREATE", entity="orders", entity_id=order_id,
-              data={"table_id": payload.table_id}, ip=request.client.host if request.client else None)
-    
-    con.commit()
-    con.close()
-    
-    await hub.broadcast("kitchen", {"type": "new_order", "order_id": order_id})
-    return {"ok": True, "order_id": order_id}
+            with db() as con:
+                revisadas, diferencias, _ = revisar(con, filtro_lote, params_lote)
+        resultado["lotes"] += 1
+        resultado["revisadas"] += revisadas
+        resultado["con_diferencias"] += len(diferencias)
+        resultado["ejemplos"].extend(
+            {k: v if k in ("id", "fecha") else a_pesos(v) for k, v in d.items()}
+            for d in diferencias[:ejemplos - len(resultado["ejemplos"])])
+        if reparar:
+            resultado["reparadas"] += len(diferencias)
+            dias.update(d["fecha"] for d in diferencias)
+
+    # Un comando por día corregido, esperando cada uno: el escritor no junta
+    # todo el rango en una sola transacción
+    for dia in sorted(dias):
+        escritor.enviar(lambda con, d=dia: reconstruir_resumenes(con, d, d)).result()
+    resultado["segundos"] = round(time.perf_counter() - inicio, 3)
+    return resultado
+
+# --- Helper: Rangos de fechas ---
+def rango_dia(fecha: str):
+    """(desde, hasta) para filtrar un día con `ts >= ? AND ts < ?`.
+
+    `ts` se guarda como texto 'YYYY-MM-DD HH:MM:SS', así que comparar contra
+    los límites del día usa el índice (ts, anulada) en vez de evaluar
+    DATE(ts) fila por fila.
+    """
+    try:
+        dia = datetime.strptime(fecha, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(400, "Fecha inválida, usar YYYY-MM-DD")
+    return dia.isoformat(), (dia + timedelta(days=1)).isoformat()
+
+# --- Helper: Resúmenes diarios ---
+def actualizar_resumenes(con, order_id: int, signo: int, items: bool = True):
+    """Suma (signo=1) o resta (signo=-1) el aporte de una orden a los resúmenes del día.
+
+    Los endpoints que modifican una orden llaman con -1 antes del cambio y con
+    +1 después, dentro de la misma transacción: así los resúmenes siempre
+    reflejan el estado confirmado. Las órdenes anuladas no aportan nada.
+    Con items=False no se tocan las ventas por producto (cambios que sólo
+    afectan el total, como los descuentos).
+    """
+    o = con.execute("""SELECT substr(ts, 1, 10) AS fecha, table_id, mozo_nombre, total, anulada
+                       FROM orders WHERE id=?""", (order_id,)).fetchone()
+    if not o or o["anulada"]:
+        return
+    total = (o["total"] or 0) * signo
+
+    con.execute("""INSERT INTO daily_sales(fecha, total, comandas) VALUES(?,?,?)
+                   ON CONFLICT(fecha) DO UPDATE SET total = total + excluded.total,
+                                                    comandas = comandas + excluded.comandas""",
+                (o["fecha"], total, signo))
+    con.execute("""INSERT INTO daily_table_sales(fecha, table_id, total, comandas) VALUES(?,?,?,?)
+                   ON CONFLICT(fecha, table_id) DO UPDATE SET total = total + excluded.total,
+                                                              comandas = comandas + excluded.comandas""",
+                (o["fecha"], o["table_id"] or 0, total, signo))
+    if o["mozo_nombre"] is not None:
+        con.execute("""INSERT INTO daily_waiter_sales(fecha, mozo, total, comandas) VALUES(?,?,?,?)
+                       ON CONFLICT(fecha, mozo) DO UPDATE SET total = total + excluded.total,
+                                                              comandas = comandas + excluded.comandas""",
+                    (o["fecha"], o["mozo_nombre"], total, signo))
+    if items:
+        con.execute("""INSERT INTO daily_product_sales(fecha, product_nombre, vendidos, ingresos)
+                       SELECT ?, product_nombre, SUM(cantidad) * ?, SUM(product_precio * cantidad) * ?
+                       FROM order_items WHERE order_id=? GROUP BY product_nombre
+                       ON CONFLICT(fecha, product_nombre) DO UPDATE SET vendidos = vendidos + excluded.vendidos,
+                                                                        ingresos = ingresos + excluded.ingresos""",
+                    (o["fecha"], signo, signo, order_id))
+
+    if signo < 0:
+        # Sin aporte restante la fila sobra (igual que tras reconstruir_resumenes)
+        con.execute("DELETE FROM daily_table_sales WHERE fecha=? AND comandas=0", (o["fecha"],))
+        con.execute("DELETE FROM daily_waiter_sales WHERE fecha=? AND comandas=0", (o["fecha"],))
+        con.execute("DELETE FROM daily_product_sales WHERE fecha=? AND vendidos=0", (o["fecha"],))
+
+def registrar_cobro(con, order_id: int, monto: int):
+    """Suma un pago al cobrado del día de la orden"""
+    con.execute("""INSERT INTO daily_sales(fecha, cobrado)
+                   SELECT substr(ts, 1, 10), ? FROM orders WHERE id=?
+                   ON CONFLICT(fecha) DO UPDATE SET cobrado = cobrado + excluded.cobrado""",
+                (monto, order_id))
+
+def reconstruir_resumenes(con, desde: Optional[str] = None, hasta: Optional[str] = None):
+    """Regenera los resúmenes diarios desde orders/order_items/payments.
+
+    `desde` y `hasta` (YYYY-MM-DD, inclusive) limitan los días a regenerar;
+    sin ellos se regenera todo el historial. Los días anteriores al corte del
+    archivo histórico no se tocan: sus órdenes ya no están en esta base.
+    """
+    desde = max(desde or "0000-00-00", corte_archivo(con) or "")
+    hasta = (rango_dia(hasta)[1] if hasta else "9999-99-99")
+    rango = (desde, hasta)
+    for tabla in ("daily_sales", "daily_table_sales", "daily_waiter_sales", "daily_product_sales"):
+        con.execute(f"DELETE FROM {tabla} WHERE fecha >= ? AND fecha < ?", rango)
+
+    con.execute("""INSERT INTO daily_sales(fecha, total, comandas, cobrado)
+                   SELECT substr(o.ts, 1, 10), SUM(CASE WHEN o.anulada=0 THEN o.total ELSE 0 END),
+                          SUM(o.anulada=0),
+                          COALESCE(SUM((SELECT SUM(p.monto) FROM payments p WHERE p.order_id=o.id)), 0)
+                   FROM orders o WHERE o.ts >= ? AND o.ts < ?
+                   GROUP BY substr(o.ts, 1, 10)""", rango)
+    con.execute("""INSERT INTO daily_table_sales(fecha, table_id, total, comandas)
+                   SELECT substr(ts, 1, 10), COALESCE(table_id, 0), SUM(total), COUNT(*)
+                   FROM orders WHERE ts >= ? AND ts < ? AND anulada=0
+                   GROUP BY substr(ts, 1, 10), COALESCE(table_id, 0)""", rango)
+    con.execute("""INSERT INTO daily_waiter_sales(fecha, mozo, total, comandas)
+                   SELECT substr(ts, 1, 10), mozo_nombre, SUM(total), COUNT(*)
+                   FROM orders WHERE ts >= ? AND ts < ? AND anulada=0 AND mozo_nombre IS NOT NULL
+                   GROUP BY substr(ts, 1, 10), mozo_nombre""", rango)
+    con.execute("""INSERT INTO daily_product_sales(fecha, product_nombre, vendidos, ingresos)
+                   SELECT substr(o.ts, 1, 10), oi.product_nombre, SUM(oi.cantidad),
+                          SUM(oi.product_precio * oi.cantidad)
+                   FROM order_items oi JOIN orders o ON o.id = oi.order_id
+                   WHERE o.ts >= ? AND o.ts < ? AND o.anulada=0
+                   GROUP BY substr(o.ts, 1, 10), oi.product_nombre""", rango)
+
+def inicializar_resumenes():
+    """Genera los resúmenes desde el historial si la base todavía no los tiene"""
+    with db() as con:
+        if (not con.execute("SELECT 1 FROM daily_sales LIMIT 1").fetchone()
+                and con.execute("SELECT 1 FROM orders LIMIT 1").fetchone()):
+            reconstruir_resumenes(con)
+            print("📊 Resúmenes diarios generados desde el historial")
+
+# --- Helper: Cargar órdenes completas ---
+CAMPOS_ORDEN = ("id", "table_id", "user_id", "mozo_nombre", "subtotal", "descuento_total", "total",
+                "estado", "anulada", "pagado", "ts", "updated_at", "mesa", "mozo", "items", "modifiers")
+
+def cargar_ordenes(con, where: str = "1=1", params=(), order_by: str = "o.id DESC",
+                   limit: Optional[int] = None, items: bool = True, modifiers: bool = True):
+    """Carga órdenes con sus items y modificadores en tres consultas.
+
+    Evita el N+1 (una consulta por orden y otra por item): trae las órdenes,
+    después todos sus items y todos sus modificadores de una vez, y arma el
+    árbol en Python con índices por id. Con `items=False` o `modifiers=False`
+    se saltean la segunda o la tercera consulta.
+    """
+    query = f"""SELECT o.id, o.table_id, o.user_id, o.mozo_nombre, o.subtotal, o.descuento_total,
+                       o.total, o.estado, o.anulada, o.pagado, o.ts, o.updated_at,
+                       t.nombre AS mesa, u.nombre AS mozo
+                FROM orders o
+                LEFT JOIN tables t ON t.id=o.table_id
+                LEFT JOIN users u ON u.id=o.user_id
+                WHERE {where}
+                ORDER BY {order_by}"""
+    if limit is not None:
+        query += " LIMIT ?"
+        params = (*params, limit)
 
-@app.get("/orders")
-def list_orders(estado: Optional[str] = None, anuladas: int = 0):
-    con = db()
-    cur = con.cursor()
-    
-    query = """SELECT o.id, o.table_id, o.user_id, o.mozo_nombre, o.subtotal, o.descuento_total,
-                      o.total, o.estado, o.anulada, o.pagado, o.ts, o.updated_at,
-                      t.nombre AS mesa, u.nombre AS mozo
-               FROM orders o
-               LEFT JOIN tables t ON t.id=o.table_id
-               LEFT JOIN users u ON u.id=o.user_id
-               WHERE o.anulada=?"""
-    params = [anuladas]
-    
-    if estado:
-        query += " AND o.estado=?"
-        params.append(estado)
-    
-    query += " ORDER BY o.id DESC"
-    
-    rows = cur.execute(query, params).fetchall()
     data = []
-    
-    for r in rows:
-        items_query = """
-            SELECT oi.id, oi.product_nombre as nombre, oi.product_precio as precio,
-                   oi.cantidad, oi.notas
-            FROM order_items oi
-            WHERE oi.order_id=?"""
-        items = cur.execute(items_query, (r["id"],)).fetchall()
-        
-        items_con_mods = []
-        for it in items:
-            mods = cur.execute("""
-                SELECT modifier_nombre, precio_extra 
-                FROM order_item_modifiers 
-                WHERE order_item_id=?
-            """, (it["id"],)).fetchall()
-            
-            item_dict = dict(it)
-            item_dict["modifiers"] = [dict(m) for m in mods]
-            items_con_mods.append(item_dict)
-        
-        mozo_final = r["mozo_nombre"] or (r["mozo"] if r["mozo"] else str(r["user_id"] or ""))
+    por_orden: Dict[int, list] = {}
+    for r in con.execute(query, params):
         order_dict = dict(r)
-        order_dict["mozo"] = mozo_final
-        order_dict["items"] = items_con_mods
+        for campo in ("subtotal", "descuento_total", "total"):
+            order_dict[campo] = a_pesos(r[campo])
+        order_dict["mozo"] = r["mozo_nombre"] or (r["mozo"] if r["mozo"] else str(r["user_id"] or ""))
+        if items:
+            order_dict["items"] = por_orden[r["id"]] = []
         data.append(order_dict)
-    
-    con.close()
-    return data
 
-@app.put("/orders/{order_id}/estado")
-async def update_order_estado(order_id: int, payload: dict = Body(...), request: Request = None):
-    estado = payload.get("estado")
-    if estado not in ["pendiente", "listo", "cobrado"]:
-        raise HTTPException(400, "Estado inválido")
-    
-    con = db()
-    cur = con.cursor()
-    cur.execute("UPDATE orders SET estado=?, updated_at=datetime('now') WHERE id=?", (estado, order_id))
-    con.commit()
-    
-    log_audit(action="UPDATE_ESTADO", entity="orders", entity_id=order_id, data={"estado": estado},
-              ip=request.client.host if request.client else None)
-    
-    con.close()
-    await hub.broadcast("kitchen", {"type": "order_updated", "order_id": order_id})
-    return {"ok": True, "estado": estado}
+    if not por_orden:
+        return data
 
-@app.post("/orders/{order_id}/cancel")
-async def cancel_order(order_id: int, request: Request):
-    con = db()
-    cur = con.cursor()
-    cur.execute("UPDATE orders SET anulada=1, updated_at=datetime('now') WHERE id=?", (order_id,))
-    con.commit()
-    
-    log_audit(action="CANCEL", entity="orders", entity_id=order_id, ip=request.client.host if request.client else None)
-    
-    con.close()
-    await hub.broadcast("kitchen", {"type": "order_cancelled", "order_id": order_id})
-    return {"ok": True}
+    # Los ids viajan como un único parámetro JSON: sin límite de variables de SQLite
+    ids = json.dumps(list(por_orden))
 
-@app.get("/categories")
-def categories():
-    con = db()
-    rows = con.execute("SELECT id, nombre, orden FROM categories ORDER BY orden, nombre").fetchall()
-    con.close()
-    return [dict(r) for r in rows]
+    por_item: Dict[int, list] = {}
+    for it in con.execute("""
+        SELECT oi.order_id, oi.id, oi.product_nombre as nombre, oi.product_precio as precio,
+               oi.cantidad, oi.notas, c.nombre as categoria
+        FROM order_items oi
+        LEFT JOIN products p ON p.id = oi.product_id
+        LEFT JOIN categories c ON c.id = p.category_id
+        WHERE oi.order_id IN (SELECT value FROM json_each(?))
+        ORDER BY oi.id""", (ids,)):
+        item_dict = dict(it)
+        del item_dict["order_id"]
+        item_dict["precio"] = a_pesos(it["precio"])
+        if modifiers:
+            item_dict["modifiers"] = por_item[it["id"]] = []
+        por_orden[it["order_id"]].append(item_dict)
+
+    if por_item:
+        for m in con.execute("""
+            SELECT oim.order_item_id, oim.modifier_nombre, oim.precio_extra
+            FROM order_item_modifiers oim
+            JOIN order_items oi ON oi.id = oim.order_item_id
+            WHERE oi.order_id IN (SELECT value FROM json_each(?))
+            ORDER BY oim.id""", (ids,)):
+            por_item[m["order_item_id"]].append({"modifier_nombre": m["modifier_nombre"],
+                                                 "precio_extra": a_pesos(m["precio_extra"])})
 
-@app.post("/categories")
-def create_category(payload: CategoryIn, request: Request):
-    con = db()
-    cur = con.cursor()
-    
-    try:
-        cur.execute("INSERT INTO categories(nombre, orden) VALUES(?,?)", (payload.nombre, payload.orden))
-        cid = cur.lastrowid
-        con.commit()
-        
-        log_audit(action="CREATE", entity="categories", entity_id=cid, data=payload.dict(), 
-                  ip=request.client.host if request.client else None)
-        
-        con.close()
-        return {"ok": True, "id": cid}
-    except sqlite3.IntegrityError:
-        con.close()
-        raise HTTPException(400, "Ya existe una categoría con ese nombre")
+    return data
 
-@app.delete("/categories/{category_id}")
-def delete_category(category_id: int, request: Request):
-    con = db()
-    cur = con.cursor()
-    cur.execute("DELETE FROM categories WHERE id=?", (category_id,))
-    con.commit()
-    
-    log_audit(action="DELETE", entity="categories", entity_id=category_id, ip=request.client.host if request.client else None)
-    
-    con.close()
-    return {"ok": True}
+def cargar_orden(con, order_id: int) -> Optional[dict]:
+    """Carga una sola orden completa, o None si no existe"""
+    ordenes = cargar_ordenes(con, "o.id=?", (order_id,))
+    return ordenes[0] if ordenes else None
+
+# --- Helper: Secuencia de cambios de órdenes ---
+def evento_orden(con, order_id: int, tipo: str) -> dict:
+    """Registra el cambio de una orden y arma el mensaje para el WebSocket.
+
+    Se llama dentro de la transacción que modificó la orden, así la versión
+    queda asignada sólo si el cambio se confirma. El mensaje lleva la orden
+    completa para que los clientes apliquen el parche sin recargar la lista.
+    """
+    version = con.execute("INSERT INTO order_changes(order_id, tipo) VALUES(?,?)",
+                          (order_id, tipo)).lastrowid
+    return {"type": tipo, "order_id": order_id, "version": version, "order": cargar_orden(con, order_id)}
+
+def version_actual(con) -> int:
+    """Última versión asignada en order_changes (0 si nunca hubo cambios)"""
+    row = con.execute("SELECT seq FROM sqlite_sequence WHERE name='order_changes'").fetchone()
+    return row["seq"] if row else 0
+
+def purgar_cambios():
+    """Borra el historial de cambios más viejo que CAMBIOS_RETENCION_DIAS.
+
+    Corre al arrancar y después cada CAMBIOS_PURGA_SEGUNDOS desde el hilo de
+    backups, así un servidor que no se reinicia no acumula historial.
+    """
+    escritor.enviar(lambda con: con.execute("DELETE FROM order_changes WHERE ts < datetime('now', ?)",
+                                            (f"-{CAMBIOS_RETENCION_DIAS} days",))).result()
+
+# --- Helper: GET condicional ---
+def no_modificado(request: Request, etag: str, modificado: Optional[float] = None) -> bool:
+    """True si el cliente ya tiene esta versión (If-None-Match / If-Modified-Since)"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        etiquetas = [e.strip().removeprefix("W/") for e in if_none_match.split(",")]
+        return "*" in etiquetas or etag in etiquetas
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and modificado is not None:
+        try:
+            return int(modificado) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def headers_validacion(etag: str, modificado: Optional[float] = None) -> dict:
+    """ETag/Last-Modified; no-cache obliga al navegador a revalidar en cada uso"""
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if modificado is not None:
+        headers["Last-Modified"] = formatdate(modificado, usegmt=True)
+    return headers
+
+# --- Búsqueda de productos ---
+def normalizar(texto: str) -> str:
+    """Minúsculas y sin tildes ("Café Ñandú" -> "cafe nandu")"""
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    return "".join(c for c in texto if not unicodedata.combining(c))
+
+class IndiceBusqueda:
+    """Índice de prefijos de palabras sobre los nombres de productos.
+
+    Guarda una lista ordenada de (palabra normalizada, posición en el nombre,
+    índice del producto): cada término de la búsqueda es un bisect más un
+    recorrido por las palabras que empiezan con él. Todos los términos tienen
+    que aparecer (AND). Si no hay coincidencias por prefijo se cae a buscar
+    el texto dentro del nombre, como hacía el LIKE '%...%'.
+    """
+
+    def __init__(self, productos: list):
+        self.productos = productos
+        self.nombres = [normalizar(p["nombre"]) for p in productos]
+        self.palabras = sorted((palabra, pos, i)
+                               for i, nombre in enumerate(self.nombres)
+                               for pos, palabra in enumerate(re.findall(r"\w+", nombre)))
+        self._claves = [p[0] for p in self.palabras]
+        self._cortas = {}   # ranking ya armado de búsquedas de 1-2 letras (las más caras)
+
+    def _prefijo(self, termino: str) -> dict:
+        """{producto: posición de la primera palabra que empieza con `termino`}"""
+        desde = bisect.bisect_left(self._claves, termino)
+        hasta = bisect.bisect_left(self._claves, termino + "\uffff", desde)
+        encontrados = {}
+        for _, pos, i in self.palabras[desde:hasta]:
+            if pos < encontrados.get(i, pos + 1):
+                encontrados[i] = pos
+        return encontrados
+
+    def buscar(self, texto: str, limite: Optional[int] = None) -> list:
+        consulta = normalizar(texto).strip()
+        terminos = re.findall(r"\w+", consulta)
+        if not terminos:
+            return []
+        if len(consulta) <= 2:
+            if consulta not in self._cortas:
+                self._cortas[consulta] = self._rankear(consulta, terminos, None)
+            return self._cortas[consulta][:limite]
+        return self._rankear(consulta, terminos, limite)
+
+    def _rankear(self, consulta: str, terminos: list, limite: Optional[int]) -> list:
+        puntaje = None
+        for termino in sorted(terminos, key=len, reverse=True):
+            encontrados = self._prefijo(termino)
+            if puntaje is None:
+                puntaje = encontrados
+            else:
+                puntaje = {i: puntaje[i] + pos for i, pos in encontrados.items() if i in puntaje}
+            if not puntaje:
+                break
+
+        if not puntaje:
+            puntaje = {i: 0 for i, nombre in enumerate(self.nombres) if consulta in nombre}
+
+        # Primero el nombre exacto, después los que empiezan con la búsqueda,
+        # después los que la tienen en palabras más adelante; a igualdad, el más corto
+        nombres = self.nombres
+        def rango(i):
+            return (nombres[i] != consulta, not nombres[i].startswith(consulta), puntaje[i], len(nombres[i]), i)
+        if limite is not None and limite < len(puntaje):
+            orden = heapq.nsmallest(limite, puntaje, key=rango)
+        else:
+            orden = sorted(puntaje, key=rango)
+        return [self.productos[i] for i in orden]
 
-@app.get("/modifiers")
-def get_modifiers():
-    con = db()
-    rows = con.execute("SELECT id, nombre, precio_extra FROM modifiers WHERE activo=1 ORDER BY nombre").fetchall()
-    con.close()
-    return [dict(r) for r in rows]
+# --- Catálogo en memoria ---
+CATALOGO_CACHE_MAX = 256   # respuestas filtradas guardadas por versión
 
-@app.post("/modifiers")
-def create_modifier(payload: ModifierCreate, request: Request):
-    con = db()
-    cur = con.cursor()
-    cur.execute("INSERT INTO modifiers(nombre, precio_extra) VALUES(?,?)", 
-                (payload.nombre, payload.precio_extra))
-    mid = cur.lastrowid
-    con.commit()
-    
-    log_audit(action="CREATE", entity="modifiers", entity_id=mid, data=payload.dict(), 
-              ip=request.client.host if request.client else None)
-    
-    con.close()
-    return {"ok": True, "id": mid}
+class Catalogo:
+    """Productos, categorías, modificadores, mesas y usuarios en memoria.
 
-@app.delete("/modifiers/{modifier_id}")
-def delete_modifier(modifier_id: int, request: Request):
-    con = db()
-    cur = con.cursor()
-    cur.execute("UPDATE modifiers SET activo=0, updated_at=datetime('now') WHERE id=?", (modifier_id,))
-    con.commit()
-    
-    log_audit(action="DELETE", entity="modifiers", entity_id=modifier_id, ip=request.client.host if request.client else None)
-    
-    con.close()
-    return {"ok": True}
+    Se carga entero de una vez y queda vigente hasta que un endpoint de
+    administración llama a invalidar() (después de confirmar su transacción).
+    Las respuestas se guardan ya serializadas junto con su ETag, así que una
+    lectura del catálogo no toca la base.
+    """
 
-@app.get("/tables")
-def tables():
-    con = db()
-    rows = con.execute("SELECT id, nombre FROM tables WHERE activo=1 ORDER BY id").fetchall()
-    con.close()
-    return [dict(r) for r in rows]
+    def __init__(self):
+        self.version = 0
+        self.cargado_en = None
+        self.datos = None
+        self._respuestas = {}
+        self._generacion = 0   # sube con cada invalidar(): descarta cargas en curso
+        self._lock = threading.Lock()
+
+    def _leer(self) -> dict:
+        with db() as con:
+            datos = {
+                "products": [dict(r) for r in con.execute("""
+                    SELECT p.id, p.nombre, p.precio, p.category_id, c.nombre as categoria
+                    FROM products p
+                    LEFT JOIN categories c ON c.id = p.category_id
+                    WHERE p.activo=1
+                    ORDER BY c.orden, c.nombre, p.nombre""")],
+                "categories": [dict(r) for r in con.execute(
+                    "SELECT id, nombre, orden FROM categories ORDER BY orden, nombre")],
+                "modifiers": [dict(r) for r in con.execute(
+                    "SELECT id, nombre, precio_extra FROM modifiers WHERE activo=1 ORDER BY nombre")],
+                "tables": [dict(r) for r in con.execute(
+                    "SELECT id, nombre FROM tables WHERE activo=1 ORDER BY id")],
+                "users": [dict(r) for r in con.execute(
+                    "SELECT id, nombre, rol FROM users WHERE activo=1")],
+            }
+        for p in datos["products"]:
+            p["precio"] = a_pesos(p["precio"])
+        for m in datos["modifiers"]:
+            m["precio_extra"] = a_pesos(m["precio_extra"])
+        datos["busqueda"] = IndiceBusqueda(datos["products"])
+        return datos
+
+    def vigente(self) -> tuple:
+        """(datos, caché de respuestas) actuales, cargando el catálogo si hace falta"""
+        with self._lock:
+            if self.datos is not None:
+                return self.datos, self._respuestas
+            generacion = self._generacion
+        datos = self._leer()
+        with self._lock:
+            # Si hubo un invalidar() mientras leíamos, estos datos pueden ser
+            # viejos: se usan para esta respuesta pero no quedan vigentes
+            if generacion != self._generacion:
+                return datos, {}
+            if self.datos is None:
+                self.datos = datos
+                self._respuestas = {}
+                self.version += 1
+                self.cargado_en = time.time()
+            return self.datos, self._respuestas
+
+    def cargar(self):
+        self.invalidar()
+        self.vigente()
+
+    def invalidar(self):
+        with self._lock:
+            self._generacion += 1
+            self.datos = None
+
+    def respuesta(self, clave: tuple, armar) -> tuple:
+        """(bytes, etag) de `armar(datos)` serializado, cacheado por clave hasta la próxima carga"""
+        datos, cache = self.vigente()
+        if clave in cache:
+            return cache[clave]
+        cuerpo = json.dumps(armar(datos), ensure_ascii=False, separators=(",", ":")).encode()
+        etag = f'"{hashlib.sha1(cuerpo).hexdigest()[:16]}"'
+        if len(cache) >= CATALOGO_CACHE_MAX:
+            cache.clear()
+        cache[clave] = (cuerpo, etag)
+        return cuerpo, etag
+
+    def stats(self) -> dict:
+        return {"version": self.version, "cargado": self.datos is not None,
+                "respuestas_cacheadas": len(self._respuestas)}
+
+catalogo = Catalogo()
+
+def respuesta_catalogo(request: Request, clave: tuple, armar) -> Response:
+    """Respuesta JSON del catálogo con ETag; 304 si el cliente ya la tiene"""
+    cuerpo, etag = catalogo.respuesta(clave, armar)
+    headers = headers_validacion(etag, catalogo.cargado_en)
+    if no_modificado(request, etag, catalogo.cargado_en):
+        return Response(status_code=304, headers=headers)
+    return Response(content=cuerpo, media_type="application/json", headers=headers)
 
-@app.get("/users")
-def users(rol: Optional[str] = None):
-    con = db()
-    if rol:
-        rows = con.execute("SELECT id, nombre, rol FROM users WHERE rol=? AND activo=1", (rol,)).fetchall()
-    else:
-        rows = con.execute("SELECT id, nombre, rol FROM users WHERE activo=1").fetchall()
-    con.close()
-    return [dict(r) for r in rows]
+# --- API ENDPOINTS ---
 
-@app.get("/notas")
-def get_notas():
-    con = db()
-    rows = con.execute("SELECT id, contenido, ts FROM notas_generales WHERE activo=1 ORDER BY id DESC LIMIT 50").fetchall()
-    con.close()
-    return [dict(r) for r in rows]
+@app.get("/api/db-pool")
+def db_pool_stats():
+    """Métricas del pool de conexiones para dimensionarlo, del escritor y de los checkpoints"""
+    return {**pool.stats(), "escritor": escritor.stats(), "checkpoint": estado_checkpoint}
 
-@app.post("/notas")
-async def create_nota(payload: dict = Body(...), request: Request = None):
-    con = db()
-    cur = con.cursor()
-    contenido = payload.get("contenido", "")
-    cur.execute("INSERT INTO notas_generales(contenido) VALUES(?)", (contenido,))
-    nid = cur.lastrowid
-    con.commit()
-    
-    log_audit(action="CREATE", entity="notas", entity_id=nid, data={"contenido": contenido},
-              ip=request.client.host if request.client else None)
-    
-    con.close()
-    await hub.broadcast("kitchen", {"type": "new_nota", "id": nid})
-    return {"ok": True, "id": nid}
+@app.get("/api/ws-stats")
+def ws_stats():
+    """Métricas de los WebSockets por sala: colas, descartes y latencia de envío"""
+    return hub.stats()
 
-@app.delete("/notas/{nota_id}")
-async def delete_nota(nota_id: int, request: Request):
-    con = db()
-    cur = con.cursor()
-    cur.execute("UPDATE notas_generales SET activo=0, updated_at=datetime('now') WHERE id=?", (nota_id,))
-    con.commit()
-    
-    log_audit(action="DELETE", entity="notas", entity_id=nota_id, ip=request.client.host if request.client else None)
-    
-    con.close()
-    await hub.broadcast("kitchen", {"type": "nota_deleted", "id": nota_id})
-    return {"ok": True}
+@app.get("/api/catalogo")
+def catalogo_stats():
+    """Estado del catálogo en memoria"""
+    return catalogo.stats()
 
-@app.get("/stats/today")
-def stats_today():
-    con = db()
-    today = datetime.utcnow().date().isoformat()
-    
-    total_vendido = con.execute("""
-        SELECT SUM(total) as total FROM orders 
-        WHERE DATE(ts) = ? AND anulada=0
-    """, (today,)).fetchone()["total"] or 0
-    
-    total_comandas = con.execute("""
-        SELECT COUNT(*) as count FROM orders 
-        WHERE DATE(ts) = ? AND anulada=0
-    """, (today,)).fetchone()["count"]
-    
-    por_mesa = con.execute("""
-        SELECT t.nombre as mesa, SUM(o.total) as total, COUNT(*) as comandas
-        FROM orders o
-        LEFT JOIN tables t ON t.id=o.table_id
-        WHERE DATE(o.ts) = ? AND o.anulada=0
-        GROUP BY o.table_id
-        ORDER BY total DESC
-    """, (today,)).fetchall()
-    
-    por_mozo = con.execute("""
-        SELECT mozo_nombre as mozo, SUM(total) as total, COUNT(*) as comandas
-        FROM orders
-        WHERE DATE(ts) = ? AND anulada=0 AND mozo_nombre IS NOT NULL
-        GROUP BY mozo_nombre
-        ORDER BY total DESC
-    """, (today,)).fetchall()
-    
-    top_productos = con.execute("""
-        SELECT oi.product_nombre, SUM(oi.cantidad) as vendidos, 
-               SUM(oi.product_precio * oi.cantidad) as ingresos
-        FROM order_items oi
-        JOIN orders o ON o.id = oi.order_id
-        WHERE DATE(o.ts) = ? AND o.anulada=0
-        GROUP BY oi.product_nombre
-        ORDER BY vendidos DESC
-        LIMIT 10
-    """, (today,)).fetchall()
-    
-    por_estado = con.execute("""
-        SELECT estado, COUNT(*) as count
-        FROM orders
-        WHERE DATE(ts) = ? AND anulada=0
-        GROUP BY estado
-    """, (today,)).fetchall()
-    
-    con.close()
-    return {
-        "fecha": today,
-        "total_vendido": total_vendido,
-        "total_comandas": total_comandas,
-        "por_mesa": [dict(r) for r in por_mesa],
-        "por_mozo": [dict(r) for r in por_mozo],
-        "top_productos": [dict(r) for r in top_productos],
-        "por_estado": [dict(r) for r in por_estado]
-    }
+@app.post("/api/catalogo/recargar")
+def recargar_catalogo():
+    """Vuelve a leer el catálogo (por ejemplo después de cargar seed.sql a mano)"""
+    catalogo.cargar()
+    return {"ok": True, **catalogo.stats()}
 
-@app.get("/export/orders")
-def export_orders(fecha: Optional[str] = None):
-    con = db()
-    if fecha:
-        rows = con.execute("""
-            SELECT o.id, o.ts, t.nombre as mesa, o.mozo_nombre, o.subtotal, 
-                   o.descuento_total, o.total, o.estado, o.anulada
-            FROM orders o
-            LEFT JOIN tables t ON t.id=o.table_id
-            WHERE DATE(o.ts) = ?
-            ORDER BY o.id
-        """, (fecha,)).fetchall()
-    else:
-        today = datetime.utcnow().date().isoformat()
-        rows = con.execute("""
-            SELECT o.id, o.ts, t.nombre as mesa, o.mozo_nombre, o.subtotal,
-                   o.descuento_total, o.total, o.estado, o.anulada
-            FROM orders o
-            LEFT JOIN tables t ON t.id=o.table_id
-            WHERE DATE(o.ts) = ?
-            ORDER BY o.id
-        """, (today,)).fetchall()
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['ID', 'Fecha/Hora', 'Mesa', 'Mozo', 'Subtotal', 'Descuento', 'Total', 'Estado', 'Anulada'])
-    
-    for r in rows:
-        writer.writerow([
-            r['id'], r['ts'], r['mesa'], r['mozo_nombre'], 
-            r['subtotal'], r['descuento_total'], r['total'], 
-            r['estado'], 'SI' if r['anulada'] else 'NO'
-        ])
-    
-    con.close()
-    output.seek(0)
-    return StreamingResponse(
-        iter([output.getvalue()]),
-        media_type="text/csv",
-        headers={"Content-Disposition": f"attachment; filename=comandas_{datetime.utcnow().date()}.csv"}
-    )
+@app.get("/api/audit-stats")
+def audit_stats():
+    """Métricas del escritor de auditoría: lotes, pendientes y escrituras en línea"""
+    return auditoria.stats()
 
-@app.get("/audit")
-def get_audit_log(limit: int = 100):
-    con = db()
-    rows = con.execute("""
-        SELECT * FROM audit_log 
-        ORDER BY created_at DESC 
-        LIMIT ?
-    """, (limit,)).fetchall()
-    con.close()
-    return [dict(r) for r in rows]
+# PRODUCTOS
+@app.get("/products")
+def products(request: Request, category_id: Optional[int] = None, search: Optional[str] = None,
+             limit: Optional[int] = None):
+    def armar(datos):
+        if search:
+            # Con categoría el límite se aplica después de filtrar
+            data = datos["busqueda"].buscar(search, None if category_id else limit)
+        else:
+            data = datos["products"]
+        if category_id:
+            data = [p for p in data if p["category_id"] == category_id]
+        return data[:limit] if limit else data
 
-def backup_database():
-    try:
-        os.makedirs(BACKUP_DIR, exist_ok=True)
-        backup_name = f"mozo_backup_{datetime.utcnow().date()}.db"
-        backup_path = os.path.join(BACKUP_DIR, backup_name)
-        
-        if not os.path.exists(backup_path):
-            shutil.copy2(DB, backup_path)
-            print(f"Backup creado: {backup_name}")
-            
-            for f in os.listdir(BACKUP_DIR):
-                if f.startswith("mozo_backup_"):
-                    file_path = os.path.join(BACKUP_DIR, f)
-                    if os.path.getctime(file_path) < (datetime.now() - timedelta(days=7)).timestamp():
-                        os.remove(file_path)
-    except Exception as e:
-        print(f"Error en backup: {e}")
+    if search:
+        # Las búsquedas no se cachean: hay una por cada tecla
+        return armar(catalogo.vigente()[0])
+    return respuesta_catalogo(request, ("products", category_id, limit), armar)
 
-@app.on_event("startup")
-def on_startup():
-    print("Iniciando El Café de los Pinos...")
-    local_ip = get_local_ip()
-    print(f"IP Local: {local_ip}")
-    print(f"Acceso local: http://localhost:8000")
-    print(f"Acceso LAN: http://{local_ip}:8000")
-    backup_database()
-    print("Sistema listo")
-
-@app.websocket("/ws/kitchen")
-async def ws_kitchen(ws: WebSocket):
-    await hub.connect(ws, "kitchen")
-    try:
-        while True:
-            await ws.receive_text()
-    except WebSocketDisconnect:
-        hub.remove(ws, "kitchen")
+@app.post("/products")
+def create_product(payload: ProductIn, request: Request):
+    with db() as con:
+        cur = con.cursor()
 
-@app.middleware("http")
-async def add_nocache_headers(request, call_next):
-    response = await call_next(request)
-    if request.url.path.startswith("/static/"):
-        response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
-        response.headers["Pragma"] = "no-cache"
-    return response
+        # Validar duplicado
+        existe = cur.execute("""
+            SELECT id FROM products
+            WHERE nombre = ? AND category_id IS ? AND activo = 1
+        """, (payload.nombre, payload.category_id)).fetchone()
 
-STATIC_DIR = "."
-os.makedirs(STATIC_DIR, exist_ok=True)
-app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
+        if existe:
+            raise HTTPException(400, "Ya existe un producto con ese nombre en esta categoría")
 
-@app.get("/")
-def root():
-    return {
-        "ok": True, 
-        "app": "El Café de los Pinos",
-        "version": "3.0",
-        "endpoints": {
-            "web": "/static/index.html",
-            "docs": "/docs",
-            "mozo": "/static/mozo.html",
-            "cocina": "/static/cocina.html",
-            "admin": "/static/admin.html"
-        }
-    }
+        cur.execute("""INSERT INTO products(nombre, precio, category_id) VALUES(?,?,?)""",
+                    (payload.nombre, a_centavos(payload.precio), payload.category_id))
+        pid = cur.lastrowid
 
-@app.post("/products")
-def create_product(payload: ProductIn, request: Request):
-    con = db()
-    cur = con.cursor()
-    
-    # Validar duplicado
-    existe = cur.execute("""
-        SELECT id FROM products 
-        WHERE nombre = ? AND category_id IS ? AND activo = 1
-    """, (payload.nombre, payload.category_id)).fetchone()
-    
-    if existe:
-        con.close()
-        raise HTTPException(400, "Ya existe un producto con ese nombre en esta categoría")
-    
-    cur.execute("""INSERT INTO products(nombre, precio, category_id) VALUES(?,?,?)""",
-                (payload.nombre, payload.precio, payload.category_id))
-    pid = cur.lastrowid
-    con.commit()
-    
-    log_audit(action="CREATE", entity="products", entity_id=pid, 
+    log_audit(action="CREATE", entity="products", entity_id=pid,
               data=payload.dict(), ip=request.client.host if request.client else None)
-    
-    con.close()
+    catalogo.invalidar()
     return {"ok": True, "id": pid}
 
 @app.delete("/products/{product_id}")
 def delete_product(product_id: int, request: Request):
-    con = db()
-    cur = con.cursor()
-    cur.execute("UPDATE products SET activo=0, updated_at=datetime('now') WHERE id=?", (product_id,))
-    con.commit()
-    
+    with db() as con:
+        con.execute("UPDATE products SET activo=0, updated_at=datetime('now') WHERE id=?", (product_id,))
+
     log_audit(action="DELETE", entity="products", entity_id=product_id, ip=request.client.host if request.client else None)
-    
-    con.close()
+    catalogo.invalidar()
     return {"ok": True}
 
 # CATEGORÍAS
 @app.get("/categories")
-def categories():
-    con = db()
-    rows = con.execute("SELECT id, nombre, orden FROM categories ORDER BY orden, nombre").fetchall()
-    con.close()
-    return [dict(r) for r in rows]
+def categories(request: Request):
+    return respuesta_catalogo(request, ("categories",), lambda d: d["categories"])
 
 @app.post("/categories")
 def create_category(payload: CategoryIn, request: Request):
-    con = db()
-    cur = con.cursor()
-    
     try:
-        cur.execute("INSERT INTO categories(nombre, orden) VALUES(?,?)", (payload.nombre, payload.orden))
-        cid = cur.lastrowid
-        con.commit()
-        
-        log_audit(action="CREATE", entity="categories", entity_id=cid, data=payload.dict(), 
+        with db() as con:
+            cur = con.cursor()
+            cur.execute("INSERT INTO categories(nombre, orden) VALUES(?,?)", (payload.nombre, payload.orden))
+            cid = cur.lastrowid
+
+        log_audit(action="CREATE", entity="categories", entity_id=cid, data=payload.dict(),
                   ip=request.client.host if request.client else None)
-        
-        con.close()
+        catalogo.invalidar()
         return {"ok": True, "id": cid}
     except sqlite3.IntegrityError:
-        con.close()
         raise HTTPException(400, "Ya existe una categoría con ese nombre")
 
 @app.delete("/categories/{category_id}")
 def delete_category(category_id: int, request: Request):
-    con = db()
-    cur = con.cursor()
-    cur.execute("DELETE FROM categories WHERE id=?", (category_id,))
-    con.commit()
-    
+    with db() as con:
+        con.execute("DELETE FROM categories WHERE id=?", (category_id,))
+
     log_audit(action="DELETE", entity="categories", entity_id=category_id, ip=request.client.host if request.client else None)
-    
-    con.close()
+    catalogo.invalidar()
     return {"ok": True}
 
 # MODIFICADORES
 @app.get("/modifiers")
-def get_modifiers():
-    con = db()
-    rows = con.execute("SELECT id, nombre, precio_extra FROM modifiers WHERE activo=1 ORDER BY nombre").fetchall()
-    con.close()
-    return [dict(r) for r in rows]
+def get_modifiers(request: Request):
+    return respuesta_catalogo(request, ("modifiers",), lambda d: d["modifiers"])
 
 @app.post("/modifiers")
 def create_modifier(payload: ModifierCreate, request: Request):
-    con = db()
-    cur = con.cursor()
-    cur.execute("INSERT INTO modifiers(nombre, precio_extra) VALUES(?,?)", 
-                (payload.nombre, payload.precio_extra))
-    mid = cur.lastrowid
-    con.commit()
-    
-    log_audit(action="CREATE", entity="modifiers", entity_id=mid, data=payload.dict(), 
+    with db() as con:
+        cur = con.cursor()
+        cur.execute("INSERT INTO modifiers(nombre, precio_extra) VALUES(?,?)",
+                    (payload.nombre, a_centavos(payload.precio_extra)))
+        mid = cur.lastrowid
+
+    log_audit(action="CREATE", entity="modifiers", entity_id=mid, data=payload.dict(),
               ip=request.client.host if request.client else None)
-    
-    con.close()
+    catalogo.invalidar()
     return {"ok": True, "id": mid}
 
 @app.delete("/modifiers/{modifier_id}")
 def delete_modifier(modifier_id: int, request: Request):
-    con = db()
-    cur = con.cursor()
-    cur.execute("UPDATE modifiers SET activo=0, updated_at=datetime('now') WHERE id=?", (modifier_id,))
-    con.commit()
-    
+    with db() as con:
+        con.execute("UPDATE modifiers SET activo=0, updated_at=datetime('now') WHERE id=?", (modifier_id,))
+
     log_audit(action="DELETE", entity="modifiers", entity_id=modifier_id, ip=request.client.host if request.client else None)
-    
-    con.close()
+    catalogo.invalidar()
     return {"ok": True}
 
 # COMANDAS
@@ -948,478 +1662,1552 @@ def delete_modifier(modifier_id: int, request: Request):
 async def create_order(payload: OrderIn, request: Request):
     if not payload.items:
         raise HTTPException(400, "Pedido sin items")
-    
-    con = db()
-    cur = con.cursor()
-    
-    # Crear orden
-    cur.execute("""INSERT INTO orders(table_id, user_id, mozo_nombre, estado)
-                   VALUES(?,?,?,'pendiente')""",
-                (payload.table_id, payload.user_id, payload.user_name))
-    order_id = cur.lastrowid
-    
-    # Agregar items
-    for it in payload.items:
-        if it.product_id:
-            prod = cur.execute("SELECT nombre, precio FROM products WHERE id=?", (it.product_id,)).fetchone()
-            if prod:
-                nombre = prod["nombre"]
-                precio = prod["precio"]
+
+    product_ids = {it.product_id for it in payload.items if it.product_id}
+    modifier_ids = {mod.modifier_id for it in payload.items for mod in it.modifiers if mod.modifier_id}
+
+    def escribir(con):
+        # Toda la comanda en la transacción IMMEDIATE que abre el escritor
+        cur = con.cursor()
+
+        # Catálogo de la comanda: una consulta para productos y otra para modificadores
+        productos = {r["id"]: r for r in cur.execute(
+            "SELECT id, nombre, precio FROM products WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps(list(product_ids)),))}
+        modificadores = {r["id"]: r for r in cur.execute(
+            "SELECT id, nombre, precio_extra FROM modifiers WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps(list(modifier_ids)),))}
+
+        # Crear orden
+        cur.execute("""INSERT INTO orders(table_id, user_id, mozo_nombre, estado)
+                       VALUES(?,?,?,'pendiente')""",
+                    (payload.table_id, payload.user_id, payload.user_name))
+        order_id = cur.lastrowid
+
+        # Agregar items
+        filas_items = []
+        for it in payload.items:
+            if it.product_id:
+                prod = productos.get(it.product_id)
+                if prod:
+                    nombre = prod["nombre"]
+                    precio = prod["precio"]
+                else:
+                    nombre = "Producto desconocido"
+                    precio = 0
             else:
-                nombre = "Producto desconocido"
+                nombre = "Pedido libre"
                 precio = 0
-        else:
-            nombre = "Pedido libre"
-            precio = 0
-        
-        cur.execute("""INSERT INTO order_items(order_id, product_id, product_nombre, product_precio, cantidad, notas)
-                       VALUES(?,?,?,?,?,?)""",
-                    (order_id, it.product_id, nombre, precio, it.cantidad, it.notas))
-        item_id = cur.lastrowid
-        
+            filas_items.append((order_id, it.product_id, nombre, precio, it.cantidad, it.notas))
+
+        cur.executemany("""INSERT INTO order_items(order_id, product_id, product_nombre, product_precio, cantidad, notas)
+                           VALUES(?,?,?,?,?,?)""", filas_items)
+        # executemany no devuelve lastrowid: los ids salen en el mismo orden de inserción
+        item_ids = [r["id"] for r in cur.execute(
+            "SELECT id FROM order_items WHERE order_id=? ORDER BY id", (order_id,))]
+
         # Agregar modificadores
-        for mod in it.modifiers:
-            if mod.modifier_id:
-                mod_data = cur.execute("SELECT nombre, precio_extra FROM modifiers WHERE id=?", (mod.modifier_id,)).fetchone()
-                if mod_data:
-                    cur.execute("""INSERT INTO order_item_modifiers(order_item_id, modifier_id, modifier_nombre, precio_extra)
-                                   VALUES(?,?,?,?)""",
-                                (item_id, mod.modifier_id, mod_data["nombre"], mod_data["precio_extra"]))
-            elif mod.nombre:
-                cur.execute("""INSERT INTO order_item_modifiers(order_item_id, modifier_nombre, precio_extra)
-                               VALUES(?,?,?)""",
-                            (item_id, mod.nombre, 0))
-    
-    # Calcular totales
-    calcular_totales_order(order_id, con)
-    
+        filas_mods = []
+        for item_id, it in zip(item_ids, payload.items):
+            for mod in it.modifiers:
+                if mod.modifier_id:
+                    mod_data = modificadores.get(mod.modifier_id)
+                    if mod_data:
+                        filas_mods.append((item_id, mod.modifier_id, mod_data["nombre"], mod_data["precio_extra"]))
+                elif mod.nombre:
+                    filas_mods.append((item_id, None, mod.nombre, 0))
+
+        if filas_mods:
+            cur.executemany("""INSERT INTO order_item_modifiers(order_item_id, modifier_id, modifier_nombre, precio_extra)
+                               VALUES(?,?,?,?)""", filas_mods)
+
+        # Totales: el subtotal sale de las filas que se acaban de insertar
+        extras = {}
+        for item_id, _, _, precio_extra in filas_mods:
+            extras[item_id] = extras.get(item_id, 0) + precio_extra
+        subtotal = sum((fila[3] + extras.get(item_id, 0)) * fila[4] for item_id, fila in zip(item_ids, filas_items))
+        aplicar_delta_totales(con, order_id, subtotal=subtotal)
+        actualizar_resumenes(con, order_id, +1)
+
+        return order_id, evento_orden(con, order_id, "new_order")
+
+    order_id, evento = await en_db(escribir)
     log_audit(user_nombre=payload.user_name, action="CREATE", entity="orders", entity_id=order_id,
               data={"table_id": payload.table_id}, ip=request.client.host if request.client else None)
-    
-    con.commit()
-    con.close()
-    
-    await hub.broadcast("kitchen", {"type": "new_order", "order_id": order_id})
+    await hub.publish(evento)
     return {"ok": True, "order_id": order_id}
 
 @app.get("/orders")
-def list_orders(estado: Optional[str] = None, anuladas: int = 0):
-    con = db()
-    cur = con.cursor()
-    
-    query = """SELECT o.id, o.table_id, o.user_id, o.mozo_nombre, o.subtotal, o.descuento_total,
-                      o.total, o.estado, o.anulada, o.pagado, o.ts, o.updated_at,
-                      t.nombre AS mesa, u.nombre AS mozo
-               FROM orders o
-               LEFT JOIN tables t ON t.id=o.table_id
-               LEFT JOIN users u ON u.id=o.user_id
-               WHERE o.anulada=?"""
-    params = [anuladas]
-    
+def list_orders(request: Request, response: Response, estado: Optional[str] = None, anuladas: int = 0,
+                desde: Optional[str] = None, before_id: Optional[int] = None, after_id: Optional[int] = None,
+                limit: int = ORDENES_LIMITE, fields: Optional[str] = None):
+    """Órdenes de a páginas, de la más nueva a la más vieja.
+
+    Sin `desde` el alcance es el día de servicio actual (UTC, como /stats/today)
+    más las órdenes que siguen abiertas de días anteriores; con `desde` son las
+    órdenes desde ese día, que no puede ser anterior al corte del archivo. La paginación es por id: `before_id` trae las
+    anteriores a una orden y `after_id` las posteriores, así cada página es un
+    rango del índice y cuesta lo mismo con cualquier tamaño de historial.
+    `fields` (ej. `id,mesa,estado,total,items`) elige los campos; sin `items`
+    no se leen los items y sin `modifiers` no se leen los modificadores.
+    """
+    if before_id is not None and after_id is not None:
+        raise HTTPException(400, "Usar before_id o after_id, no los dos")
+    if not 1 <= limit <= ORDENES_LIMITE_MAX:
+        raise HTTPException(400, f"limit tiene que estar entre 1 y {ORDENES_LIMITE_MAX}")
+    campos = None
+    if fields:
+        campos = {c.strip() for c in fields.split(",") if c.strip()}
+        desconocidos = campos.difference(CAMPOS_ORDEN)
+        if desconocidos:
+            raise HTTPException(400, f"Campos desconocidos: {', '.join(sorted(desconocidos))}")
+        if "modifiers" in campos:
+            campos.add("items")
+
+    hoy = datetime.utcnow().date().isoformat()
+    where = "o.anulada=?"
+    params: list = [anuladas]
+    if desde:
+        where += " AND o.ts >= ?"
+        params.append(rango_dia(desde)[0])
+    else:
+        # Unión de dos búsquedas por índice: sin esto el OR recorre la tabla por id
+        where += """ AND o.id IN (SELECT id FROM orders WHERE ts >= ?
+                                  UNION ALL SELECT id FROM orders WHERE estado IN ('pendiente', 'listo'))"""
+        params.append(hoy)
     if estado:
-        query += " AND o.estado=?"
+        where += " AND o.estado=?"
         params.append(estado)
-    
-    query += " ORDER BY o.id DESC"
-    
-    rows = cur.execute(query, params).fetchall()
-    data = []
-    
-    for r in rows:
-        items_query = """
-            SELECT oi.id, oi.product_nombre as nombre, oi.product_precio as precio,
-                   oi.cantidad, oi.notas
-            FROM order_items oi
-            WHERE oi.order_id=?"""
-        items = cur.execute(items_query, (r["id"],)).fetchall()
-        
-        items_con_mods = []
-        for it in items:
-            mods = cur.execute("""
-                SELECT modifier_nombre, precio_extra 
-                FROM order_item_modifiers 
-                WHERE order_item_id=?
-            """, (it["id"],)).fetchall()
-            
-            item_dict = dict(it)
-            item_dict["modifiers"] = [dict(m) for m in mods]
-            items_con_mods.append(item_dict)
-        
-        mozo_final = r["mozo_nombre"] or (r["mozo"] if r["mozo"] else str(r["user_id"] or ""))
-        order_dict = dict(r)
-        order_dict["mozo"] = mozo_final
-        order_dict["items"] = items_con_mods
-        data.append(order_dict)
-    
-    con.close()
+    if before_id is not None:
+        where += " AND o.id < ?"
+        params.append(before_id)
+    if after_id is not None:
+        where += " AND o.id > ?"
+        params.append(after_id)
+
+    with db() as con:
+        # Lo archivado no se pagina desde acá: mejor un error claro que una lista incompleta
+        corte = corte_archivo(con) if desde else None
+        if corte and rango_dia(desde)[0] < corte:
+            raise HTTPException(400, f"Las órdenes anteriores al {corte} están archivadas: pedirlas con /export/orders")
+        # La versión se lee antes que las órdenes: si entra un cambio en el medio,
+        # el cliente lo vuelve a recibir por /orders/changes (aplicarlo es idempotente)
+        version = version_actual(con)
+        # Los items llevan el nombre de su categoría: el catálogo también entra en el ETag.
+        # El alcance por defecto cambia con el día aunque no cambie ninguna orden
+        catalogo.vigente()
+        consulta = zlib.crc32(str(sorted(request.query_params.multi_items())).encode())
+        etag = f'"o{version}-c{catalogo.version}-{desde or hoy}-{consulta:08x}"'
+        ultimo = con.execute("SELECT ts FROM order_changes ORDER BY version DESC LIMIT 1").fetchone()
+        modificado = (datetime.strptime(ultimo["ts"], "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+                      if ultimo else None)
+        if not desde:
+            medianoche = datetime.strptime(hoy, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp()
+            modificado = max(modificado or 0, medianoche)
+        headers = {"X-Orders-Version": str(version), **headers_validacion(etag, modificado)}
+        if no_modificado(request, etag, modificado):
+            return Response(status_code=304, headers=headers)
+
+        # Una de más para saber si hay otra página
+        data = cargar_ordenes(con, where, params, "o.id ASC" if after_id is not None else "o.id DESC",
+                              limit=limit + 1,
+                              items=campos is None or bool(campos & {"items", "modifiers"}),
+                              modifiers=campos is None or "modifiers" in campos)
+
+    hay_mas = len(data) > limit
+    data = data[:limit]
+    if after_id is not None:
+        data.reverse()
+        if hay_mas:
+            headers["X-Next-After-Id"] = str(data[0]["id"])
+    elif hay_mas:
+        headers["X-Next-Before-Id"] = str(data[-1]["id"])
+    headers["X-Has-More"] = "1" if hay_mas else "0"
+    response.headers.update(headers)
+    if campos is not None:
+        data = [{k: v for k, v in o.items() if k in campos} for o in data]
     return data
 
+@app.get("/orders/changes")
+def order_changes(since: int = 0):
+    """Órdenes que cambiaron después de la versión `since`.
+
+    Los clientes guardan la última versión vista (del header X-Orders-Version
+    o de los mensajes del WebSocket) y al reconectar piden sólo lo que cambió.
+    Si el historial ya no cubre esa versión se responde `reset: true` y el
+    cliente tiene que recargar /orders completo.
+    """
+    with db() as con:
+        version = version_actual(con)
+        minima = con.execute("SELECT MIN(version) AS v FROM order_changes").fetchone()["v"]
+        if since > version or (since < version and (minima is None or minima > since + 1)):
+            return {"version": version, "reset": True, "orders": []}
+
+        ids = [r["order_id"] for r in con.execute(
+            "SELECT DISTINCT order_id FROM order_changes WHERE version > ? AND version <= ?", (since, version))]
+        if len(ids) > CAMBIOS_MAX_ORDENES:
+            return {"version": version, "reset": True, "orders": []}
+
+        orders = cargar_ordenes(con, "o.id IN (SELECT value FROM json_each(?))", (json.dumps(ids),)) if ids else []
+    return {"version": version, "reset": False, "orders": orders}
+
 @app.put("/orders/{order_id}/estado")
 async def update_order_estado(order_id: int, payload: dict = Body(...), request: Request = None):
     """Cambiar estado de una orden"""
     estado = payload.get("estado")
     if estado not in ["pendiente", "listo", "cobrado"]:
         raise HTTPException(400, "Estado inválido")
-    
-    con = db()
-    cur = con.cursor()
-    cur.execute("UPDATE orders SET estado=?, updated_at=datetime('now') WHERE id=?", (estado, order_id))
-    con.commit()
-    
+
+    def escribir(con):
+        cur = con.execute("UPDATE orders SET estado=?, updated_at=datetime('now') WHERE id=?", (estado, order_id))
+        if cur.rowcount == 0:
+            raise HTTPException(404, "Orden no encontrada")
+
+        return evento_orden(con, order_id, "order_updated")
+
+    evento = await en_db(escribir)
     log_audit(action="UPDATE_ESTADO", entity="orders", entity_id=order_id, data={"estado": estado},
               ip=request.client.host if request.client else None)
-    
-    con.close()
-    await hub.broadcast("kitchen", {"type": "order_updated", "order_id": order_id})
+    await hub.publish(evento)
     return {"ok": True, "estado": estado}
 
 @app.post("/orders/{order_id}/cancel")
 async def cancel_order(order_id: int, request: Request):
-    con = db()
-    cur = con.cursor()
-    cur.execute("UPDATE orders SET anulada=1, updated_at=datetime('now') WHERE id=?", (order_id,))
-    con.commit()
-    
+    def escribir(con):
+        actualizar_resumenes(con, order_id, -1)
+        cur = con.execute("UPDATE orders SET anulada=1, updated_at=datetime('now') WHERE id=?", (order_id,))
+        if cur.rowcount == 0:
+            raise HTTPException(404, "Orden no encontrada")
+
+        return evento_orden(con, order_id, "order_cancelled")
+
+    evento = await en_db(escribir)
     log_audit(action="CANCEL", entity="orders", entity_id=order_id, ip=request.client.host if request.client else None)
-    
-    con.close()
-    await hub.broadcast("kitchen", {"type": "order_cancelled", "order_id": order_id})
+    await hub.publish(evento)
     return {"ok": True}
 
 # DESCUENTOS
 @app.post("/discounts")
 async def create_discount(payload: DiscountIn, request: Request):
-    con = db()
-    cur = con.cursor()
-    
-    cur.execute("""INSERT INTO discounts(order_id, tipo, valor, motivo, aplicado_por)
-                   VALUES(?,?,?,?,?)""",
-                (payload.order_id, payload.tipo, payload.valor, payload.motivo, payload.aplicado_por))
-    did = cur.lastrowid
-    
-    # Recalcular totales
-    calcular_totales_order(payload.order_id, con)
-    
-    log_audit(user_nombre=payload.aplicado_por, action="CREATE", entity="discounts", 
+    valor = a_centavos(payload.valor)  # centavos, o centésimos de punto si es porcentaje
+
+    def escribir(con):
+        cur = con.cursor()
+
+        # Verificar que la orden exista
+        if not cur.execute("SELECT 1 FROM orders WHERE id=?", (payload.order_id,)).fetchone():
+            raise HTTPException(404, "Orden no encontrada")
+
+        actualizar_resumenes(con, payload.order_id, -1, items=False)
+
+        cur.execute("""INSERT INTO discounts(order_id, tipo, valor, motivo, aplicado_por)
+                       VALUES(?,?,?,?,?)""",
+                    (payload.order_id, payload.tipo, valor, payload.motivo, payload.aplicado_por))
+        did = cur.lastrowid
+
+        # Actualizar totales
+        aplicar_delta_totales(con, payload.order_id, **delta_descuento(payload.tipo, valor))
+        actualizar_resumenes(con, payload.order_id, +1, items=False)
+
+        return did, evento_orden(con, payload.order_id, "discount_applied")
+
+    did, evento = await en_db(escribir)
+    log_audit(user_nombre=payload.aplicado_por, action="CREATE", entity="discounts",
               entity_id=did, data=payload.dict(), ip=request.client.host if request.client else None)
-    
-    con.commit()
-    con.close()
-    
-    await hub.broadcast("kitchen", {"type": "discount_applied", "order_id": payload.order_id})
+    await hub.publish(evento)
     return {"ok": True, "id": did}
 
 @app.get("/discounts/{order_id}")
 def get_discounts(order_id: int):
-    con = db()
-    rows = con.execute("SELECT * FROM discounts WHERE order_id=?", (order_id,)).fetchall()
-    con.close()
-    return [dict(r) for r in rows]
+    rows = filas_de_orden("SELECT * FROM discounts WHERE order_id=?", order_id)
+    return [{**dict(r), "valor": a_pesos(r["valor"])} for r in rows]
 
 @app.delete("/discounts/{discount_id}")
 async def delete_discount(discount_id: int, request: Request):
-    con = db()
-    cur = con.cursor()
-    
-    # Obtener order_id antes de borrar
-    discount = cur.execute("SELECT order_id FROM discounts WHERE id=?", (discount_id,)).fetchone()
-    if not discount:
-        con.close()
-        raise HTTPException(404, "Descuento no encontrado")
-    
-    order_id = discount["order_id"]
-    cur.execute("DELETE FROM discounts WHERE id=?", (discount_id,))
-    
-    # Recalcular totales
-    calcular_totales_order(order_id, con)
-    
-    log_audit(action="DELETE", entity="discounts", entity_id=discount_id, 
+    def escribir(con):
+        cur = con.cursor()
+
+        # Obtener order_id antes de borrar
+        discount = cur.execute("SELECT order_id, tipo, valor FROM discounts WHERE id=?", (discount_id,)).fetchone()
+        if not discount:
+            raise HTTPException(404, "Descuento no encontrado")
+
+        order_id = discount["order_id"]
+        actualizar_resumenes(con, order_id, -1, items=False)
+        cur.execute("DELETE FROM discounts WHERE id=?", (discount_id,))
+
+        # Actualizar totales
+        aplicar_delta_totales(con, order_id, **delta_descuento(discount["tipo"], -discount["valor"]))
+        actualizar_resumenes(con, order_id, +1, items=False)
+
+        return evento_orden(con, order_id, "discount_removed")
+
+    evento = await en_db(escribir)
+    log_audit(action="DELETE", entity="discounts", entity_id=discount_id,
               ip=request.client.host if request.client else None)
-    
-    con.commit()
-    con.close()
-    
-    await hub.broadcast("kitchen", {"type": "discount_removed", "order_id": order_id})
+    await hub.publish(evento)
     return {"ok": True}
 
 # PAGOS
 @app.post("/payments")
 async def create_payment(payload: PaymentIn, request: Request):
-    con = db()
-    cur = con.cursor()
-    
-    # Verificar que la orden exista
-    order = cur.execute("SELECT total, pagado FROM orders WHERE id=?", (payload.order_id,)).fetchone()
-    if not order:
-        con.close()
-        raise HTTPException(404, "Orden no encontrada")
-    
-    cur.execute("""INSERT INTO payments(order_id, metodo, monto) VALUES(?,?,?)""",
-                (payload.order_id, payload.metodo, payload.monto))
-    pid = cur.lastrowid
-    
-    # Calcular total pagado
-    total_pagado = cur.execute("""SELECT SUM(monto) as total FROM payments WHERE order_id=?""",
-                               (payload.order_id,)).fetchone()["total"] or 0
-    
-    # Marcar como pagado si se completó el pago
-    pagado = 1 if total_pagado >= order["total"] else 0
-    cur.execute("UPDATE orders SET pagado=?, updated_at=datetime('now') WHERE id=?", 
-                (pagado, payload.order_id))
-    
+    monto = a_centavos(payload.monto)
+
+    def escribir(con):
+        cur = con.cursor()
+
+        # Verificar que la orden exista
+        order = cur.execute("SELECT total, pagado FROM orders WHERE id=?", (payload.order_id,)).fetchone()
+        if not order:
+            raise HTTPException(404, "Orden no encontrada")
+
+        cur.execute("""INSERT INTO payments(order_id, metodo, monto) VALUES(?,?,?)""",
+                    (payload.order_id, payload.metodo, monto))
+        pid = cur.lastrowid
+        registrar_cobro(con, payload.order_id, monto)
+
+        # Calcular total pagado
+        total_pagado = cur.execute("""SELECT SUM(monto) as total FROM payments WHERE order_id=?""",
+                                   (payload.order_id,)).fetchone()["total"] or 0
+
+        # Marcar como pagado si se completó el pago (centavos: comparación exacta)
+        pagado = 1 if total_pagado >= order["total"] else 0
+        cur.execute("UPDATE orders SET pagado=?, updated_at=datetime('now') WHERE id=?",
+                    (pagado, payload.order_id))
+
+        return pid, pagado, evento_orden(con, payload.order_id, "payment_added")
+
+    pid, pagado, evento = await en_db(escribir)
     log_audit(action="CREATE", entity="payments", entity_id=pid, data=payload.dict(),
               ip=request.client.host if request.client else None)
-    
-    con.commit()
-    con.close()
-    
-    await hub.broadcast("kitchen", {"type": "payment_added", "order_id": payload.order_id})
+    await hub.publish(evento)
     return {"ok": True, "id": pid, "pagado": bool(pagado)}
 
 @app.get("/payments/{order_id}")
 def get_payments(order_id: int):
-    con = db()
-    rows = con.execute("SELECT * FROM payments WHERE order_id=? ORDER BY created_at", 
-                      (order_id,)).fetchall()
-    con.close()
-    return [dict(r) for r in rows]
+    rows = filas_de_orden("SELECT * FROM payments WHERE order_id=? ORDER BY created_at", order_id)
+    return [{**dict(r), "monto": a_pesos(r["monto"])} for r in rows]
 
 # TABLAS/MESAS
 @app.get("/tables")
-def tables():
-    con = db()
-    rows = con.execute("SELECT id, nombre FROM tables WHERE activo=1 ORDER BY id").fetchall()
-    con.close()
-    return [dict(r) for r in rows]
+def tables(request: Request):
+    return respuesta_catalogo(request, ("tables",), lambda d: d["tables"])
 
 # USUARIOS
 @app.get("/users")
-def users(rol: Optional[str] = None):
-    con = db()
-    if rol:
-        rows = con.execute("SELECT id, nombre, rol FROM users WHERE rol=? AND activo=1", (rol,)).fetchall()
-    else:
-        rows = con.execute("SELECT id, nombre, rol FROM users WHERE activo=1").fetchall()
-    con.close()
-    return [dict(r) for r in rows]
+def users(request: Request, rol: Optional[str] = None):
+    return respuesta_catalogo(request, ("users", rol),
+                              lambda d: [u for u in d["users"] if not rol or u["rol"] == rol])
 
 # NOTAS GENERALES
 @app.get("/notas")
 def get_notas():
-    con = db()
-    rows = con.execute("SELECT id, contenido, ts FROM notas_generales WHERE activo=1 ORDER BY id DESC LIMIT 50").fetchall()
-    con.close()
+    with db() as con:
+        rows = con.execute("SELECT id, contenido, ts FROM notas_generales WHERE activo=1 ORDER BY id DESC LIMIT 50").fetchall()
     return [dict(r) for r in rows]
 
 @app.post("/notas")
 async def create_nota(payload: dict = Body(...), request: Request = None):
-    con = db()
-    cur = con.cursor()
     contenido = payload.get("contenido", "")
-    cur.execute("INSERT INTO notas_generales(contenido) VALUES(?)", (contenido,))
-    nid = cur.lastrowid
-    con.commit()
-    
+
+    def escribir(con):
+        cur = con.cursor()
+        cur.execute("INSERT INTO notas_generales(contenido) VALUES(?)", (contenido,))
+        return cur.lastrowid
+
+    nid = await en_db(escribir)
     log_audit(action="CREATE", entity="notas", entity_id=nid, data={"contenido": contenido},
               ip=request.client.host if request.client else None)
-    
-    con.close()
-    await hub.broadcast("kitchen", {"type": "new_nota", "id": nid})
+    await hub.publish({"type": "new_nota", "id": nid})
     return {"ok": True, "id": nid}
 
 @app.delete("/notas/{nota_id}")
 async def delete_nota(nota_id: int, request: Request):
-    con = db()
-    cur = con.cursor()
-    cur.execute("UPDATE notas_generales SET activo=0, updated_at=datetime('now') WHERE id=?", (nota_id,))
-    con.commit()
-    
+    await en_db(lambda con: con.execute(
+        "UPDATE notas_generales SET activo=0, updated_at=datetime('now') WHERE id=?", (nota_id,)))
     log_audit(action="DELETE", entity="notas", entity_id=nota_id, ip=request.client.host if request.client else None)
-    
-    con.close()
-    await hub.broadcast("kitchen", {"type": "nota_deleted", "id": nota_id})
+    await hub.publish({"type": "nota_deleted", "id": nota_id})
     return {"ok": True}
 
 # ESTADÍSTICAS
-@app.get("/stats/today")
-def stats_today():
-    con = db()
-    today = datetime.utcnow().date().isoformat()
-    
-    total_vendido = con.execute("""
-        SELECT SUM(total) as total FROM orders 
-        WHERE DATE(ts) = ? AND anulada=0
-    """, (today,)).fetchone()["total"] or 0
-    
-    total_comandas = con.execute("""
-        SELECT COUNT(*) as count FROM orders 
-        WHERE DATE(ts) = ? AND anulada=0
-    """, (today,)).fetchone()["count"]
-    
-    por_mesa = con.execute("""
-        SELECT t.nombre as mesa, SUM(o.total) as total, COUNT(*) as comandas
+def calcular_stats_dia(con, fecha: str) -> dict:
+    """Todas las estadísticas de un día en una sola pasada.
+
+    Una única consulta trae las órdenes del día con sus items (una fila por
+    item) y los agregados se acumulan en Python mientras se recorre el cursor.
+    """
+    desde, hasta = rango_dia(fecha)
+    total_vendido = 0
+    total_comandas = 0
+    por_mesa: Dict[Optional[int], dict] = {}
+    por_mozo: Dict[str, dict] = {}
+    por_producto: Dict[str, dict] = {}
+    por_estado: Dict[str, int] = {}
+
+    ultima = None
+    for r in con.execute("""
+        SELECT o.id, o.table_id, t.nombre AS mesa, o.mozo_nombre, o.total, o.estado,
+               oi.product_nombre, oi.cantidad, oi.product_precio
         FROM orders o
         LEFT JOIN tables t ON t.id=o.table_id
-        WHERE DATE(o.ts) = ? AND o.anulada=0
-        GROUP BY o.table_id
-        ORDER BY total DESC
-    """, (today,)).fetchall()
-    
-    por_mozo = con.execute("""
-        SELECT mozo_nombre as mozo, SUM(total) as total, COUNT(*) as comandas
-        FROM orders
-        WHERE DATE(ts) = ? AND o.anulada=0 AND mozo_nombre IS NOT NULL
-        GROUP BY mozo_nombre
-        ORDER BY total DESC
-    """, (today,)).fetchall()
-    
-    top_productos = con.execute("""
-        SELECT oi.product_nombre, SUM(oi.cantidad) as vendidos, 
-               SUM(oi.product_precio * oi.cantidad) as ingresos
-        FROM order_items oi
-        JOIN orders o ON o.id = oi.order_id
-        WHERE DATE(o.ts) = ? AND o.anulada=0
-        GROUP BY oi.product_nombre
-        ORDER BY vendidos DESC
-        LIMIT 10
-    """, (today,)).fetchall()
-    
-    por_estado = con.execute("""
-        SELECT estado, COUNT(*) as count
-        FROM orders
-        WHERE DATE(ts) = ? AND anulada=0
-        GROUP BY estado
-    """, (today,)).fetchall()
-    
-    con.close()
+        LEFT JOIN order_items oi ON oi.order_id = o.id
+        WHERE o.ts >= ? AND o.ts < ? AND o.anulada=0
+        ORDER BY o.id
+    """, (desde, hasta)):
+        # Los datos de la orden se cuentan sólo en su primera fila
+        if r["id"] != ultima:
+            ultima = r["id"]
+            total = r["total"] or 0
+            total_vendido += total
+            total_comandas += 1
+
+            mesa = por_mesa.setdefault(r["table_id"], {"mesa": r["mesa"], "total": 0, "comandas": 0})
+            mesa["total"] += total
+            mesa["comandas"] += 1
+
+            if r["mozo_nombre"] is not None:
+                mozo = por_mozo.setdefault(r["mozo_nombre"], {"mozo": r["mozo_nombre"], "total": 0, "comandas": 0})
+                mozo["total"] += total
+                mozo["comandas"] += 1
+
+            por_estado[r["estado"]] = por_estado.get(r["estado"], 0) + 1
+
+        if r["product_nombre"] is not None:
+            prod = por_producto.setdefault(r["product_nombre"],
+                                           {"product_nombre": r["product_nombre"], "vendidos": 0, "ingresos": 0})
+            prod["vendidos"] += r["cantidad"]
+            prod["ingresos"] += r["product_precio"] * r["cantidad"]
+
+    # Se acumula en centavos (enteros, exacto) y se pasa a pesos sólo al responder
     return {
-        "fecha": today,
-        "total_vendido": total_vendido,
+        "fecha": fecha,
+        "total_vendido": a_pesos(total_vendido),
         "total_comandas": total_comandas,
-        "por_mesa": [dict(r) for r in por_mesa],
-        "por_mozo": [dict(r) for r in por_mozo],
-        "top_productos": [dict(r) for r in top_productos],
-        "por_estado": [dict(r) for r in por_estado]
+        "por_mesa": [{**m, "total": a_pesos(m["total"])}
+                     for m in sorted(por_mesa.values(), key=lambda x: x["total"], reverse=True)],
+        "por_mozo": [{**m, "total": a_pesos(m["total"])}
+                     for m in sorted(por_mozo.values(), key=lambda x: x["total"], reverse=True)],
+        "top_productos": [{**p, "ingresos": a_pesos(p["ingresos"])}
+                          for p in sorted(por_producto.values(), key=lambda x: x["vendidos"], reverse=True)[:10]],
+        "por_estado": [{"estado": e, "count": n} for e, n in sorted(por_estado.items())]
+    }
+
+# Stats del día cacheadas por versión de órdenes: cualquier cambio registrado
+# en order_changes (alta, estado, anulación, descuento, pago) las invalida
+_stats_cache = {"fecha": None, "version": None, "data": None}
+
+@app.get("/stats/today")
+def stats_today():
+    today = datetime.utcnow().date().isoformat()
+
+    with db() as con:
+        version = version_actual(con)
+        if _stats_cache["fecha"] == today and _stats_cache["version"] == version:
+            return _stats_cache["data"]
+        data = calcular_stats_dia(con, today)
+
+    _stats_cache.update(fecha=today, version=version, data=data)
+    return data
+
+@app.get("/stats/range")
+def stats_range(desde: str, hasta: str):
+    """Ventas entre dos fechas (inclusive) leídas de los resúmenes diarios"""
+    d, _ = rango_dia(desde)
+    _, h = rango_dia(hasta)
+    rango = (d, h)
+
+    with db() as con:
+        dias = con.execute("""SELECT fecha, total, comandas, cobrado FROM daily_sales
+                              WHERE fecha >= ? AND fecha < ? ORDER BY fecha""", rango).fetchall()
+        por_mesa = con.execute("""
+            SELECT t.nombre as mesa, SUM(s.total) as total, SUM(s.comandas) as comandas
+            FROM daily_table_sales s
+            LEFT JOIN tables t ON t.id = s.table_id
+            WHERE s.fecha >= ? AND s.fecha < ?
+            GROUP BY s.table_id
+            ORDER BY total DESC
+        """, rango).fetchall()
+        por_mozo = con.execute("""
+            SELECT mozo, SUM(total) as total, SUM(comandas) as comandas
+            FROM daily_waiter_sales
+            WHERE fecha >= ? AND fecha < ?
+            GROUP BY mozo
+            ORDER BY total DESC
+        """, rango).fetchall()
+        top_productos = con.execute("""
+            SELECT product_nombre, SUM(vendidos) as vendidos, SUM(ingresos) as ingresos
+            FROM daily_product_sales
+            WHERE fecha >= ? AND fecha < ?
+            GROUP BY product_nombre
+            ORDER BY vendidos DESC
+            LIMIT 10
+        """, rango).fetchall()
+
+    return {
+        "desde": desde,
+        "hasta": hasta,
+        "total_vendido": a_pesos(sum(r["total"] for r in dias)),
+        "total_comandas": sum(r["comandas"] for r in dias),
+        "total_cobrado": a_pesos(sum(r["cobrado"] for r in dias)),
+        "por_dia": [{**dict(r), "total": a_pesos(r["total"]), "cobrado": a_pesos(r["cobrado"])} for r in dias],
+        "por_mesa": [{**dict(r), "total": a_pesos(r["total"])} for r in por_mesa],
+        "por_mozo": [{**dict(r), "total": a_pesos(r["total"])} for r in por_mozo],
+        "top_productos": [{**dict(r), "ingresos": a_pesos(r["ingresos"])} for r in top_productos]
     }
 
+@app.post("/api/admin/totales")
+async def recalcular_totales(request: Request, desde: Optional[str] = None, hasta: Optional[str] = None,
+                             reparar: bool = False):
+    """Verifica (y con reparar=true corrige) los totales de las órdenes de un rango de fechas"""
+    eventos = []
+    # En un hilo aparte: espera al escritor lote por lote y no debe frenar el event loop
+    resultado = await asyncio.to_thread(verificar_totales, desde, hasta, reparar, eventos=eventos)
+    for evento in eventos:
+        await hub.publish(evento)
+    if resultado["reparadas"]:
+        log_audit(action="REPAIR_TOTALES", entity="orders",
+                  data={"desde": desde, "hasta": hasta, "reparadas": resultado["reparadas"]},
+                  ip=request.client.host if request.client else None)
+    return resultado
+
 # EXPORTAR
+def pesos_sql(expr: str) -> str:
+    """Importe en centavos como texto en pesos con dos decimales, para el CSV"""
+    return f"printf('%.2f', ({expr}) / 100.0)"
+
+COLUMNAS_ORDEN = (f"o.id, o.ts, t.nombre as mesa, o.mozo_nombre, {pesos_sql('o.subtotal')} as subtotal, "
+                  f"{pesos_sql('o.descuento_total')} as descuento_total, {pesos_sql('o.total')} as total, "
+                  "o.estado, o.anulada")
+CABECERA_ORDEN = ['ID', 'Fecha/Hora', 'Mesa', 'Mozo', 'Subtotal', 'Descuento', 'Total', 'Estado', 'Anulada']
+
+EXTRA_ITEM = "SELECT COALESCE(SUM(m.precio_extra), 0) FROM order_item_modifiers m WHERE m.order_item_id = oi.id"
+
+# detalle -> (consulta, columnas extra de la cabecera)
+EXPORTS = {
+    None: (f"""SELECT {COLUMNAS_ORDEN}
+               FROM orders o
+               LEFT JOIN tables t ON t.id=o.table_id
+               WHERE o.ts >= ? AND o.ts < ?
+               ORDER BY o.id""", []),
+    "items": (f"""SELECT {COLUMNAS_ORDEN}, oi.product_nombre, {pesos_sql('oi.product_precio')}, oi.cantidad,
+                         (SELECT group_concat(m.modifier_nombre, ' + ') FROM order_item_modifiers m
+                          WHERE m.order_item_id = oi.id) as modificadores,
+                         {pesos_sql(EXTRA_ITEM)} as precio_extra,
+                         oi.notas
+                  FROM orders o
+                  LEFT JOIN tables t ON t.id=o.table_id
+                  JOIN order_items oi ON oi.order_id = o.id
+                  WHERE o.ts >= ? AND o.ts < ?
+                  ORDER BY o.id, oi.id""",
+              ['Producto', 'Precio', 'Cantidad', 'Modificadores', 'Extra modificadores', 'Notas']),
+    "pagos": (f"""SELECT {COLUMNAS_ORDEN}, p.metodo, {pesos_sql('p.monto')}, p.created_at
+                  FROM orders o
+                  LEFT JOIN tables t ON t.id=o.table_id
+                  JOIN payments p ON p.order_id = o.id
+                  WHERE o.ts >= ? AND o.ts < ?
+                  ORDER BY o.id, p.id""",
+              ['Método de pago', 'Monto', 'Fecha/Hora pago']),
+}
+
+def filas_cursor(cur, fuente: int):
+    """(id de la orden, fuente, fila) de cada fila del cursor, leyendo de a EXPORT_LOTE"""
+    while True:
+        filas = cur.fetchmany(EXPORT_LOTE)
+        if not filas:
+            return
+        for r in filas:
+            yield r[0], fuente, r
+
+def filas_export(desde: str, hasta: str, detalle: Optional[str]):
+    """Genera el CSV de a EXPORT_LOTE filas sin cargar el resultado entero.
+
+    Abre su propia conexión de sólo lectura (no una del pool) porque el
+    generador se recorre desde varios hilos del threadpool mientras se envía
+    la respuesta y puede durar lo que tarde el cliente en bajarla: con una
+    del pool la dejaría ocupada todo ese tiempo.
+    Si el rango toca meses archivados, la misma consulta corre también sobre
+    cada archivo y las filas se intercalan por id de orden; una orden que está
+    en los dos lados (archivado a medias) sale sólo de la base caliente.
+    """
+    sql, extra = EXPORTS[detalle]
+    salida = io.StringIO()
+    writer = csv.writer(salida)
+    writer.writerow(CABECERA_ORDEN + extra)
+
+    con = sqlite3.connect(uri_archivo(DB), uri=True, timeout=DB_BUSY_TIMEOUT, check_same_thread=False)
+    fuentes = [con]
+    try:
+        con.row_factory = sqlite3.Row
+        aplicar_perfil(con)
+        fuentes += [abrir_archivo(mes) for mes in meses_archivados(con, desde, hasta)]
+        cursores = [fuente.execute(sql, (desde, hasta)) for fuente in fuentes]
+        ultima_caliente = None
+        escritas = 0
+        filas = (heapq.merge(*(filas_cursor(cur, n) for n, cur in enumerate(cursores)), key=lambda x: x[:2])
+                 if len(cursores) > 1 else filas_cursor(cursores[0], 0))
+        for order_id, fuente, r in filas:
+            if fuente == 0:
+                ultima_caliente = order_id
+            elif order_id == ultima_caliente:
+                continue
+            r = list(r)
+            r[8] = 'SI' if r[8] else 'NO'
+            writer.writerow(r)
+            escritas += 1
+            if escritas % EXPORT_LOTE == 0:
+                yield salida.getvalue().encode()
+                salida.seek(0)
+                salida.truncate()
+        for cur in cursores:
+            cur.close()
+    finally:
+        for fuente in fuentes:
+            fuente.close()
+    if salida.tell():
+        yield salida.getvalue().encode()
+
+def comprimir(partes):
+    """gzip en streaming sobre un iterador de bytes"""
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for parte in partes:
+        comprimido = gz.compress(parte)
+        if comprimido:
+            yield comprimido
+    yield gz.flush()
+
 @app.get("/export/orders")
-def export_orders(fecha: Optional[str] = None):
-    con = db()
-    if fecha:
-        rows = con.execute("""
-            SELECT o.id, o.ts, t.nombre as mesa, o.mozo_nombre, o.subtotal, 
-                   o.descuento_total, o.total, o.estado, o.anulada
-            FROM orders o
-            LEFT JOIN tables t ON t.id=o.table_id
-            WHERE DATE(o.ts) = ?
-            ORDER BY o.id
-        """, (fecha,)).fetchall()
-    else:
-        today = datetime.utcnow().date().isoformat()
-        rows = con.execute("""
-            SELECT o.id, o.ts, t.nombre as mesa, o.mozo_nombre, o.subtotal,
-                   o.descuento_total, o.total, o.estado, o.anulada
-            FROM orders o
-            LEFT JOIN tables t ON t.id=o.table_id
-            WHERE DATE(o.ts) = ?
-            ORDER BY o.id
-        """, (today,)).fetchall()
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['ID', 'Fecha/Hora', 'Mesa', 'Mozo', 'Subtotal', 'Descuento', 'Total', 'Estado', 'Anulada'])
-    
-    for r in rows:
-        writer.writerow([
-            r['id'], r['ts'], r['mesa'], r['mozo_nombre'], 
-            r['subtotal'], r['descuento_total'], r['total'], 
-            r['estado'], 'SI' if r['anulada'] else 'NO'
-        ])
-    
-    con.close()
-    output.seek(0)
+def export_orders(fecha: Optional[str] = None, desde: Optional[str] = None, hasta: Optional[str] = None,
+                  detalle: Optional[str] = None, gzip: bool = False):
+    """CSV de comandas de un día (`fecha`) o de un rango `desde`/`hasta` inclusive.
+
+    `detalle=items` exporta una fila por item y `detalle=pagos` una por pago;
+    `gzip=true` comprime la descarga.
+    """
+    if detalle not in EXPORTS:
+        raise HTTPException(400, "detalle debe ser 'items' o 'pagos'")
+    hoy = datetime.utcnow().date().isoformat()
+    dia_desde = desde or fecha or hoy
+    dia_hasta = hasta or fecha or desde or hoy
+    inicio, _ = rango_dia(dia_desde)
+    _, fin = rango_dia(dia_hasta)
+    if fin <= inicio:
+        raise HTTPException(400, "hasta no puede ser anterior a desde")
+
+    nombre = f"comandas_{dia_desde}" if dia_desde == dia_hasta else f"comandas_{dia_desde}_{dia_hasta}"
+    if detalle:
+        nombre += f"_{detalle}"
+    contenido = filas_export(inicio, fin, detalle)
+    if gzip:
+        return StreamingResponse(
+            comprimir(contenido),
+            media_type="application/gzip",
+            headers={"Content-Disposition": f"attachment; filename={nombre}.csv.gz"}
+        )
     return StreamingResponse(
-        iter([output.getvalue()]),
+        contenido,
         media_type="text/csv",
-        headers={"Content-Disposition": f"attachment; filename=comandas_{datetime.utcnow().date()}.csv"}
+        headers={"Content-Disposition": f"attachment; filename={nombre}.csv"}
     )
 
+# EXPORT COLUMNAR (Parquet, requiere pyarrow)
+# tabla -> (consulta de un día, columnas con su tipo). Todas las filas van al día de su orden
+PARQUET_TABLAS = {
+    "orders": ("""SELECT o.id, o.table_id, t.nombre as mesa, o.user_id, o.mozo_nombre, o.subtotal,
+                         o.descuento_total, o.total, o.estado, o.anulada, o.pagado, o.ts, o.updated_at
+                  FROM orders o LEFT JOIN tables t ON t.id = o.table_id
+                  WHERE o.ts >= ? AND o.ts < ? ORDER BY o.id""",
+               [("id", "int64"), ("table_id", "int64"), ("mesa", "string"), ("user_id", "int64"),
+                ("mozo_nombre", "string"), ("subtotal", "dinero"), ("descuento_total", "dinero"),
+                ("total", "dinero"), ("estado", "string"), ("anulada", "bool"), ("pagado", "bool"),
+                ("ts", "timestamp"), ("updated_at", "timestamp")]),
+    "order_items": ("""SELECT oi.id, oi.order_id, oi.product_id, oi.product_nombre, oi.product_precio,
+                              oi.cantidad, oi.notas, oi.created_at
+                       FROM order_items oi JOIN orders o ON o.id = oi.order_id
+                       WHERE o.ts >= ? AND o.ts < ? ORDER BY oi.id""",
+                    [("id", "int64"), ("order_id", "int64"), ("product_id", "int64"), ("product_nombre", "string"),
+                     ("product_precio", "dinero"), ("cantidad", "int64"), ("notas", "string"),
+                     ("created_at", "timestamp")]),
+    "order_item_modifiers": ("""SELECT m.id, m.order_item_id, oi.order_id, m.modifier_id, m.modifier_nombre,
+                                       m.precio_extra, m.created_at
+                                FROM order_item_modifiers m
+                                JOIN order_items oi ON oi.id = m.order_item_id
+                                JOIN orders o ON o.id = oi.order_id
+                                WHERE o.ts >= ? AND o.ts < ? ORDER BY m.id""",
+                             [("id", "int64"), ("order_item_id", "int64"), ("order_id", "int64"),
+                              ("modifier_id", "int64"), ("modifier_nombre", "string"), ("precio_extra", "dinero"),
+                              ("created_at", "timestamp")]),
+    "discounts": ("""SELECT d.id, d.order_id, d.tipo, d.valor, d.motivo, d.aplicado_por, d.created_at
+                     FROM discounts d JOIN orders o ON o.id = d.order_id
+                     WHERE o.ts >= ? AND o.ts < ? ORDER BY d.id""",
+                  [("id", "int64"), ("order_id", "int64"), ("tipo", "string"), ("valor", "dinero"),
+                   ("motivo", "string"), ("aplicado_por", "string"), ("created_at", "timestamp")]),
+    "payments": ("""SELECT p.id, p.order_id, p.metodo, p.monto, p.created_at
+                    FROM payments p JOIN orders o ON o.id = p.order_id
+                    WHERE o.ts >= ? AND o.ts < ? ORDER BY p.id""",
+                 [("id", "int64"), ("order_id", "int64"), ("metodo", "string"), ("monto", "dinero"),
+                  ("created_at", "timestamp")]),
+}
+
+def exportar_parquet(destino: str = PARQUET_DIR, desde: Optional[str] = None) -> dict:
+    """Exporta a Parquet (zstd) los días cerrados que todavía no se exportaron.
+
+    Deja un archivo por tabla y por día en `<destino>/<tabla>/fecha=YYYY-MM-DD/`
+    (particiones estilo Hive, las lee directo pandas/pyarrow/DuckDB) y guarda
+    en `_estado.json` el último día exportado y cuándo corrió: la próxima
+    corrida sigue desde ahí y además reexporta los días ya exportados que
+    tengan órdenes modificadas desde entonces (`updated_at`: comandas que
+    seguían abiertas a la medianoche y se cobraron, descuentos, anulaciones).
+    El día en curso no se exporta porque todavía cambia; `desde` fuerza a
+    reexportar a partir de esa fecha. Los días de meses archivados se leen de
+    la base caliente y del archivo del mes (ver abrir_archivo).
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise HTTPException(501, "El export Parquet necesita pyarrow: pip install pyarrow")
+
+    # Los importes van como decimal(14, 2): exactos, en pesos
+    tipos = {"int64": pa.int64(), "dinero": pa.decimal128(14, 2), "string": pa.string(),
+             "bool": pa.bool_(), "timestamp": pa.timestamp("s")}
+    esquemas = {tabla: pa.schema([(nombre, tipos[tipo]) for nombre, tipo in columnas])
+                for tabla, (_, columnas) in PARQUET_TABLAS.items()}
+
+    estado_path = os.path.join(destino, "_estado.json")
+    estado = {}
+    if os.path.exists(estado_path):
+        with open(estado_path) as f:
+            estado = json.load(f)
+
+    ayer = (datetime.utcnow().date() - timedelta(days=1)).isoformat()
+    archivados: Dict[str, sqlite3.Connection] = {}
+    with db() as con, ExitStack() as abiertos:
+        # Antes de leer nada: lo que cambie durante la corrida se reexporta en la próxima
+        exportado = con.execute("SELECT datetime('now')").fetchone()[0]
+        reexportar = []
+        if estado.get("ultimo_dia"):
+            # Estados de antes de guardar `exportado`: lo modificado después de ese día
+            cambios_desde = estado.get("exportado") or rango_dia(estado["ultimo_dia"])[1]
+            reexportar = [r["dia"] for r in con.execute(
+                "SELECT DISTINCT substr(ts, 1, 10) AS dia FROM orders WHERE updated_at >= ? AND ts < ?",
+                (cambios_desde, rango_dia(estado["ultimo_dia"])[1]))]
+        if desde:
+            rango_dia(desde)  # valida el formato
+            primero = desde
+        elif estado.get("ultimo_dia"):
+            primero = (datetime.fromisoformat(estado["ultimo_dia"]) + timedelta(days=1)).date().isoformat()
+        else:
+            row = con.execute("SELECT substr(MIN(ts), 1, 10) AS dia FROM orders").fetchone()
+            mes = con.execute("SELECT MIN(mes) FROM archivo_meses").fetchone()[0]
+            primero = min(filter(None, [row["dia"], mes and f"{mes}-01"]), default=ayer)
+        fin_rango = rango_dia(ayer)[1]
+        fuentes = [con]
+        if primero <= ayer:
+            for mes in meses_archivados(con, primero, fin_rango):
+                archivados[mes] = abiertos.enter_context(closing(abrir_archivo(mes)))
+                fuentes.append(archivados[mes])
+        # Sólo los días con comandas (lectura por índice, sin recorrer día por día)
+        dias = sorted({r["dia"] for fuente in fuentes for r in fuente.execute(
+            "SELECT DISTINCT substr(ts, 1, 10) AS dia FROM orders WHERE ts >= ? AND ts < ?",
+            (primero, fin_rango))}) if primero <= ayer else []
+        dias = sorted(set(dias).union(reexportar))
+
+        archivos = 0
+        for dia in dias:
+            inicio, fin = rango_dia(dia)
+            if dia[:7] not in archivados and meses_archivados(con, inicio, fin):
+                archivados[dia[:7]] = abiertos.enter_context(closing(abrir_archivo(dia[:7])))
+            fuentes_dia = [con] + ([archivados[dia[:7]]] if dia[:7] in archivados else [])
+            for tabla, (sql, columnas) in PARQUET_TABLAS.items():
+                filas = []
+                # Una fila archivada que sigue también en la caliente (archivado a medias) va una vez
+                vistas = set()
+                for r in (r for fuente in fuentes_dia for r in fuente.execute(sql, (inicio, fin))):
+                    if r["id"] in vistas:
+                        continue
+                    vistas.add(r["id"])
+                    fila = {}
+                    for nombre, tipo in columnas:
+                        valor = r[nombre]
+                        if tipo == "timestamp" and valor is not None:
+                            valor = datetime.strptime(valor, "%Y-%m-%d %H:%M:%S")
+                        elif tipo == "bool" and valor is not None:
+                            valor = bool(valor)
+                        elif tipo == "dinero" and valor is not None:
+                            valor = Decimal(valor).scaleb(-2)
+                        fila[nombre] = valor
+                    filas.append(fila)
+                carpeta = os.path.join(destino, tabla, f"fecha={dia}")
+                archivo = os.path.join(carpeta, "part-0.parquet")
+                if not filas:
+                    # Al reexportar: la tabla pudo quedar sin filas ese día (un descuento borrado)
+                    if os.path.exists(archivo):
+                        os.remove(archivo)
+                    continue
+                filas.sort(key=lambda f: f["id"])
+                os.makedirs(carpeta, exist_ok=True)
+                pq.write_table(pa.Table.from_pylist(filas, schema=esquemas[tabla]), archivo + ".tmp",
+                               compression="zstd")
+                os.replace(archivo + ".tmp", archivo)
+                archivos += 1
+
+    if primero <= ayer or reexportar:
+        estado["ultimo_dia"] = ayer
+        estado["exportado"] = exportado
+        os.makedirs(destino, exist_ok=True)
+        with open(estado_path + ".tmp", "w") as f:
+            json.dump(estado, f)
+        os.replace(estado_path + ".tmp", estado_path)
+
+    return {"dias": len(dias), "reexportados": len(reexportar), "archivos": archivos,
+            "desde": dias[0] if dias else None,
+            "ultimo_dia": estado.get("ultimo_dia"), "destino": destino}
+
+@app.post("/export/parquet")
+def export_parquet(desde: Optional[str] = None):
+    """Exporta a Parquet los días nuevos desde el último export (ver exportar_parquet)"""
+    return exportar_parquet(desde=desde)
+
 # AUDIT LOG
 @app.get("/audit")
 def get_audit_log(limit: int = 100):
-    con = db()
-    rows = con.execute("""
-        SELECT * FROM audit_log 
-        ORDER BY created_at DESC 
-        LIMIT ?
-    """, (limit,)).fetchall()
-    con.close()
+    auditoria.flush()
+    with db() as con:
+        rows = con.execute("""
+            SELECT * FROM audit_log
+            ORDER BY created_at DESC
+            LIMIT ?
+        """, (limit,)).fetchall()
+        meses = [r[0] for r in con.execute("SELECT mes FROM archivo_meses ORDER BY mes DESC")] if len(rows) < limit else []
+    # Si la base caliente no alcanza, sigue por los meses archivados: todo lo
+    # archivado es más viejo que lo caliente. Un registro archivado a medias
+    # está en los dos lados y sale una sola vez.
+    vistos = {r["id"] for r in rows}
+    for mes in meses:
+        if len(rows) >= limit:
+            break
+        with closing(abrir_archivo(mes)) as arch:
+            rows += [r for r in arch.execute("SELECT * FROM audit_log ORDER BY created_at DESC LIMIT ?", (limit,))
+                     if r["id"] not in vistos][:limit - len(rows)]
     return [dict(r) for r in rows]
 
 # BACKUP AUTOMÁTICO
-def backup_database():
-    """Crea backup diario de la base de datos"""
+estado_backup = {"ultimo": None, "segundos": None, "integridad": None, "error": None}
+
+def copiar_base(origen: sqlite3.Connection, destino_path: str) -> str:
+    """Copia `origen` (ya dentro de una transacción de lectura) a `destino_path`.
+
+    Copia de a BACKUP_PAGINAS páginas, verifica con integrity_check y recién
+    entonces reemplaza el archivo final. Devuelve el resultado del check.
+    """
+    tmp_path = destino_path + ".tmp"
+    destino = sqlite3.connect(tmp_path)
+    try:
+        origen.backup(destino, pages=BACKUP_PAGINAS, sleep=BACKUP_PAUSA)
+        # El backup queda como un único archivo, sin -wal/-shm al lado
+        destino.execute("PRAGMA journal_mode = DELETE")
+        integridad = destino.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        destino.close()
+    if integridad != "ok":
+        os.remove(tmp_path)
+        raise RuntimeError(f"integrity_check del backup: {integridad}")
+    os.replace(tmp_path, destino_path)
+    return integridad
+
+def backup_database(forzar: bool = False) -> Optional[str]:
+    """Crea el backup diario con la API de backup de SQLite.
+
+    Copia de a BACKUP_PAGINAS páginas con una pausa entre pasos, así las
+    escrituras siguen entrando mientras tanto. Se escribe a un .tmp, se verifica con integrity_check y recién ahí se
+    renombra; los backups de más de BACKUP_RETENCION_DIAS días se borran.
+    """
     try:
         os.makedirs(BACKUP_DIR, exist_ok=True)
         backup_name = f"mozo_backup_{datetime.utcnow().date()}.db"
         backup_path = os.path.join(BACKUP_DIR, backup_name)
-        
-        if not os.path.exists(backup_path):
-            shutil.copy2(DB, backup_path)
-            print(f"✅ Backup creado: {backup_name}")
-            
-            # Limpiar backups antiguos (mantener últimos 7 días)
-            for f in os.listdir(BACKUP_DIR):
-                if f.startswith("mozo_backup_"):
-                    file_path = os.path.join(BACKUP_DIR, f)
-                    if os.path.getctime(file_path) < (datetime.now() - timedelta(days=7)).timestamp():
-                        os.remove(file_path)
-                        print(f"🗑️  Backup antiguo eliminado: {f}")
+
+        if os.path.exists(backup_path) and not forzar:
+            return None
+
+        inicio = time.perf_counter()
+        origen = sqlite3.connect(DB, timeout=DB_BUSY_TIMEOUT)
+        try:
+            # Una transacción de lectura abierta fija la foto de la base (WAL) para
+            # todos los pasos: las escrituras siguen entrando y la copia no se reinicia
+            origen.execute("BEGIN")
+            origen.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            integridad = copiar_base(origen, backup_path)
+        finally:
+            origen.close()
+        estado_backup.update(ultimo=backup_name, segundos=round(time.perf_counter() - inicio, 2),
+                             integridad=integridad, error=None)
+        print(f"✅ Backup creado: {backup_name}")
+
+        # Limpiar backups antiguos (mantener últimos BACKUP_RETENCION_DIAS días)
+        for f in os.listdir(BACKUP_DIR):
+            if f.startswith("mozo_backup_"):
+                file_path = os.path.join(BACKUP_DIR, f)
+                if os.path.getctime(file_path) < (datetime.now() - timedelta(days=BACKUP_RETENCION_DIAS)).timestamp():
+                    os.remove(file_path)
+                    print(f"🗑️  Backup antiguo eliminado: {f}")
+        return backup_path
     except Exception as e:
+        estado_backup["error"] = str(e)
         print(f"❌ Error en backup: {e}")
+        return None
+
+_detener_backups = threading.Event()
+
+def programar_backups():
+    """Hilo de fondo: hace el backup del día apenas arranca y después revisa cada BACKUP_REVISION_HORAS.
+
+    En modo incremental archiva el WAL cada WAL_INTERVALO segundos. De paso
+    purga el historial de cambios vencido cada CAMBIOS_PURGA_SEGUNDOS.
+    """
+    proxima_purga = time.monotonic() + CAMBIOS_PURGA_SEGUNDOS  # la primera la hace el arranque
+    while not _detener_backups.is_set():
+        if time.monotonic() >= proxima_purga:
+            try:
+                purgar_cambios()
+            except Exception as e:
+                print(f"❌ Error purgando historial de cambios: {e}")
+            proxima_purga = time.monotonic() + CAMBIOS_PURGA_SEGUNDOS
+        if BACKUP_MODO == "incremental":
+            try:
+                r = archivador.ciclo()
+                if r["segmento"]:
+                    estado_backup.update(ultimo=r["segmento"], error=None)
+            except Exception as e:
+                estado_backup["error"] = str(e)
+                print(f"❌ Error archivando WAL: {e}")
+            _detener_backups.wait(WAL_INTERVALO)
+        else:
+            backup_database()
+            _detener_backups.wait(BACKUP_REVISION_HORAS * 3600)
+
+# BACKUP INCREMENTAL (WAL)
+# Formato del WAL de SQLite: cabecera de 32 bytes y frames de 24 bytes + una página
+WAL_CABECERA = struct.Struct(">IIIIIIII")  # magic, versión, tamaño de página, checkpoint, salt1, salt2, checksum x2
+WAL_FRAME = struct.Struct(">IIIIII")       # página, tamaño de la base si es commit (si no 0), salt1, salt2, checksum x2
+
+def leer_cabecera_wal(path: str) -> Optional[dict]:
+    """Cabecera del WAL, o None si no existe o todavía está vacío"""
+    try:
+        with open(path, "rb") as f:
+            datos = f.read(WAL_CABECERA.size)
+    except FileNotFoundError:
+        return None
+    if len(datos) < WAL_CABECERA.size:
+        return None
+    magic, _, page_size, checkpoint, salt1, salt2, _, _ = WAL_CABECERA.unpack(datos)
+    if magic not in (0x377f0682, 0x377f0683):
+        return None
+    return {"page_size": page_size, "checkpoint": checkpoint, "salt": [salt1, salt2]}
+
+def leer_frames_wal(path: str, cabecera: dict, desde: int) -> tuple:
+    """Frames confirmados del WAL a partir del frame `desde`.
+
+    Devuelve (bytes de los frames, índice del frame siguiente al último
+    commit). Se corta en el primer frame con otro salt (restos de una
+    generación anterior del WAL) y se descarta lo que quede después del
+    último commit (transacciones que no llegaron a confirmarse).
+    """
+    tam_frame = WAL_FRAME.size + cabecera["page_size"]
+    salt = tuple(cabecera["salt"])
+    partes, fin, n = [], desde, desde
+    with open(path, "rb") as f:
+        f.seek(WAL_CABECERA.size + desde * tam_frame)
+        pendientes = []
+        while True:
+            frame = f.read(tam_frame)
+            if len(frame) < tam_frame:
+                break
+            _, commit, salt1, salt2, _, _ = WAL_FRAME.unpack_from(frame)
+            if (salt1, salt2) != salt:
+                break
+            pendientes.append(frame)
+            n += 1
+            if commit:
+                partes.extend(pendientes)
+                pendientes = []
+                fin = n
+    return b"".join(partes), fin
+
+class ArchivadorWAL:
+    """Backup incremental: snapshot completo + segmentos del WAL.
+
+    Con wal_autocheckpoint=0 en todas las conexiones, los frames del WAL sólo
+    llegan a la base cuando este archivador hace el checkpoint, y lo hace
+    recién después de copiarlos. Cada WAL_INTERVALO segundos toma el lock de
+    escritura (BEGIN IMMEDIATE, unos milisegundos), copia los frames nuevos a
+    un segmento de la cadena actual y hace un checkpoint PASSIVE. Cada
+    WAL_SNAPSHOT_DIAS días empieza una cadena nueva con un snapshot completo.
+
+        backups/wal/<cadena>/base.db              snapshot
+        backups/wal/<cadena>/base.json            fecha y tamaño de página
+        backups/wal/<cadena>/000001_<fecha>.wal   frames archivados en ese ciclo
+
+    Si no puede garantizar que no se perdieron frames (el WAL cambió de
+    generación sin pasar por este archivador), lo avisa y empieza una cadena
+    nueva. Para eso guarda la huella de la base (tamaño y mtime) justo después
+    de su checkpoint: sólo un checkpoint escribe la base, así que si cambió,
+    otro proceso (un script con el perfil `liviano`, por ejemplo) pasó a la
+    base frames que nunca se archivaron.
+    """
+
+    def __init__(self, db_path: str, directorio: str):
+        self.db_path = db_path
+        self.wal_path = db_path + "-wal"
+        self.directorio = directorio
+        self.estado_path = os.path.join(directorio, "_estado.json")
+        self.estado = {}
+        self._escritor = None
+        self._lock = threading.Lock()
+
+    def _conectar(self) -> sqlite3.Connection:
+        con = sqlite3.connect(self.db_path, timeout=DB_BUSY_TIMEOUT, isolation_level=None,
+                              check_same_thread=False)
+        aplicar_perfil(con)  # incluye wal_autocheckpoint = 0 en modo incremental
+        return con
+
+    def _guardar_estado(self):
+        os.makedirs(self.directorio, exist_ok=True)
+        with open(self.estado_path + ".tmp", "w") as f:
+            json.dump(self.estado, f)
+        os.replace(self.estado_path + ".tmp", self.estado_path)
+
+    def iniciar(self):
+        if os.path.exists(self.estado_path):
+            with open(self.estado_path) as f:
+                self.estado = json.load(f)
+        # Un cierre limpio dejó la base igual al final de la cadena; si el archivo
+        # cambió desde entonces (otro proceso escribió sin archivar) la cadena no sirve
+        cierre = self.estado.pop("cierre", None)
+        if cierre and cierre != self._huella():
+            self.estado.pop("cadena", None)
+        self.estado["continua_sin_salt"] = bool(cierre)
+        self._escritor = self._conectar()
+
+    def _huella(self) -> list:
+        st = os.stat(self.db_path)
+        return [st.st_size, st.st_mtime_ns]
+
+    def _inicio_segmento(self, cabecera: Optional[dict]) -> Optional[int]:
+        """Frame desde el que hay que archivar, o None si la cadena se cortó"""
+        est = self.estado
+        if not est.get("cadena"):
+            return None
+        if cabecera is not None and cabecera["salt"] == est.get("salt"):
+            return est["frame"]
+        if est.get("salt") is None or est.get("continua_sin_salt"):
+            return 0
+        if cabecera is None:
+            # Sin WAL: alguien lo truncó o lo borró a mitad de una generación
+            motivo = "el WAL desapareció"
+        else:
+            # El WAL volvió a empezar: sólo es seguro si fue justo después de nuestro
+            # último checkpoint y nadie más hizo uno (la base no cambió desde entonces)
+            siguiente = cabecera["checkpoint"] == est.get("checkpoint", -1) + 1
+            if siguiente and est.get("base") == self._huella():
+                return 0
+            motivo = (f"checkpoint {est.get('checkpoint')} -> {cabecera['checkpoint']}" if not siguiente
+                      else "otro proceso hizo un checkpoint")
+        print(f"⚠️  El WAL se reinició sin pasar por el archivador ({motivo}): "
+              f"puede haber frames sin archivar, se empieza una cadena nueva con snapshot")
+        return None
+
+    def ciclo(self, forzar_snapshot: bool = False) -> dict:
+        """Archiva los frames nuevos; empieza cadena nueva si hace falta"""
+        with self._lock:
+            if self._escritor is None:
+                raise RuntimeError("archivador del WAL no iniciado")
+            return self._ciclo(forzar_snapshot)
+
+    def _ciclo(self, forzar_snapshot: bool) -> dict:
+        est = self.estado
+        base_vieja = (est.get("creada") or "") < (datetime.utcnow() - timedelta(days=WAL_SNAPSHOT_DIAS)).isoformat()
+        lector = None
+        resultado = {"segmento": None, "bytes": 0, "snapshot": None}
+
+        self._escritor.execute("BEGIN IMMEDIATE")
+        try:
+            cabecera = leer_cabecera_wal(self.wal_path)
+            desde = self._inicio_segmento(cabecera)
+            nueva = desde is None or base_vieja or forzar_snapshot
+
+            if cabecera is not None:
+                frames, fin = leer_frames_wal(self.wal_path, cabecera, 0 if nueva else desde)
+            else:
+                frames, fin = b"", 0
+
+            if nueva:
+                # La foto de esta transacción de lectura es exactamente el estado
+                # actual: los frames hasta `fin` quedan dentro del snapshot
+                lector = self._conectar()
+                lector.execute("BEGIN")
+                lector.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+                cadena = datetime.utcnow().strftime("%Y%m%dT%H%M%S") + "_" + uuid.uuid4().hex[:6]
+                nuevo_estado = {"cadena": cadena, "creada": datetime.utcnow().isoformat(), "segmento": 0}
+            elif frames:
+                carpeta = os.path.join(self.directorio, est["cadena"])
+                est["segmento"] += 1
+                nombre = f"{est['segmento']:06d}_{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.wal"
+                with open(os.path.join(carpeta, nombre + ".tmp"), "wb") as f:
+                    f.write(frames)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(os.path.join(carpeta, nombre + ".tmp"), os.path.join(carpeta, nombre))
+                resultado.update(segmento=nombre, bytes=len(frames))
+
+            if not nueva and cabecera is not None:
+                est.update(salt=cabecera["salt"], checkpoint=cabecera["checkpoint"], frame=fin,
+                           continua_sin_salt=False)
+                self._guardar_estado()
+
+            # Con el lock de escritura tomado no entra ningún frame sin archivar
+            # entre la copia y el checkpoint
+            checkpoint = self._conectar()
+            try:
+                checkpoint.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+            finally:
+                checkpoint.close()
+            # Cómo quedó la base con nuestro checkpoint (ver _inicio_segmento)
+            base = self._huella()
+            if not nueva:
+                est["base"] = base
+                self._guardar_estado()
+        finally:
+            self._escritor.execute("ROLLBACK")
+
+        if lector is not None:
+            try:
+                carpeta = os.path.join(self.directorio, nuevo_estado["cadena"])
+                os.makedirs(carpeta, exist_ok=True)
+                copiar_base(lector, os.path.join(carpeta, "base.db"))
+                page_size = lector.execute("PRAGMA page_size").fetchone()[0]
+            finally:
+                lector.close()
+            with open(os.path.join(carpeta, "base.json"), "w") as f:
+                json.dump({"creada": nuevo_estado["creada"], "page_size": page_size}, f)
+            if cabecera is not None:
+                nuevo_estado.update(salt=cabecera["salt"], checkpoint=cabecera["checkpoint"], frame=fin)
+            else:
+                nuevo_estado.update(salt=None, checkpoint=None, frame=0)
+            nuevo_estado["base"] = base
+            self.estado = nuevo_estado
+            self._guardar_estado()
+            resultado["snapshot"] = nuevo_estado["cadena"]
+            print(f"✅ Snapshot de backup incremental: {nuevo_estado['cadena']}")
+            self.purgar()
+        return resultado
+
+    def purgar(self):
+        """Borra cadenas que ya no hacen falta para volver a cualquier momento de los últimos BACKUP_RETENCION_DIAS"""
+        limite = (datetime.utcnow() - timedelta(days=BACKUP_RETENCION_DIAS)).isoformat()
+        cadenas = self.cadenas()
+        for vieja, siguiente in zip(cadenas, cadenas[1:]):
+            if siguiente["creada"] < limite:
+                shutil.rmtree(os.path.join(self.directorio, vieja["cadena"]), ignore_errors=True)
+                print(f"🗑️  Cadena de backup antigua eliminada: {vieja['cadena']}")
+
+    def cadenas(self) -> list:
+        resultado = []
+        if not os.path.isdir(self.directorio):
+            return resultado
+        for nombre in sorted(os.listdir(self.directorio)):
+            meta = os.path.join(self.directorio, nombre, "base.json")
+            if os.path.exists(meta):
+                with open(meta) as f:
+                    creada = json.load(f)["creada"]
+                segmentos = [s for s in os.listdir(os.path.join(self.directorio, nombre)) if s.endswith(".wal")]
+                resultado.append({"cadena": nombre, "creada": creada, "segmentos": len(segmentos)})
+        return resultado
+
+    def cerrar(self):
+        """Último ciclo antes de apagar; se llama con el resto de las conexiones ya cerradas"""
+        if self._escritor is None:
+            return
+        with self._lock:
+            self._ciclo(False)
+            self._escritor.close()
+            self._escritor = None
+            # Al cerrarse la última conexión SQLite pasa el WAL a la base y lo borra:
+            # la base queda igual al final de la cadena
+            self.estado["cierre"] = self._huella()
+            self._guardar_estado()
+
+archivador = ArchivadorWAL(DB, WAL_DIR)
+
+@app.get("/api/backups")
+def listar_backups():
+    """Backups disponibles y resultado del último"""
+    archivos = sorted(f for f in os.listdir(BACKUP_DIR) if f.startswith("mozo_backup_") and f.endswith(".db")) \
+        if os.path.isdir(BACKUP_DIR) else []
+    return {"modo": BACKUP_MODO, "estado": estado_backup,
+            "archivos": [{"nombre": f, "bytes": os.path.getsize(os.path.join(BACKUP_DIR, f))} for f in archivos],
+            "cadenas": archivador.cadenas()}
+
+# ARCHIVO HISTÓRICO
+# Las órdenes cerradas (cobradas o anuladas) de más de ARCHIVO_DIAS días pasan a
+# una base por mes, archivo/mozo_YYYY-MM.db, con sus items, modificadores,
+# descuentos y pagos; el audit_log se archiva por su propia fecha. Los resúmenes
+# diarios quedan en la base caliente, así que /stats/range no lee el archivo.
+# tabla -> filas de las órdenes de un lote (los ids van en un parámetro JSON)
+TABLAS_ARCHIVO = {
+    "orders": "id IN (SELECT value FROM json_each(?))",
+    "order_items": "order_id IN (SELECT value FROM json_each(?))",
+    "order_item_modifiers": """order_item_id IN (SELECT id FROM order_items
+                                                 WHERE order_id IN (SELECT value FROM json_each(?)))""",
+    "discounts": "order_id IN (SELECT value FROM json_each(?))",
+    "payments": "order_id IN (SELECT value FROM json_each(?))",
+}
+AUDIT_ARCHIVO = {"audit_log": "id IN (SELECT value FROM json_each(?))"}
+
+INDICES_ARCHIVO = """
+CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_id ON orders(id);
+CREATE INDEX IF NOT EXISTS idx_orders_ts_anulada ON orders(ts, anulada);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_order_items_id ON order_items(id);
+CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items(order_id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_order_item_modifiers_id ON order_item_modifiers(id);
+CREATE INDEX IF NOT EXISTS idx_order_item_modifiers_item ON order_item_modifiers(order_item_id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_discounts_id ON discounts(id);
+CREATE INDEX IF NOT EXISTS idx_discounts_order ON discounts(order_id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_payments_id ON payments(id);
+CREATE INDEX IF NOT EXISTS idx_payments_order ON payments(order_id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_audit_id ON audit_log(id);
+CREATE INDEX IF NOT EXISTS idx_audit_created ON audit_log(created_at);
+"""
+
+estado_archivo = {"ultimo": None, "resultado": None, "error": None}
+
+def archivo_mes(mes: str) -> str:
+    """Ruta de la base de un mes archivado (mes = YYYY-MM)"""
+    return os.path.join(ARCHIVO_DIR, f"mozo_{mes}.db")
+
+def uri_archivo(path: str, solo_lectura: bool = True) -> str:
+    return Path(path).resolve().as_uri() + ("?mode=ro" if solo_lectura else "")
+
+def corte_archivo(con) -> Optional[str]:
+    """Día (YYYY-MM-DD) antes del cual las órdenes cerradas pueden estar archivadas"""
+    return con.execute("SELECT MAX(corte) FROM archivo_meses").fetchone()[0]
+
+def meses_archivados(con, inicio: str, fin: str) -> List[str]:
+    """Meses archivados que se cruzan con [inicio, fin)"""
+    return [r[0] for r in con.execute(
+        "SELECT mes FROM archivo_meses WHERE mes >= substr(?, 1, 7) AND mes <= substr(date(?, '-1 day'), 1, 7) ORDER BY mes",
+        (inicio, fin))]
+
+def abrir_archivo(mes: str) -> sqlite3.Connection:
+    """Conexión de sólo lectura a un mes archivado.
+
+    El archivo es `main`, así que las mismas consultas de siempre (orders,
+    order_items, payments...) leen lo archivado. La base caliente se adjunta
+    también de sólo lectura y las tablas que el archivo no tiene (mesas,
+    productos, usuarios) se ven a través de vistas TEMP con el mismo nombre.
+    """
+    path = archivo_mes(mes)
+    if not os.path.exists(path):
+        raise RuntimeError(f"Falta el archivo histórico {path}")
+    con = sqlite3.connect(uri_archivo(path), uri=True, timeout=DB_BUSY_TIMEOUT, check_same_thread=False)
+    con.row_factory = sqlite3.Row
+    con.execute("ATTACH ? AS caliente", (uri_archivo(DB),))
+    propias = {r[0] for r in con.execute("SELECT name FROM main.sqlite_master WHERE type='table'")}
+    for (tabla,) in con.execute("""SELECT name FROM caliente.sqlite_master
+                                   WHERE type='table' AND name NOT LIKE 'sqlite_%'""").fetchall():
+        if tabla not in propias:
+            con.execute(f'CREATE TEMP VIEW "{tabla}" AS SELECT * FROM caliente."{tabla}"')
+    return con
+
+def archivo_de_orden(con, order_id: int) -> Optional[sqlite3.Connection]:
+    """Mes archivado que tiene la orden, ya abierto (ver abrir_archivo), o None.
+
+    Busca del mes más nuevo al más viejo por el índice de id; sólo vale la
+    pena llamarla si la orden no está en la base caliente.
+    """
+    for (mes,) in con.execute("SELECT mes FROM archivo_meses ORDER BY mes DESC").fetchall():
+        arch = abrir_archivo(mes)
+        if arch.execute("SELECT 1 FROM orders WHERE id=?", (order_id,)).fetchone():
+            return arch
+        arch.close()
+    return None
+
+def filas_de_orden(sql: str, order_id: int) -> list:
+    """Filas de `sql` (parámetro: el id de orden) de la base caliente o, si la orden se archivó, de su mes"""
+    with db() as con:
+        filas = con.execute(sql, (order_id,)).fetchall()
+        if filas or con.execute("SELECT 1 FROM orders WHERE id=?", (order_id,)).fetchone():
+            return filas
+        arch = archivo_de_orden(con, order_id)
+    if arch is None:
+        return []
+    with closing(arch):
+        return arch.execute(sql, (order_id,)).fetchall()
+
+def preparar_archivo(arch: sqlite3.Connection):
+    """Crea en el archivo las tablas que falten, con las columnas de la base caliente.
+
+    Sin claves foráneas ni defaults: son copias. Si la base caliente ganó
+    columnas desde la última corrida, se agregan.
+    """
+    for tabla in {**TABLAS_ARCHIVO, **AUDIT_ARCHIVO}:
+        existe = arch.execute("SELECT 1 FROM main.sqlite_master WHERE type='table' AND name=?", (tabla,)).fetchone()
+        if not existe:
+            arch.execute(f"CREATE TABLE main.{tabla} AS SELECT * FROM caliente.{tabla} WHERE 0")
+            continue
+        propias = {r["name"] for r in arch.execute(f"PRAGMA main.table_info({tabla})")}
+        for r in arch.execute(f"PRAGMA caliente.table_info({tabla})").fetchall():
+            if r["name"] not in propias:
+                arch.execute(f'ALTER TABLE main.{tabla} ADD COLUMN "{r["name"]}" {r["type"]}')
+    arch.executescript(INDICES_ARCHIVO)
+
+def mover_lote(con, arch, tablas: Dict[str, str], consulta_ids: str, params: tuple, lote: int) -> int:
+    """Mueve un lote al archivo; devuelve cuántas filas de la primera tabla movió.
+
+    Es un comando del escritor: `con` es su conexión, ya dentro de la
+    transacción del lote, así nadie cambia esas filas hasta que se borran. Las
+    filas se copian tal como las ve el escritor (incluidos cambios de otros
+    comandos del mismo lote) y el archivo confirma; recién después la caliente
+    borra. Si el commit del escritor falla las filas quedan en los dos lados:
+    los lectores se quedan con la copia caliente y la próxima corrida vuelve a
+    copiar (INSERT OR REPLACE) y a borrar. Las órdenes movidas quedan en
+    order_changes, así cambia la versión (y el ETag de /orders).
+    """
+    elegidos = [r[0] for r in con.execute(consulta_ids, (*params, lote))]
+    if not elegidos:
+        return 0
+    ids = json.dumps(elegidos)
+    arch.execute("BEGIN")
+    try:
+        for tabla, filtro in tablas.items():
+            cur = con.execute(f"SELECT * FROM {tabla} WHERE {filtro}", (ids,))
+            columnas = [d[0] for d in cur.description]
+            arch.executemany(f"""INSERT OR REPLACE INTO main.{tabla} ({", ".join(f'"{c}"' for c in columnas)})
+                                 VALUES ({", ".join("?" * len(columnas))})""", cur)
+        arch.execute("COMMIT")
+    except BaseException:
+        arch.execute("ROLLBACK")
+        raise
+    # Hijas primero: los modificadores se eligen por sus items
+    for tabla, filtro in reversed(tablas.items()):
+        con.execute(f"DELETE FROM {tabla} WHERE {filtro}", (ids,))
+    if "orders" in tablas:
+        con.execute("INSERT INTO order_changes(order_id, tipo) SELECT value, 'order_archived' FROM json_each(?)",
+                    (ids,))
+    return len(elegidos)
+
+def archivar_ordenes(dias: int = ARCHIVO_DIAS, lote: int = ARCHIVO_LOTE) -> dict:
+    """Mueve al archivo mensual las órdenes cerradas de más de `dias` días y el audit_log de esa edad.
+
+    Todo lo que escribe pasa por el escritor, de a un comando por lote de
+    `lote` órdenes (ver mover_lote), así que se puede correr con el servidor
+    andando sin competir por el lock con las comandas. Las órdenes abiertas se
+    quedan en la base caliente aunque sean viejas. El mes se registra en
+    archivo_meses antes del primer borrado: desde ahí los reportes ya lo leen
+    del archivo.
+    """
+    if dias < 1:
+        raise HTTPException(400, "dias tiene que ser al menos 1 (MOZO_ARCHIVO_DIAS=0 deja el archivo apagado)")
+    inicio = time.perf_counter()
+    corte = (datetime.utcnow().date() - timedelta(days=dias)).isoformat()
+    auditoria.flush()
+    os.makedirs(ARCHIVO_DIR, exist_ok=True)
+    resultado = {"corte": corte, "meses": [], "ordenes": 0, "auditoria": 0}
+
+    with db() as con:
+        meses = {r[0] for r in con.execute("""SELECT DISTINCT substr(ts, 1, 7) FROM orders
+                                              WHERE ts < ? AND (estado = 'cobrado' OR anulada = 1)""", (corte,))}
+        meses |= {r[0] for r in con.execute("SELECT DISTINCT substr(created_at, 1, 7) FROM audit_log WHERE created_at < ?",
+                                            (corte,))}
+    for mes in sorted(meses):
+        desde = f"{mes}-01"
+        hasta = min(corte, (datetime.strptime(desde, "%Y-%m-%d") + timedelta(days=32)).strftime("%Y-%m-01"))
+        escritor.enviar(lambda con: con.execute("""INSERT INTO archivo_meses(mes, corte) VALUES(?, ?)
+                                                   ON CONFLICT(mes) DO UPDATE SET corte = max(corte, excluded.corte)""",
+                                                (mes, corte))).result()
+
+        # La usa el hilo del escritor: sólo se toca desde sus comandos
+        arch = sqlite3.connect(uri_archivo(archivo_mes(mes), solo_lectura=False), uri=True,
+                               timeout=DB_BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+        arch.row_factory = sqlite3.Row
+        try:
+            arch.execute("ATTACH ? AS caliente", (uri_archivo(DB),))
+            escritor.enviar(lambda con: preparar_archivo(arch)).result()
+            ordenes = registros = 0
+            # Entre lotes se mira si el servidor se está apagando: no escribir con el pool cerrado
+            while not _detener_archivo.is_set() and (n := escritor.enviar(lambda con: mover_lote(
+                    con, arch, TABLAS_ARCHIVO,
+                    """SELECT id FROM orders WHERE ts >= ? AND ts < ?
+                       AND (estado = 'cobrado' OR anulada = 1) ORDER BY id LIMIT ?""",
+                    (desde, hasta), lote)).result()):
+                ordenes += n
+            while not _detener_archivo.is_set() and (n := escritor.enviar(lambda con: mover_lote(
+                    con, arch, AUDIT_ARCHIVO,
+                    "SELECT id FROM audit_log WHERE created_at >= ? AND created_at < ? ORDER BY id LIMIT ?",
+                    (desde, hasta), lote * 10)).result()):
+                registros += n
+        finally:
+            arch.close()
+
+        escritor.enviar(lambda con: con.execute(
+            """UPDATE archivo_meses SET ordenes = ordenes + ?, auditoria = auditoria + ?,
+                                        actualizado = datetime('now') WHERE mes = ?""",
+            (ordenes, registros, mes))).result()
+        resultado["meses"].append({"mes": mes, "ordenes": ordenes, "auditoria": registros})
+        resultado["ordenes"] += ordenes
+        resultado["auditoria"] += registros
+        print(f"🗄️  {mes}: {ordenes} órdenes y {registros} registros de auditoría archivados")
+        if _detener_archivo.is_set():
+            print("⏹️  Archivo interrumpido por el apagado; sigue en la próxima corrida")
+            break
+
+    resultado["segundos"] = round(time.perf_counter() - inicio, 2)
+    return resultado
+
+_detener_archivo = threading.Event()
+
+def programar_archivo():
+    """Hilo de fondo: una vez por día, pasada la ARCHIVO_HORA (UTC), archiva lo viejo"""
+    while not _detener_archivo.is_set():
+        ahora = datetime.utcnow()
+        if ahora.hour >= ARCHIVO_HORA and estado_archivo["ultimo"] != ahora.date().isoformat():
+            try:
+                estado_archivo.update(resultado=archivar_ordenes(), error=None)
+            except Exception as e:
+                estado_archivo["error"] = str(e)
+                print(f"❌ Error archivando órdenes: {e}")
+            estado_archivo["ultimo"] = ahora.date().isoformat()
+        _detener_archivo.wait(3600)
+
+@app.get("/api/archivo")
+def listar_archivo():
+    """Meses archivados y resultado de la última corrida"""
+    with db() as con:
+        meses = [dict(r) for r in con.execute("SELECT * FROM archivo_meses ORDER BY mes")]
+    for m in meses:
+        path = archivo_mes(m["mes"])
+        m["bytes"] = os.path.getsize(path) if os.path.exists(path) else None
+    return {"dias": ARCHIVO_DIAS, "estado": estado_archivo, "meses": meses}
+
+@app.post("/api/admin/archivar")
+def archivar(request: Request, dias: int = ARCHIVO_DIAS):
+    """Corre el archivo histórico ahora (lo mismo que la corrida nocturna)"""
+    resultado = archivar_ordenes(dias)
+    log_audit(action="ARCHIVE", entity="orders",
+              data={"dias": dias, "corte": resultado["corte"], "ordenes": resultado["ordenes"]},
+              ip=request.client.host if request.client else None)
+    return resultado
 
 # STARTUP
+_hilos_fondo: List[threading.Thread] = []
+
+def iniciar_hilo(target, nombre: str):
+    """Arranca un hilo de fondo y lo anota para esperarlo al apagar"""
+    hilo = threading.Thread(target=target, name=nombre, daemon=True)
+    hilo.start()
+    _hilos_fondo.append(hilo)
+
 @app.on_event("startup")
 def on_startup():
     print("🚀 Iniciando El Café de los Pinos...")
-    
-    # Crear backup
-    backup_database()
-    
+    local_ip = get_local_ip()
+    print(f"📡 IP Local: {local_ip}")
+    print(f"🌐 Acceso local: http://localhost:8000")
+    print(f"📱 Acceso LAN: http://{local_ip}:8000")
+
+    purgar_cambios()
+    inicializar_resumenes()
+    escritor.iniciar()
+    auditoria.iniciar()
+    catalogo.cargar()
+
+    # Los hilos de fondo arrancan después del escritor: si no, lo que mandan por él
+    # (la purga del historial, los lotes del archivo) correría en línea, por fuera
+    # Backups en segundo plano (el primero no demora el arranque)
+    _detener_backups.clear()
+    if BACKUP_MODO == "incremental":
+        archivador.iniciar()
+    iniciar_hilo(programar_backups, "backups")
+    # En modo incremental los checkpoints los hace el archivador del WAL
+    if PERFILES_DB[pool.perfil]["journal_mode"] == "WAL" and BACKUP_MODO != "incremental":
+        _detener_checkpoints.clear()
+        iniciar_hilo(programar_checkpoints, "checkpoints")
+    if ARCHIVO_DIAS > 0:
+        _detener_archivo.clear()
+        iniciar_hilo(programar_archivo, "archivo")
+
     # NO resetear comandas en producción
     # Comentar estas líneas cuando vayas a producción:
     # try:
-    #     con = db()
-    #     cur = con.cursor()
-    #     cur.execute("DELETE FROM order_items")
-    #     cur.execute("DELETE FROM orders")
-    #     cur.execute("DELETE FROM notas_generales")
-    #     con.commit()
-    #     con.close()
+    #     with db() as con:
+    #         con.execute("DELETE FROM order_items")
+    #         con.execute("DELETE FROM orders")
+    #         con.execute("DELETE FROM notas_generales")
     #     print("⚠️  Reset de comandas (MODO DESARROLLO)")
     # except Exception as e:
     #     print(f"WARN reset DB: {e}")
-    
+
     print("✅ Sistema listo")
 
+@app.on_event("shutdown")
+def on_shutdown():
+    _detener_backups.set()
+    _detener_checkpoints.set()
+    _detener_archivo.set()
+    # Esperar a que terminen lo que están haciendo (un backup, un ciclo del WAL,
+    # un lote de archivo) antes de cerrar el escritor y las conexiones que usan
+    for hilo in _hilos_fondo:
+        hilo.join(APAGADO_ESPERA)
+        if hilo.is_alive():
+            print(f"⚠️  El hilo {hilo.name} no terminó en {APAGADO_ESPERA:.0f}s")
+    _hilos_fondo.clear()
+    auditoria.detener()
+    escritor.detener()
+    pool.close()
+    if BACKUP_MODO == "incremental":
+        archivador.cerrar()
+
 # WEBSOCKET
-@app.websocket("/ws/kitchen")
-async def ws_kitchen(ws: WebSocket):
-    await hub.connect(ws, "kitchen")
+def parse_filtros(params) -> Dict[str, set]:
+    """Filtros de suscripción: ?estado=pendiente,listo&categoria=Postres"""
+    filtros = {}
+    for campo in ("estado", "categoria"):
+        valor = params.get(campo)
+        if valor:
+            filtros[campo] = {v.strip() for v in valor.split(",") if v.strip()}
+    return filtros
+
+@app.websocket("/ws/{topico}")
+async def ws_topico(ws: WebSocket, topico: str):
+    """Suscripción a un topic: /ws/kitchen, /ws/bar, /ws/cashier, /ws/admin, /ws/mesa:3, /ws/mozo:Lucas
+
+    El cliente puede cambiar sus filtros en vivo enviando
+    {"action": "filter", "estado": "listo", "categoria": "Postres"}.
+    """
+    if not topico_valido(topico):
+        await ws.close(code=1008)
+        return
+    cliente = await hub.connect(ws, topico, parse_filtros(ws.query_params))
     try:
         while True:
-            await ws.receive_text()
+            texto = await ws.receive_text()
+            try:
+                msg = json.loads(texto)
+            except ValueError:
+                continue
+            if isinstance(msg, dict) and msg.get("action") == "filter":
+                cliente.filtros = parse_filtros(msg)
     except WebSocketDisconnect:
-        hub.remove(ws, "kitchen")
+        hub.remove(ws, topico)
 
 # MIDDLEWARE NO CACHE
 @app.middleware("http")
 async def add_nocache_headers(request, call_next):
     response = await call_next(request)
     if request.url.path.startswith("/static/"):
-        response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
-        response.headers["Pragma"] = "no-cache"
+        # no-cache (no no-store): el navegador guarda el archivo pero revalida siempre
+        # con el ETag/Last-Modified de StaticFiles, que responde 304 si no cambió
+        response.headers["Cache-Control"] = "no-cache"
     return response
 
 # ESTÁTICOS
@@ -1430,9 +3218,9 @@ app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 @app.get("/")
 def root():
     return {
-        "ok": True, 
+        "ok": True,
         "app": "El Café de los Pinos",
-        "version": "2.0",
+        "version": "3.0",
         "endpoints": {
             "web": "/static/index.html",
             "docs": "/docs",
@@ -1440,4 +3228,4 @@ def root():
             "cocina": "/static/cocina.html",
             "admin": "/static/admin.html"
         }
-    }
\ No newline at end of file
+    }
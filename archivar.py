@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Mueve las comandas cerradas (cobradas o anuladas) más viejas que N días, con sus
+items, modificadores, descuentos y pagos, a una base por mes en archivo/
+(mozo_YYYY-MM.db); el audit_log de esa edad va al mismo archivo
+Con MOZO_ARCHIVO_DIAS > 0 el servidor lo corre solo todas las noches (MOZO_ARCHIVO_HORA);
+cada lote es su propia transacción, así que se puede correr con el servidor andando
+
+Uso:
+    python archivar.py                 # lo de más de MOZO_ARCHIVO_DIAS días (0 = apagado: pasar --dias)
+    python archivar.py --dias 180
+    python archivar.py --listar        # meses archivados
+"""
+import argparse
+import sys
+
+from fastapi import HTTPException
+
+from app import ARCHIVO_DIAS, ARCHIVO_LOTE, archivar_ordenes, listar_archivo
+
+def main():
+    parser = argparse.ArgumentParser(description="Archivo histórico de comandas de El Café de los Pinos")
+    parser.add_argument("--dias", type=int, default=ARCHIVO_DIAS, help="antigüedad mínima para archivar")
+    parser.add_argument("--lote", type=int, default=ARCHIVO_LOTE, help="comandas por transacción")
+    parser.add_argument("--listar", action="store_true", help="mostrar los meses archivados")
+    args = parser.parse_args()
+
+    if args.listar:
+        for m in listar_archivo()["meses"]:
+            tamanio = f"{m['bytes'] / 2**20:.1f} MB" if m["bytes"] is not None else "¡falta el archivo!"
+            print(f"{m['mes']}: {m['ordenes']} comandas, {m['auditoria']} registros de auditoría, {tamanio}")
+        return 0
+
+    try:
+        r = archivar_ordenes(args.dias, args.lote)
+    except HTTPException as e:
+        print(f"❌ {e.detail}")
+        return 1
+    print(f"✅ Antes de {r['corte']}: {r['ordenes']} comandas y {r['auditoria']} registros de auditoría "
+          f"archivados en {len(r['meses'])} meses en {r['segundos']:.2f}s")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+"""
+Benchmarks del backend sobre una base de datos sintética
+Nunca toca mozo.db: cada escenario trabaja en una base temporal
+
+Uso:
+    python benchmark.py orders [--ordenes 150] [--items 5]
+    python benchmark.py stats [--ordenes 55000] [--dias 365]
+    python benchmark.py search [--productos 30000]
+    python benchmark.py export [--ordenes 55000] [--dias 365]
+    python benchmark.py storage [--segundos 5] [--escritores 2] [--lectores 6]
+    python benchmark.py writes [--comandos 2000] [--clientes 8]
+    python benchmark.py archivo [--ordenes 55000] [--dias 365] [--archivar 90]
+"""
+import argparse
+import csv
+import io
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+# Importar app apuntando a una base temporal (init_db crea el esquema)
+_TMP = tempfile.mkdtemp(prefix="mozo_bench_")
+os.environ["MOZO_DB"] = os.path.join(_TMP, "bench.db")
+os.environ["MOZO_ARCHIVO_DIR"] = os.path.join(_TMP, "archivo")
+import app  # noqa: E402
+
+# Precios en centavos, como se guardan en la base
+PRODUCTOS = [("Café espresso", 150000), ("Café con leche", 180000), ("Capuccino", 220000),
+             ("Medialuna simple", 90000), ("Tostado completo", 400000), ("Milanesa napolitana", 650000),
+             ("Pizza muzzarella", 450000), ("Flan con dulce de leche", 280000), ("Limonada", 250000)]
+MODIFICADORES = [("Sin azúcar", 0), ("Extra shot café", 50000), ("Extra queso", 30000)]
+
+
+def sembrar(con, ordenes, items_por_orden, dias=1):
+    """Carga catálogo y comandas sintéticas repartidas en los últimos `dias` días"""
+    rnd = random.Random(42)
+    con.executemany("INSERT INTO tables(nombre) VALUES(?)", [(f"Mesa {i}",) for i in range(1, 21)])
+    con.executemany("INSERT INTO products(nombre, precio) VALUES(?,?)", PRODUCTOS)
+    con.executemany("INSERT INTO modifiers(nombre, precio_extra) VALUES(?,?)", MODIFICADORES)
+    ahora = time.time()
+    for n in range(ordenes):
+        ts = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(ahora - rnd.random() * dias * 86400))
+        cur = con.execute("""INSERT INTO orders(table_id, mozo_nombre, estado, ts, subtotal, total)
+                             VALUES(?,?,?,?,0,0)""",
+                          (rnd.randint(1, 20), rnd.choice(["Lucas", "Sofi", "Fabri"]),
+                           rnd.choice(["pendiente", "listo", "cobrado"]), ts))
+        order_id = cur.lastrowid
+        for _ in range(items_por_orden):
+            pid = rnd.randint(1, len(PRODUCTOS))
+            nombre, precio = PRODUCTOS[pid - 1]
+            cur = con.execute("""INSERT INTO order_items(order_id, product_id, product_nombre, product_precio, cantidad)
+                                 VALUES(?,?,?,?,?)""", (order_id, pid, nombre, precio, rnd.randint(1, 3)))
+            if rnd.random() < 0.5:
+                mid = rnd.randint(1, len(MODIFICADORES))
+                con.execute("""INSERT INTO order_item_modifiers(order_item_id, modifier_id, modifier_nombre, precio_extra)
+                               VALUES(?,?,?,?)""", (cur.lastrowid, mid, *MODIFICADORES[mid - 1]))
+    con.commit()
+
+
+def medir(fn, repeticiones):
+    """Devuelve (ms promedio, ms p95) de `fn`"""
+    tiempos = []
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        fn()
+        tiempos.append((time.perf_counter() - t0) * 1000)
+    tiempos.sort()
+    return statistics.mean(tiempos), tiempos[int(len(tiempos) * 0.95) - 1]
+
+
+def contar_consultas(con, fn):
+    """Cantidad de sentencias SQL que ejecuta `fn` sobre `con`"""
+    consultas = []
+    con.set_trace_callback(consultas.append)
+    try:
+        fn()
+    finally:
+        con.set_trace_callback(None)
+    return len(consultas)
+
+
+# --- Escenario: GET /orders ---
+def listar_ordenes_n1(con):
+    """Implementación anterior de list_orders: una consulta por orden y otra por item"""
+    rows = con.execute("""SELECT o.id, o.table_id, o.user_id, o.mozo_nombre, o.subtotal, o.descuento_total,
+                                 o.total, o.estado, o.anulada, o.pagado, o.ts, o.updated_at,
+                                 t.nombre AS mesa, u.nombre AS mozo
+                          FROM orders o
+                          LEFT JOIN tables t ON t.id=o.table_id
+                          LEFT JOIN users u ON u.id=o.user_id
+                          WHERE o.anulada=0 ORDER BY o.id DESC""").fetchall()
+    data = []
+    for r in rows:
+        items = con.execute("""SELECT oi.id, oi.product_nombre as nombre, oi.product_precio as precio,
+                                      oi.cantidad, oi.notas
+                               FROM order_items oi WHERE oi.order_id=?""", (r["id"],)).fetchall()
+        items_con_mods = []
+        for it in items:
+            mods = con.execute("""SELECT modifier_nombre, precio_extra FROM order_item_modifiers
+                                  WHERE order_item_id=?""", (it["id"],)).fetchall()
+            item_dict = dict(it)
+            item_dict["modifiers"] = [dict(m) for m in mods]
+            items_con_mods.append(item_dict)
+        order_dict = dict(r)
+        order_dict["mozo"] = r["mozo_nombre"] or (r["mozo"] if r["mozo"] else str(r["user_id"] or ""))
+        order_dict["items"] = items_con_mods
+        data.append(order_dict)
+    return data
+
+
+def bench_orders(args):
+    with app.db() as con:
+        sembrar(con, args.ordenes, args.items)
+
+        antes = listar_ordenes_n1(con)
+        for o in antes:  # la API devuelve los importes en pesos
+            for campo in ("subtotal", "descuento_total", "total"):
+                o[campo] = app.a_pesos(o[campo])
+            for it in o["items"]:
+                it["precio"] = app.a_pesos(it["precio"])
+                for m in it["modifiers"]:
+                    m["precio_extra"] = app.a_pesos(m["precio_extra"])
+        despues = app.cargar_ordenes(con, "o.anulada=?", (0,))
+        for o in despues:  # la categoría de cada item es un campo agregado después
+            for it in o["items"]:
+                del it["categoria"]
+        assert antes == despues, "el loader por lotes no devuelve lo mismo que la versión N+1"
+
+        print(f"GET /orders con {args.ordenes} comandas x {args.items} items")
+        print(f"{'versión':<12}{'consultas':>10}{'prom ms':>10}{'p95 ms':>10}")
+        for nombre, fn in [("N+1", lambda: listar_ordenes_n1(con)),
+                           ("por lotes", lambda: app.cargar_ordenes(con, "o.anulada=?", (0,)))]:
+            consultas = contar_consultas(con, fn)
+            prom, p95 = medir(fn, args.repeticiones)
+            print(f"{nombre:<12}{consultas:>10}{prom:>10.2f}{p95:>10.2f}")
+
+
+# --- Escenario: /stats/today y /export/orders sobre un año de comandas ---
+CONSULTAS_STATS_DATE = [
+    "SELECT SUM(total) as total FROM orders WHERE DATE(ts) = ? AND anulada=0",
+    "SELECT COUNT(*) as count FROM orders WHERE DATE(ts) = ? AND anulada=0",
+    """SELECT t.nombre as mesa, SUM(o.total) as total, COUNT(*) as comandas FROM orders o
+       LEFT JOIN tables t ON t.id=o.table_id WHERE DATE(o.ts) = ? AND o.anulada=0
+       GROUP BY o.table_id ORDER BY total DESC""",
+    """SELECT mozo_nombre as mozo, SUM(total) as total, COUNT(*) as comandas FROM orders
+       WHERE DATE(ts) = ? AND anulada=0 AND mozo_nombre IS NOT NULL GROUP BY mozo_nombre ORDER BY total DESC""",
+    """SELECT oi.product_nombre, SUM(oi.cantidad) as vendidos, SUM(oi.product_precio * oi.cantidad) as ingresos
+       FROM order_items oi JOIN orders o ON o.id = oi.order_id WHERE DATE(o.ts) = ? AND o.anulada=0
+       GROUP BY oi.product_nombre ORDER BY vendidos DESC LIMIT 10""",
+    "SELECT estado, COUNT(*) as count FROM orders WHERE DATE(ts) = ? AND anulada=0 GROUP BY estado",
+]
+EXPORT_DATE = """SELECT o.id, o.ts, t.nombre as mesa, o.mozo_nombre, o.subtotal, o.descuento_total, o.total,
+                        o.estado, o.anulada FROM orders o LEFT JOIN tables t ON t.id=o.table_id
+                 WHERE DATE(o.ts) = ? ORDER BY o.id"""
+
+
+def plan(con, sql, params):
+    return " | ".join(r["detail"] for r in con.execute("EXPLAIN QUERY PLAN " + sql, params))
+
+
+def bench_stats(args):
+    hoy = time.strftime("%Y-%m-%d", time.gmtime())
+    desde, hasta = app.rango_dia(hoy)
+    export_rango = EXPORT_DATE.replace("DATE(o.ts) = ?", "o.ts >= ? AND o.ts < ?")
+
+    with app.db() as con:
+        print(f"Sembrando {args.ordenes} comandas en {args.dias} días...")
+        sembrar(con, args.ordenes, 3, dias=args.dias)
+        con.execute("ANALYZE")
+        # Índice de expresión que usaba la versión anterior
+        con.execute("CREATE INDEX idx_orders_date ON orders(DATE(ts))")
+
+        def stats_date():
+            for sql in CONSULTAS_STATS_DATE:
+                con.execute(sql, (hoy,)).fetchall()
+
+        def stats_rango():
+            for sql in CONSULTAS_STATS_DATE:
+                sql = sql.replace("DATE(o.ts) = ?", "o.ts >= ? AND o.ts < ?").replace("DATE(ts) = ?", "ts >= ? AND ts < ?")
+                con.execute(sql, (desde, hasta)).fetchall()
+
+        print(f"Plan DATE(ts) = ?      : {plan(con, EXPORT_DATE, (hoy,))}")
+        print(f"Plan ts >= ? AND ts < ?: {plan(con, export_rango, (desde, hasta))}")
+        print(f"{'consulta':<28}{'prom ms':>10}{'p95 ms':>10}")
+        casos = [("stats DATE(ts)", stats_date),
+                 ("stats rango", stats_rango),
+                 ("export DATE(ts)", lambda: con.execute(EXPORT_DATE, (hoy,)).fetchall()),
+                 ("export rango", lambda: con.execute(export_rango, (desde, hasta)).fetchall())]
+        casos.insert(2, ("stats una pasada", lambda: app.calcular_stats_dia(con, hoy)))
+        casos.insert(3, ("stats cacheado", app.stats_today))
+        for nombre, fn in casos:
+            prom, p95 = medir(fn, args.repeticiones)
+            print(f"{nombre:<28}{prom:>10.2f}{p95:>10.2f}")
+
+        # Sin el índice de expresión DATE(ts) no es sargable: escanea todo orders
+        con.execute("DROP INDEX idx_orders_date")
+        for nombre, fn in (casos[0], casos[4]):
+            prom, p95 = medir(fn, max(1, args.repeticiones // 4))
+            print(f"{nombre + ' sin idx_date':<28}{prom:>10.2f}{p95:>10.2f}")
+
+
+# --- Escenario: GET /products?search= sobre un catálogo grande ---
+LIMITE_TYPEAHEAD = 20
+BUSQUEDAS = ["c", "ca", "caf", "cafe", "café con", "leche", "napo", "muzza", "tostado jamon", "zzz"]
+
+
+def bench_search(args):
+    rnd = random.Random(42)
+    bases = [n for n, _ in PRODUCTOS] + ["Tostado jamón y queso", "Ñoquis caseros", "Jugo de naranja"]
+    variantes = ["", " grande", " chico", " doble", " sin TACC", " vegano", " para llevar"]
+    with app.db() as con:
+        con.executemany("INSERT INTO products(nombre, precio) VALUES(?,?)",
+                        [(f"{rnd.choice(bases)}{rnd.choice(variantes)} #{n}", rnd.randint(50000, 900000))
+                         for n in range(args.productos)])
+    app.catalogo.cargar()
+    indice = app.catalogo.vigente()[0]["busqueda"]
+
+    print(f"Búsqueda en {args.productos} productos (índice con limit={LIMITE_TYPEAHEAD})")
+    print(f"{'término':<16}{'LIKE ms':>10}{'índice ms':>12}{'p95 ms':>10}{'resultados':>12}")
+    with app.db() as con:
+        for termino in BUSQUEDAS:
+            like, _ = medir(lambda: con.execute("SELECT id FROM products WHERE activo=1 AND nombre LIKE ?",
+                                                (f"%{termino}%",)).fetchall(), args.repeticiones)
+            prom, p95 = medir(lambda: indice.buscar(termino, LIMITE_TYPEAHEAD), args.repeticiones)
+            print(f"{termino:<16}{like:>10.2f}{prom:>12.2f}{p95:>10.2f}{len(indice.buscar(termino)):>12}")
+
+
+# --- Escenario: /export/orders de un año ---
+def export_en_memoria(con, desde, hasta):
+    """Implementación anterior: fetchall + StringIO con todo el CSV"""
+    rows = con.execute(app.EXPORTS[None][0], (desde, hasta)).fetchall()
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(app.CABECERA_ORDEN)
+    for r in rows:
+        writer.writerow([r['id'], r['ts'], r['mesa'], r['mozo_nombre'], r['subtotal'], r['descuento_total'],
+                         r['total'], r['estado'], 'SI' if r['anulada'] else 'NO'])
+    return [output.getvalue().encode()]
+
+
+def consumir(partes):
+    return sum(len(p) for p in partes)
+
+
+def bench_export(args):
+    with app.db() as con:
+        print(f"Sembrando {args.ordenes} comandas en {args.dias} días...")
+        sembrar(con, args.ordenes, 3, dias=args.dias)
+    desde, _ = app.rango_dia(time.strftime("%Y-%m-%d", time.gmtime(time.time() - args.dias * 86400)))
+    _, hasta = app.rango_dia(time.strftime("%Y-%m-%d", time.gmtime()))
+
+    def viejo():
+        with app.db() as con:
+            return export_en_memoria(con, desde, hasta)
+
+    casos = [("fetchall + StringIO", viejo),
+             ("streaming", lambda: app.filas_export(desde, hasta, None)),
+             ("streaming items", lambda: app.filas_export(desde, hasta, "items")),
+             ("streaming items gzip", lambda: app.comprimir(app.filas_export(desde, hasta, "items")))]
+    print(f"{'export':<24}{'seg':>8}{'MB pico':>10}{'MB salida':>12}")
+    for nombre, fn in casos:
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        tamanio = consumir(fn())
+        segundos = time.perf_counter() - t0
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{nombre:<24}{segundos:>8.2f}{pico / 2**20:>10.1f}{tamanio / 2**20:>12.1f}")
+
+
+# --- Escenario: archivo histórico de las órdenes viejas ---
+def bench_archivo(args):
+    with app.db() as con:
+        print(f"Sembrando {args.ordenes} comandas en {args.dias} días...")
+        sembrar(con, args.ordenes, 3, dias=args.dias)
+        # Lo de días anteriores ya está cobrado, como en un local de verdad
+        con.execute("UPDATE orders SET estado='cobrado' WHERE ts < date('now')")
+    _, hasta = app.rango_dia(time.strftime("%Y-%m-%d", time.gmtime()))
+    semana, _ = app.rango_dia(time.strftime("%Y-%m-%d", time.gmtime(time.time() - 7 * 86400)))
+    anio, _ = app.rango_dia(time.strftime("%Y-%m-%d", time.gmtime(time.time() - args.dias * 86400)))
+
+    def usados():
+        """MB ocupados de la base caliente (sin contar páginas libres)"""
+        with app.db() as con:
+            paginas, libres, tamanio = (con.execute(f"PRAGMA {p}").fetchone()[0]
+                                        for p in ("page_count", "freelist_count", "page_size"))
+        return (paginas - libres) * tamanio / 2**20
+
+    casos = [("export items 7 días", lambda: consumir(app.filas_export(semana, hasta, "items"))),
+             ("export items año", lambda: consumir(app.filas_export(anio, hasta, "items"))),
+             ("verificar totales", lambda: app.verificar_totales())]
+    antes = [medir(fn, args.repeticiones)[0] for _, fn in casos]
+    mb_antes = usados()
+    r = app.archivar_ordenes(args.archivar)
+    print(f"Archivadas {r['ordenes']} comandas en {len(r['meses'])} meses en {r['segundos']:.1f}s")
+    despues = [medir(fn, args.repeticiones)[0] for _, fn in casos]
+
+    print(f"{'':<22}{'antes':>10}{'después':>10}")
+    print(f"{'MB base caliente':<22}{mb_antes:>10.1f}{usados():>10.1f}")
+    for (nombre, _), a, d in zip(casos, antes, despues):
+        print(f"{nombre + ' ms':<22}{a:>10.1f}{d:>10.1f}")
+
+
+# --- Escenario: perfiles de almacenamiento con lectores y escritores concurrentes ---
+def bench_storage(args):
+    with app.db() as con:
+        sembrar(con, args.ordenes, 3)
+    perfiles = args.perfiles.split(",") if args.perfiles else list(app.PERFILES_DB)
+    print(f"{args.escritores} escritores + {args.lectores} lectores durante {args.segundos}s por perfil")
+    print(f"{'perfil':<14}{'commits/s':>11}{'escr p95 ms':>13}{'lecturas/s':>12}{'lect p95 ms':>13}{'MB wal':>8}")
+    for perfil in perfiles:
+        # Copia de la base sembrada para que todos los perfiles arranquen igual
+        path = os.path.join(_TMP, f"storage_{perfil}.db")
+        origen, destino = sqlite3.connect(app.DB), sqlite3.connect(path)
+        origen.backup(destino)
+        origen.close()
+        destino.close()
+
+        pool = app.ConnectionPool(path, args.escritores + args.lectores + 1, perfil)
+        fin = time.perf_counter() + args.segundos
+        escrituras, lecturas = [], []
+
+        def escritor(n):
+            rnd = random.Random(n)
+            while time.perf_counter() < fin:
+                t0 = time.perf_counter()
+                with pool.connection() as con:
+                    con.execute("BEGIN IMMEDIATE")
+                    cur = con.execute("""INSERT INTO orders(table_id, mozo_nombre, estado, subtotal, total)
+                                         VALUES(?, 'Lucas', 'pendiente', 0, 0)""", (rnd.randint(1, 20),))
+                    con.executemany("""INSERT INTO order_items(order_id, product_id, product_nombre, product_precio, cantidad)
+                                       VALUES(?,?,?,?,1)""",
+                                    [(cur.lastrowid, pid, *PRODUCTOS[pid - 1])
+                                     for pid in rnd.sample(range(1, len(PRODUCTOS) + 1), 3)])
+                escrituras.append((time.perf_counter() - t0) * 1000)
+
+        def lector():
+            while time.perf_counter() < fin:
+                t0 = time.perf_counter()
+                with pool.connection() as con:
+                    # La vista de cocina: las últimas comandas con sus items
+                    app.cargar_ordenes(con, "o.id > (SELECT MAX(id) - 50 FROM orders)", ())
+                lecturas.append((time.perf_counter() - t0) * 1000)
+
+        def checkpoints():
+            # Lo que hace programar_checkpoints en la app para perfiles sin autocheckpoint
+            while time.perf_counter() < fin:
+                time.sleep(1)
+                grande = os.path.getsize(path + "-wal") > app.CHECKPOINT_TRUNCAR_MB * 2**20
+                with pool.connection() as con:
+                    con.execute(f"PRAGMA wal_checkpoint({'TRUNCATE' if grande else 'PASSIVE'})")
+
+        hilos = [threading.Thread(target=escritor, args=(n,)) for n in range(args.escritores)]
+        hilos += [threading.Thread(target=lector) for _ in range(args.lectores)]
+        if app.PERFILES_DB[perfil]["journal_mode"] == "WAL" and app.PERFILES_DB[perfil]["wal_autocheckpoint"] == 0:
+            hilos.append(threading.Thread(target=checkpoints))
+        for h in hilos:
+            h.start()
+        for h in hilos:
+            h.join()
+        # Tamaño del WAL antes de cerrar: la última conexión hace checkpoint y lo borra
+        wal = os.path.getsize(path + "-wal") / 2**20 if os.path.exists(path + "-wal") else 0
+        pool.close()
+        p95 = lambda tiempos: sorted(tiempos)[int(len(tiempos) * 0.95) - 1] if tiempos else 0
+        print(f"{perfil:<14}{len(escrituras) / args.segundos:>11.0f}{p95(escrituras):>13.2f}"
+              f"{len(lecturas) / args.segundos:>12.0f}{p95(lecturas):>13.2f}{wal:>8.1f}")
+
+
+# --- Escenario: ráfaga de comandas, conexiones independientes vs escritor único ---
+def comanda(con, rnd):
+    """Lo que hace create_order: lee precios y después escribe la orden y sus items"""
+    pids = rnd.sample(range(1, len(PRODUCTOS) + 1), 3)
+    precios = {r["id"]: r for r in con.execute(
+        "SELECT id, nombre, precio FROM products WHERE id IN (?,?,?)", pids)}
+    cur = con.execute("INSERT INTO orders(table_id, mozo_nombre, estado) VALUES(?, 'Sofi', 'pendiente')",
+                      (rnd.randint(1, 20),))
+    con.executemany("""INSERT INTO order_items(order_id, product_id, product_nombre, product_precio, cantidad)
+                       VALUES(?,?,?,?,1)""",
+                    [(cur.lastrowid, pid, precios[pid]["nombre"], precios[pid]["precio"]) for pid in pids])
+    app.aplicar_delta_totales(con, cur.lastrowid, subtotal=sum(precios[pid]["precio"] for pid in pids))
+
+
+def bench_writes(args):
+    with app.db() as con:
+        sembrar(con, 100, 3)
+
+    def independiente(n):
+        # Cada cliente con su conexión y su transacción, como antes del escritor
+        with app.db() as con:
+            comanda(con, random.Random(n))
+
+    def por_escritor(n):
+        app.escritor.enviar(lambda con: comanda(con, random.Random(n))).result()
+
+    print(f"{args.comandos} comandas desde {args.clientes} clientes a la vez")
+    print(f"{'camino':<26}{'comandas/s':>12}{'errores lock':>14}{'commits':>9}")
+    for nombre, fn in [("conexiones independientes", independiente), ("escritor único", por_escritor)]:
+        if fn is por_escritor:
+            app.escritor.iniciar()
+        lotes_antes = app.escritor.metricas["lotes"]
+        errores = 0
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(args.clientes) as ejecutor:
+            for futuro in [ejecutor.submit(fn, n) for n in range(args.comandos)]:
+                try:
+                    futuro.result()
+                except sqlite3.OperationalError:
+                    errores += 1
+        segundos = time.perf_counter() - t0
+        commits = app.escritor.metricas["lotes"] - lotes_antes if fn is por_escritor else args.comandos - errores
+        app.escritor.detener()
+        print(f"{nombre:<26}{(args.comandos - errores) / segundos:>12.0f}{errores:>14}{commits:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de El Café de los Pinos")
+    sub = parser.add_subparsers(dest="escenario", required=True)
+
+    p = sub.add_parser("orders", help="N+1 vs carga por lotes en GET /orders")
+    p.add_argument("--ordenes", type=int, default=150)
+    p.add_argument("--items", type=int, default=5)
+    p.add_argument("--repeticiones", type=int, default=50)
+    p.set_defaults(fn=bench_orders)
+
+    p = sub.add_parser("stats", help="DATE(ts) vs rangos de fecha sobre un año de comandas")
+    p.add_argument("--ordenes", type=int, default=55000)
+    p.add_argument("--dias", type=int, default=365)
+    p.add_argument("--repeticiones", type=int, default=20)
+    p.set_defaults(fn=bench_stats)
+
+    p = sub.add_parser("search", help="LIKE '%%...%%' vs índice de prefijos en memoria")
+    p.add_argument("--productos", type=int, default=30000)
+    p.add_argument("--repeticiones", type=int, default=20)
+    p.set_defaults(fn=bench_search)
+
+    p = sub.add_parser("export", help="CSV en memoria vs streaming sobre un año de comandas")
+    p.add_argument("--ordenes", type=int, default=55000)
+    p.add_argument("--dias", type=int, default=365)
+    p.set_defaults(fn=bench_export)
+
+    p = sub.add_parser("storage", help="perfiles de almacenamiento (journal, synchronous, mmap) bajo carga mixta")
+    p.add_argument("--ordenes", type=int, default=2000)
+    p.add_argument("--segundos", type=float, default=5)
+    p.add_argument("--escritores", type=int, default=2)
+    p.add_argument("--lectores", type=int, default=6)
+    p.add_argument("--perfiles", help="lista separada por comas (default: todos)")
+    p.set_defaults(fn=bench_storage)
+
+    p = sub.add_parser("writes", help="ráfaga de comandas: conexiones independientes vs escritor con commit en grupo")
+    p.add_argument("--comandos", type=int, default=2000)
+    p.add_argument("--clientes", type=int, default=8)
+    p.set_defaults(fn=bench_writes)
+
+    p = sub.add_parser("archivo", help="base caliente y reportes antes y después de archivar lo viejo")
+    p.add_argument("--ordenes", type=int, default=55000)
+    p.add_argument("--dias", type=int, default=365)
+    p.add_argument("--archivar", type=int, default=90, help="antigüedad en días para archivar")
+    p.add_argument("--repeticiones", type=int, default=3)
+    p.set_defaults(fn=bench_archivo)
+
+    args = parser.parse_args()
+    args.fn(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+Export columnar (Parquet) de comandas, items, modificadores, descuentos y pagos
+Un archivo por tabla y por día; cada corrida agrega los días nuevos y reexporta
+los ya exportados que tuvieron órdenes modificadas desde la corrida anterior
+
+Requiere: pip install pyarrow
+
+Uso:
+    python exportar_parquet.py                         # días nuevos desde el último export
+    python exportar_parquet.py --desde 2025-01-01      # reexportar desde esa fecha
+    python exportar_parquet.py --destino /mnt/contador
+"""
+import argparse
+import time
+
+from fastapi import HTTPException
+
+from app import PARQUET_DIR, exportar_parquet
+
+def main():
+    parser = argparse.ArgumentParser(description="Export Parquet de El Café de los Pinos")
+    parser.add_argument("--desde", help="reexportar desde esta fecha (YYYY-MM-DD)")
+    parser.add_argument("--destino", default=PARQUET_DIR)
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    try:
+        r = exportar_parquet(args.destino, args.desde)
+    except HTTPException as e:
+        print(f"❌ {e.detail}")
+        return 1
+    print(f"✅ {r['dias']} días ({r['reexportados']} reexportados), {r['archivos']} archivos en {r['destino']} "
+          f"(hasta {r['ultimo_dia']}) en {time.perf_counter() - t0:.1f}s")
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""
+Regenera los resúmenes diarios (daily_sales, daily_table_sales,
+daily_waiter_sales, daily_product_sales) desde orders/order_items/payments
+
+Uso:
+    python reconstruir_resumenes.py                       # todo el historial
+    python reconstruir_resumenes.py 2025-01-01 2025-01-31 # sólo ese rango
+"""
+import sys
+import time
+
+from app import db, reconstruir_resumenes
+
+def main():
+    desde = sys.argv[1] if len(sys.argv) > 1 else None
+    hasta = sys.argv[2] if len(sys.argv) > 2 else desde
+
+    t0 = time.perf_counter()
+    with db() as con:
+        reconstruir_resumenes(con, desde, hasta)
+        dias = con.execute("SELECT COUNT(*) FROM daily_sales").fetchone()[0]
+    print(f"✅ Resúmenes regenerados ({desde or 'inicio'} → {hasta or 'hoy'}): "
+          f"{dias} días en {time.perf_counter() - t0:.2f}s")
+
+if __name__ == "__main__":
+    main()
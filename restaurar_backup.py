@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Restaura la base desde el backup incremental (MOZO_BACKUP_MODO=incremental)
+Toma el snapshot de la cadena que corresponda y le aplica los segmentos del WAL
+archivados hasta el momento pedido. No toca mozo.db: escribe en --destino
+
+Uso:
+    python restaurar_backup.py --listar
+    python restaurar_backup.py --destino restaurada.db                            # lo último archivado
+    python restaurar_backup.py --destino restaurada.db --hasta "2025-10-05 14:30:00"  # hora UTC
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import struct
+import sys
+from datetime import datetime
+
+WAL_DIR = os.path.join("backups", "wal")
+WAL_FRAME = struct.Struct(">IIIIII")  # página, tamaño de la base si es commit (si no 0), salt1, salt2, checksum x2
+
+def cadenas(directorio):
+    """[(cadena, metadatos, [(fecha, archivo de segmento)])] de la más vieja a la más nueva"""
+    resultado = []
+    for nombre in sorted(os.listdir(directorio)):
+        meta_path = os.path.join(directorio, nombre, "base.json")
+        if not os.path.exists(meta_path):
+            continue
+        with open(meta_path) as f:
+            meta = json.load(f)
+        segmentos = []
+        for archivo in sorted(os.listdir(os.path.join(directorio, nombre))):
+            if archivo.endswith(".wal"):
+                fecha = datetime.strptime(archivo[:-4].split("_", 1)[1], "%Y%m%dT%H%M%S")
+                segmentos.append((fecha, os.path.join(directorio, nombre, archivo)))
+        resultado.append((nombre, meta, segmentos))
+    return resultado
+
+def aplicar_segmento(db, path, page_size):
+    """Escribe las páginas de cada transacción del segmento; ajusta el tamaño en cada commit"""
+    tam_frame = WAL_FRAME.size + page_size
+    paginas = {}
+    with open(path, "rb") as f:
+        while True:
+            frame = f.read(tam_frame)
+            if len(frame) < tam_frame:
+                break
+            pagina, commit, _, _, _, _ = WAL_FRAME.unpack_from(frame)
+            paginas[pagina] = frame[WAL_FRAME.size:]
+            if commit:
+                for numero, datos in sorted(paginas.items()):
+                    db.seek((numero - 1) * page_size)
+                    db.write(datos)
+                db.truncate(commit * page_size)
+                paginas = {}
+
+def main():
+    parser = argparse.ArgumentParser(description="Restaurar backup incremental de El Café de los Pinos")
+    parser.add_argument("--dir", default=WAL_DIR)
+    parser.add_argument("--destino", help="archivo a crear con la base restaurada")
+    parser.add_argument("--hasta", help="momento a restaurar, 'YYYY-MM-DD HH:MM:SS' en UTC (default: lo último)")
+    parser.add_argument("--listar", action="store_true", help="mostrar cadenas y segmentos disponibles")
+    args = parser.parse_args()
+
+    disponibles = cadenas(args.dir) if os.path.isdir(args.dir) else []
+    if not disponibles:
+        print(f"❌ No hay backups incrementales en {args.dir}")
+        return 1
+
+    if args.listar:
+        for nombre, meta, segmentos in disponibles:
+            desde = meta["creada"][:19].replace("T", " ")
+            hasta = segmentos[-1][0] if segmentos else desde
+            print(f"{nombre}: snapshot {desde}, {len(segmentos)} segmentos, hasta {hasta}")
+        return 0
+
+    if not args.destino:
+        parser.error("falta --destino")
+    if os.path.exists(args.destino):
+        print(f"❌ {args.destino} ya existe")
+        return 1
+    hasta = datetime.strptime(args.hasta, "%Y-%m-%d %H:%M:%S") if args.hasta else datetime.max
+
+    # La cadena más nueva cuyo snapshot es anterior al momento pedido
+    candidatas = [c for c in disponibles if datetime.fromisoformat(c[1]["creada"]) <= hasta]
+    if not candidatas:
+        print(f"❌ No hay snapshots anteriores a {args.hasta}")
+        return 1
+    nombre, meta, segmentos = candidatas[-1]
+    aplicar = [path for fecha, path in segmentos if fecha <= hasta]
+
+    tmp = args.destino + ".tmp"
+    shutil.copyfile(os.path.join(args.dir, nombre, "base.db"), tmp)
+    with open(tmp, "r+b") as db:
+        for path in aplicar:
+            aplicar_segmento(db, path, meta["page_size"])
+
+    con = sqlite3.connect(tmp)
+    try:
+        # Las páginas vienen de una base en WAL: dejar la restaurada como archivo único
+        con.execute("PRAGMA journal_mode = DELETE")
+        integridad = con.execute("PRAGMA integrity_check").fetchone()[0]
+        ordenes = con.execute("SELECT COUNT(*), MAX(ts) FROM orders").fetchone()
+    finally:
+        con.close()
+    if integridad != "ok":
+        os.remove(tmp)
+        print(f"❌ La base restaurada no pasó integrity_check: {integridad}")
+        return 1
+    os.replace(tmp, args.destino)
+    print(f"✅ {args.destino}: snapshot {nombre} + {len(aplicar)} segmentos "
+          f"({ordenes[0]} comandas, última {ordenes[1]})")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
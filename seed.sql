@@ -37,50 +37,51 @@ INSERT INTO categories(id, nombre, orden) VALUES
  (5, 'Postres', 5);
 
 -- Productos de ejemplo (AJUSTA SEGÚN TU MENÚ REAL)
+-- Precios en centavos: 150000 = $1500
 -- Bebidas Calientes
 INSERT INTO products(nombre, precio, category_id, activo) VALUES
- ('Café espresso', 1500, 1, 1),
- ('Café con leche', 1800, 1, 1),
- ('Capuccino', 2200, 1, 1),
- ('Té negro', 1400, 1, 1),
- ('Té verde', 1400, 1, 1),
- ('Chocolate caliente', 2500, 1, 1);
+ ('Café espresso', 150000, 1, 1),
+ ('Café con leche', 180000, 1, 1),
+ ('Capuccino', 220000, 1, 1),
+ ('Té negro', 140000, 1, 1),
+ ('Té verde', 140000, 1, 1),
+ ('Chocolate caliente', 250000, 1, 1);
 
 -- Bebidas Frías
 INSERT INTO products(nombre, precio, category_id, activo) VALUES
- ('Coca-Cola 500ml', 2000, 2, 1),
- ('Sprite 500ml', 2000, 2, 1),
- ('Agua mineral 500ml', 1500, 2, 1),
- ('Jugo de naranja natural', 2800, 2, 1),
- ('Limonada', 2500, 2, 1),
- ('Cerveza Quilmes', 3000, 2, 1);
+ ('Coca-Cola 500ml', 200000, 2, 1),
+ ('Sprite 500ml', 200000, 2, 1),
+ ('Agua mineral 500ml', 150000, 2, 1),
+ ('Jugo de naranja natural', 280000, 2, 1),
+ ('Limonada', 250000, 2, 1),
+ ('Cerveza Quilmes', 300000, 2, 1);
 
 -- Desayunos y Meriendas
 INSERT INTO products(nombre, precio, category_id, activo) VALUES
- ('Medialuna simple', 900, 3, 1),
- ('Medialuna c/dulce de leche', 1200, 3, 1),
- ('Tostado jamón y queso', 3500, 3, 1),
- ('Tostado completo', 4000, 3, 1),
- ('Panqueques c/dulce de leche', 3800, 3, 1);
+ ('Medialuna simple', 90000, 3, 1),
+ ('Medialuna c/dulce de leche', 120000, 3, 1),
+ ('Tostado jamón y queso', 350000, 3, 1),
+ ('Tostado completo', 400000, 3, 1),
+ ('Panqueques c/dulce de leche', 380000, 3, 1);
 
 -- Comidas
 INSERT INTO products(nombre, precio, category_id, activo) VALUES
- ('Milanesa napolitana', 6500, 4, 1),
- ('Hamburguesa completa', 5500, 4, 1),
- ('Pizza muzzarella', 4500, 4, 1),
- ('Ensalada César', 4800, 4, 1),
- ('Papas fritas', 3000, 4, 1);
+ ('Milanesa napolitana', 650000, 4, 1),
+ ('Hamburguesa completa', 550000, 4, 1),
+ ('Pizza muzzarella', 450000, 4, 1),
+ ('Ensalada César', 480000, 4, 1),
+ ('Papas fritas', 300000, 4, 1);
 
 -- Postres
 INSERT INTO products(nombre, precio, category_id, activo) VALUES
- ('Flan con dulce de leche', 2800, 5, 1),
- ('Tiramisú', 3500, 5, 1),
- ('Helado 2 bochas', 2500, 5, 1),
- ('Brownie c/helado', 3800, 5, 1);
+ ('Flan con dulce de leche', 280000, 5, 1),
+ ('Tiramisú', 350000, 5, 1),
+ ('Helado 2 bochas', 250000, 5, 1),
+ ('Brownie c/helado', 380000, 5, 1);
 
 -- NOTAS:
 -- 1. Este archivo es solo un EJEMPLO con precios y productos ficticios
 -- 2. DEBES modificar las categorías y productos según tu menú real
--- 3. Los precios son orientativos (en pesos argentinos)
+-- 3. Los precios son orientativos (en centavos de peso argentino: 150000 = $1500)
 -- 4. Para cargar este archivo: sqlite3 mozo.db < seed.sql
 -- 5. O copia/pega el contenido en un cliente SQL
\ No newline at end of file
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Verifica que subtotal, descuento y total guardados en cada orden coincidan con
+sus items, modificadores y descuentos (los endpoints los mantienen por deltas)
+Recorre las órdenes en lotes; con --reparar cada lote se corrige en su propia
+transacción, así que se puede correr con el servidor andando
+
+Uso:
+    python verificar_totales.py                                   # todo el historial, sólo informa
+    python verificar_totales.py --desde 2025-01-01 --hasta 2025-01-31
+    python verificar_totales.py --reparar                         # reescribe las que no coinciden
+"""
+import argparse
+import sys
+
+from fastapi import HTTPException
+
+from app import TOTALES_LOTE, verificar_totales
+
+def main():
+    parser = argparse.ArgumentParser(description="Verificar totales de comandas de El Café de los Pinos")
+    parser.add_argument("--desde", help="primer día (YYYY-MM-DD)")
+    parser.add_argument("--hasta", help="último día, inclusive (YYYY-MM-DD)")
+    parser.add_argument("--reparar", action="store_true", help="reescribir las órdenes con diferencias")
+    parser.add_argument("--lote", type=int, default=TOTALES_LOTE, help="órdenes por transacción")
+    args = parser.parse_args()
+
+    try:
+        r = verificar_totales(args.desde, args.hasta, args.reparar, args.lote, ejemplos=20)
+    except HTTPException as e:
+        print(f"❌ {e.detail}")
+        return 1
+    for d in r["ejemplos"]:
+        print(f"  orden {d['id']} ({d['fecha']}): guardado {d['subtotal_guardado']:.2f} / "
+              f"{d['descuento_guardado']:.2f} / {d['total_guardado']:.2f}, "
+              f"calculado {d['subtotal']:.2f} / {d['descuento_total']:.2f} / {d['total']:.2f}")
+    if r["con_diferencias"] > len(r["ejemplos"]):
+        print(f"  ... y {r['con_diferencias'] - len(r['ejemplos'])} más")
+    print(f"{'✅' if not r['con_diferencias'] or args.reparar else '⚠️'} {r['revisadas']} órdenes revisadas "
+          f"en {r['lotes']} lotes, {r['con_diferencias']} con diferencias, {r['reparadas']} reparadas "
+          f"en {r['segundos']:.2f}s")
+    return 1 if r["con_diferencias"] and not args.reparar else 0
+
+if __name__ == "__main__":
+    sys.exit(main())